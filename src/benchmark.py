@@ -0,0 +1,230 @@
+"""
+End-to-end benchmark of OneTMY on synthetic data
+(see synthetic.py)
+
+For each data size (number of years), a station's
+synthetic files are written once and kept, and
+processStation is run twice: cold (without the
+gap-filled month cache and the solar zenith cache)
+and warm (with them). The wall time, CPU time and
+memory of every stage (see instrument.py) and of
+the whole station are appended to a results file,
+together with the git commit, so runs of different
+commits can be compared:
+
+python benchmark.py [--years 10 20] [--directory ../benchmark]
+python benchmark.py --compare [<commit> [<commit>]]
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import platform
+import subprocess
+import numpy as np
+import pandas as pd
+
+from config_parse import CONFIG
+
+import instrument
+import synthetic
+import onetmy
+
+FIRST_YEAR = 2000
+
+def gitCommit():
+    """
+    Returns the commit of the working tree, and
+    whether it has uncommitted changes (None, None
+    outside a git repository)
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+            capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status)
+
+def dataset(directory, station, years, options):
+    """
+    Source folder of the synthetic files of a
+    station and number of years, written first if
+    they aren't there yet (or were written with
+    other options)
+
+    options - keyword arguments of
+        synthetic.generate
+    """
+    source = os.path.join(directory, 'data', '{}_{}y'.format(station, years))
+    marker = os.path.join(source, 'synthetic.json')
+    wanted = dict(options, station=station, years=years)
+    if os.path.exists(marker):
+        with open(marker, 'r') as f:
+            if json.load(f)==wanted:
+                return os.path.join(source, station)
+        shutil.rmtree(source)
+
+    logging.info('Writing %d years of synthetic data of station %s', years, station)
+    synthetic.generate(source, [station], range(FIRST_YEAR, FIRST_YEAR+years), **options)
+    with open(marker, 'w') as f:
+        json.dump(wanted, f)
+    return os.path.join(source, station)
+
+def runStation(directory, station, years, source, cold):
+    """
+    Runs processStation on a synthetic dataset
+    Returns the result record
+    """
+    name = '{}_{}y'.format(station, years)
+    preprocesspath = os.path.join(directory, 'filtered', name)
+    solar_cache = os.path.join(directory, 'solar_cache')
+    outpath = os.path.join(directory, 'out', name+'_TMY.csv')
+    if cold:
+        shutil.rmtree(preprocesspath, ignore_errors=True)
+        shutil.rmtree(solar_cache, ignore_errors=True)
+    os.makedirs(preprocesspath, exist_ok=True)
+    CONFIG['processing']['solar-cache'] = dict(CONFIG['processing'].get('solar-cache') or {}, directory=solar_cache)
+
+    instrument.reset(station)
+    start = time.perf_counter()
+    cpu = time.process_time()
+    success = onetmy.processStation(station, source, CONFIG['folders']['pattern'], outpath, preprocesspath)
+    return {
+        'station': station,
+        'years': years,
+        'run': 'cold' if cold else 'warm',
+        'success': bool(success),
+        'wall-s': time.perf_counter()-start,
+        'cpu-s': time.process_time()-cpu,
+        'peak-mb': None if instrument.peakRss() is None else instrument.peakRss()/1024**2,
+        'stages': instrument.summarise(instrument.records()),
+    }
+
+def run(directory, station, sizes, options, results_path, month_workers=1):
+    """
+    Benchmarks a station at several sizes (numbers
+    of years), and appends the results to the
+    results file
+    Returns the list of results
+    """
+
+    # Same settings for every commit
+    CONFIG['processing'] = dict(CONFIG.get('processing') or {})
+    CONFIG['processing']['month-workers'] = month_workers
+    CONFIG['processing']['instrument'] = {'enabled': True, 'memory': 'rss'}
+    CONFIG['tmy']['min-years'] = min(CONFIG['tmy']['min-years'], min(sizes))
+
+    commit, dirty = gitCommit()
+    common = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'options': options,
+    }
+
+    results = []
+    for years in sizes:
+        source = dataset(directory, station, years, options)
+        for cold in [True, False]:
+            result = dict(common, **runStation(directory, station, years, source, cold))
+            logging.info('%d years, %s: %.1fs', years, result['run'], result['wall-s'])
+            results.append(result)
+            with open(results_path, 'a') as f:
+                f.write(json.dumps(result)+'\n')
+    return results
+
+def load(results_path):
+    """
+    Reads the results file. Returns a list of
+    results, oldest first
+    """
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare(results, before=None, after=None):
+    """
+    Compares the results of two commits (by
+    default the last two commits in the results,
+    or before and the last other commit).
+    The latest result of each size and run is used
+    Returns the lines of the comparison
+    """
+
+    commits = list(dict.fromkeys(r['commit'] for r in results))
+    if after is None:
+        later = [c for c in commits if c!=before]
+        after = later[-1] if later else None
+    if before is None:
+        earlier = [c for c in commits if c!=after]
+        before = earlier[-1] if earlier else None
+    if before is None or after is None:
+        return ['Need results of two commits to compare']
+
+    latest = {}
+    for r in results:
+        latest[r['commit'], r['station'], r['years'], r['run']] = r
+
+    lines = ['{} -> {}'.format(before, after)]
+    for (commit, station, years, run), new in latest.items():
+        if commit!=after or (before, station, years, run) not in latest:
+            continue
+        old = latest[before, station, years, run]
+        lines.append('{} {} years, {}: {:.1f}s -> {:.1f}s ({:+.0%})'.format(station, years, run,
+            old['wall-s'], new['wall-s'], new['wall-s']/old['wall-s']-1))
+        for stage, figures in new['stages'].items():
+            if stage in old['stages'] and old['stages'][stage]['wall-s']>0:
+                change = figures['wall-s']/old['stages'][stage]['wall-s']-1
+                lines.append('\t{:<18}{:8.2f}s -> {:8.2f}s ({:+.0%})'.format(stage,
+                    old['stages'][stage]['wall-s'], figures['wall-s'], change))
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks OneTMY on synthetic data')
+    parser.add_argument('--directory', default='../benchmark', help='folder for the synthetic data, the caches and the results')
+    parser.add_argument('--station', default=list(CONFIG['stations'])[0], help='station from config.yml (default: the first one)')
+    parser.add_argument('--years', nargs='+', type=int, default=[10, 20], help='data sizes in years (at least 10)')
+    parser.add_argument('--results', help='results file (default: results.jsonl in the directory)')
+    parser.add_argument('--month-workers', type=int, default=1)
+    parser.add_argument('--gaps', choices=synthetic.GAP_PATTERNS, default='mixed')
+    parser.add_argument('--flag-rate', type=float, default=0.01)
+    parser.add_argument('--files-per-month', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', nargs='*', metavar='COMMIT', help='compare the results of two commits instead (default: the last two)')
+    args = parser.parse_args(argv)
+
+    results_path = args.results or os.path.join(args.directory, 'results.jsonl')
+    if args.compare is not None:
+        if len(args.compare)>2:
+            parser.error('--compare takes at most two commits')
+        commits = list(args.compare)+[None]*(2-len(args.compare))
+        print('\n'.join(compare(load(results_path), *commits)))
+        return
+
+    if min(args.years)<10:
+        parser.error('Every calendar month needs at least ten years')
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+    os.makedirs(args.directory, exist_ok=True)
+    options = {'gaps': args.gaps, 'flag_rate': args.flag_rate, 'files_per_month': args.files_per_month, 'seed': args.seed}
+    results = run(args.directory, args.station, args.years, options, results_path, args.month_workers)
+    for result in results:
+        print('{} {} years, {}: {:.1f}s, peak {:.0f} MB{}'.format(result['station'], result['years'],
+            result['run'], result['wall-s'], result['peak-mb'] or 0, '' if result['success'] else ' (failed)'))
+    print('Results appended to '+results_path)
+
+if __name__=='__main__':
+    main()
@@ -2,9 +2,168 @@
 Reads the configuration file config.yml
 so that other modules can access the
 configuration quickly
+
+The file is only read when the configuration is
+first used, so importing a module is cheap. It is
+config.yml in the working directory, unless
+another file is set with load() (or the
+ONETMY_CONFIG environment variable, which load()
+also sets so worker processes read the same file)
 """
 
+import os
 import yaml
+import logging
+import importlib.util
+
+DEFAULT_PATH = 'config.yml'
+ENVIRONMENT_VARIABLE = 'ONETMY_CONFIG'
+
+class LazyDict(dict):
+    """
+    A dictionary that is filled by loader the first
+    time it is used
+    """
+
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+        self.loaded = False
+
+    def ensure(self):
+        if not self.loaded:
+            self.loaded = True
+            super().update(self.loader())
+
+    def reset(self):
+        """
+        Empties the dictionary, so it is filled
+        again when it is next used
+        """
+        super().clear()
+        self.loaded = False
+
+    def __getitem__(self, key):
+        self.ensure()
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self.ensure()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.ensure()
+        super().__delitem__(key)
+
+    def __contains__(self, key):
+        self.ensure()
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self.ensure()
+        return super().__iter__()
+
+    def __len__(self):
+        self.ensure()
+        return super().__len__()
+
+    def __repr__(self):
+        self.ensure()
+        return super().__repr__()
+
+    def __eq__(self, other):
+        self.ensure()
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __copy__(self):
+        self.ensure()
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        import copy
+        self.ensure()
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        self.ensure()
+        return (dict, (dict(self),))
+
+    def get(self, key, default=None):
+        self.ensure()
+        return super().get(key, default)
+
+    def keys(self):
+        self.ensure()
+        return super().keys()
+
+    def values(self):
+        self.ensure()
+        return super().values()
+
+    def items(self):
+        self.ensure()
+        return super().items()
+
+    def copy(self):
+        self.ensure()
+        return dict(self)
+
+    def setdefault(self, key, default=None):
+        self.ensure()
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self.ensure()
+        return super().pop(*args)
+
+    def update(self, *args, **kwargs):
+        self.ensure()
+        super().update(*args, **kwargs)
+
+    def clear(self):
+        self.loaded = True
+        super().clear()
+
+def path():
+    """
+    Path of the configuration file
+    """
+    return os.environ.get(ENVIRONMENT_VARIABLE) or DEFAULT_PATH
+
+def readConfig():
+    with open(path(), 'r') as ymlfile:
+        return yaml.load(ymlfile, Loader=yaml.Loader)
+
+def load(config_path=None):
+    """
+    Reads the configuration from another file
+    (config.yml in the working directory if None).
+    Everything derived from the configuration is
+    made again when it is next used
+    Returns CONFIG
+    """
+    if config_path is None:
+        os.environ.pop(ENVIRONMENT_VARIABLE, None)
+    else:
+        os.environ[ENVIRONMENT_VARIABLE] = os.path.abspath(config_path)
+    CONFIG.reset()
+    HEADER_MAP.reset()
+    for callback in _on_load:
+        callback()
+    return CONFIG
+
+_on_load = []
+
+def onLoad(callback):
+    """
+    Registers a function that is called when the
+    configuration is read from another file (e.g.
+    to clear caches of values derived from it)
+    """
+    _on_load.append(callback)
+    return callback
 
 def timeHeaderMap():
     """
@@ -35,14 +194,53 @@ def makeHeaderMap():
     """
     return {**timeHeaderMap(), **weatherHeaderMap(), **solarHeaderMap()}
 
+def timeFormats():
+    """
+    List of time formats (utc, lst, lt etc.)
+    """
+    return list(CONFIG['time'].keys())
 
-# Load the configuration file
-path = 'config.yml'
-with open(path, 'r') as ymlfile:
-    CONFIG = yaml.load(ymlfile, Loader=yaml.Loader)
+def stationPaths(station):
+    """
+    Returns the source folder, file pattern, TMY
+    output path and gap-filled data folder for a
+    station, as defined in the folders block
+    """
+    indir = os.path.normpath(CONFIG['folders']['source'] + '/' + station + '/')
+    pattern = CONFIG['folders']['pattern']
+    outpath = os.path.normpath(CONFIG['folders']['destination-tmy'].format(station))
+    preprocesspath = os.path.normpath(CONFIG['folders']['destination-filtered'] + '/' + station + '/')
+    return indir, pattern, outpath, preprocesspath
 
-# Dictionary of old headers -> new headers
-HEADER_MAP = makeHeaderMap()
+def csvEngine():
+    """
+    Parser engine for the data files, as set by
+    csv-engine in the processing block of
+    config.yml: c, pyarrow or auto (pyarrow if it
+    is installed)
+    """
+    processing = CONFIG.get('processing') or {}
+    engine = processing.get('csv-engine') or 'c'
+    if engine in ['pyarrow', 'auto']:
+        if importlib.util.find_spec('pyarrow') is not None:
+            return 'pyarrow'
+        if engine=='pyarrow':
+            logging.warning('pyarrow is not installed. Using the c parser')
+    return 'c'
 
-# List of time formats (utc, lst, lt etc.)
-TIME_FORMATS = list(CONFIG['time'].keys())
+def measurementDtype():
+    """
+    dtype of the measurements, as set by
+    measurement-dtype in the processing block of
+    config.yml (default float64)
+    """
+    processing = CONFIG.get('processing') or {}
+    return processing.get('measurement-dtype') or 'float64'
+
+
+# The configuration, read from the configuration
+# file when it is first used
+CONFIG = LazyDict(readConfig)
+
+# Dictionary of old headers -> new headers
+HEADER_MAP = LazyDict(makeHeaderMap)
@@ -1,20 +1,23 @@
 import datetime
-from pvlib import solarposition
 import pytz
 import pandas as pd
 import numpy as np
 import logging
 
 from config_parse import CONFIG
+import solarcache
+import instrument
 
 def logicalfill(df, lat, lon, zenith_limit=96):
 	"""
 	'Logically fills' a dataframe's
 	irradiance columns. Does this inplace
+	The solar zenith is taken from the solar
+	cache (see solarcache.py)
 	"""
 
 	#df[['mean-ghi', 'mean-dni', 'mean-dhi']].apply(remedy, axis=1, lat=lat, lon=lon, zenith_limit=zenith_limit)
-	solpos = solarposition.get_solarposition(df.index, lat, lon)
+	solpos = solarcache.zenith(df.index, lat, lon).to_frame()
 	
 	logging.debug("Number of invalid values: {}".format(df.isna()[['mean-ghi', 'mean-dni', 'mean-dhi']].sum()))
 	
@@ -52,7 +55,8 @@ def fill(df, station, data_requirement=0.9):
 
 	# Logical fill the solar columns
 	logging.debug('Logical filling')
-	df = logicalfill(df, lat, lon)
+	with instrument.stage('fill.logicalfill', len(df)):
+		df = logicalfill(df, lat, lon)
 
 	# If the percentage of missing data is
 	# unacceptable, quit now
@@ -65,7 +69,8 @@ def fill(df, station, data_requirement=0.9):
 
 	# Interpolate column gaps of up to 60 minutes
 	logging.debug('Interpolating small gaps')
-	df.interpolate(axis=0, limit=60, inplace=True)
+	with instrument.stage('interpolate', len(df)):
+		df.interpolate(axis=0, limit=60, inplace=True)
 	
 	perc_missing = df.isnull().sum()/len(df)
 	perc_missing = perc_missing.mean()
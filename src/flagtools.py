@@ -4,52 +4,91 @@ data files
 """
 
 import logging
+import numpy as np
+import pandas as pd
+
+from config_parse import CONFIG
+
+def acceptedFlags(dataColumn):
+    """
+    Returns the flag values that are accepted for
+    a data column. These are set in the flags block
+    of config.yml, for all columns (accepted) or per
+    column (columns). Defaults to ['Y']
+    """
+    flags = CONFIG.get('flags') or {}
+    columns = flags.get('columns') or {}
+    if dataColumn in columns:
+        return list(columns[dataColumn])
+    return list(flags.get('accepted') or ['Y'])
 
 def convert(df):
     """
     Converts all columns with '-flag' in
     their header into boolean flags (often
     they're strings like 'Y', 'N', 'X')
-    See flagMap if you want to modify this to
-    convert different types of flags
+    A flag is True if its value is one of the
+    accepted flags of its data column (see
+    acceptedFlags)
     """
 
     logging.debug('Converting to binary flags')
 
     flagColumns = [x for x in list(df) if '-flag' in x]
     for flagColumn in flagColumns:
-        df[flagColumn] = df[flagColumn].apply(map)
-
-def map(x):
-    """
-    Converts a column of flags (possibly a set of
-    charcaters) into boolean values
-    flagColumn is the name of the column you want to convert
-    """
-    if x=='Y': return True
-    else: return False
+        df[flagColumn] = df[flagColumn].isin(acceptedFlags(flagColumn[:-5])).values
 
 def maskData(df):
     """
     Goes through data-flag column pairs and
     deletes data values with unacceptable flag
     values
+    The flags are combined into one mask matrix
+    that is applied to all data columns at once
+    Returns a dictionary of data column -> fraction
+    of its values that were masked
     """
 
     logging.debug('Masking against flags')
 
-    flagColumns = [x for x in list(df) if '-flag' in x]
+    flagColumns = [x for x in list(df) if '-flag' in x and x[:-5] in df]
     dataColumns = [x[:-5] for x in flagColumns]
-    for i in range(0, len(flagColumns)):
-        dataColumn = dataColumns[i]
-        flagColumn = flagColumns[i]
-        # .mask replaces each index with flag TRUE with
-        # NaN by default. Hence we negate the flag column
-        if not df[flagColumn].empty:
-            df[dataColumn] = df[dataColumn].mask(~df[flagColumn])
-        else:
-            # Flag column corrupt, assume all correct
-            logging.warning('Flag column empty. Assuming all flags positive')
+    if not flagColumns:
+        return {}
+
+    if df.empty:
+        # Flag column corrupt, assume all correct
+        logging.warning('Flag column empty. Assuming all flags positive')
+        return {x: 0.0 for x in dataColumns}
+
+    # One row per observation, one column per
+    # data-flag pair. True where the value has to
+    # be deleted
+    mask = ~df[flagColumns].to_numpy(dtype=bool)
+    masked = mask.sum(axis=0)
+
+    # Numeric data columns are masked in one go
+    numeric = [i for i, x in enumerate(dataColumns) if pd.api.types.is_numeric_dtype(df[x])]
+    if numeric:
+        columns = [dataColumns[i] for i in numeric]
+        dtypes = df[columns].dtypes
+        values = df[columns].to_numpy(dtype=np.float64)
+        values[mask[:, numeric]] = np.nan
+        for j, i in enumerate(numeric):
+            dataColumn = dataColumns[i]
+            column = values[:, j]
+            # Columns with nothing masked, and float
+            # columns, keep their dtype (as .mask does)
+            if masked[i]==0 or pd.api.types.is_float_dtype(dtypes[dataColumn]):
+                column = column.astype(dtypes[dataColumn])
+            df[dataColumn] = column
+
+    # Anything else (e.g. text) one column at a time
+    for i, dataColumn in enumerate(dataColumns):
+        if i not in numeric:
+            df[dataColumn] = df[dataColumn].mask(mask[:, i])
+
+    return {x: float(masked[i])/len(df) for i, x in enumerate(dataColumns)}
 
 def deleteFlagColumns(df):
     """
@@ -48,3 +48,224 @@ def calculateFS(lt_CDF, candidate_CDF):
     difference_vector = X['lt_CDF']-X['candidate_CDF']
     sum_difference = difference_vector.sum()
     return abs(sum_difference)
+
+def sortedSample(values):
+    """
+    Prepares a sample for calculateFSSorted. The
+    sample only has to be sorted once, however many
+    candidates it is compared with
+    Returns a tuple of the sorted values (NaNs
+    removed) and the size of the sample including
+    NaNs, as createCDF counts them
+    """
+    values = np.asarray(values, dtype=np.float64)
+    size = len(values)
+    values = np.sort(values[~np.isnan(values)])
+    return values, size
+
+def calculateFSSorted(lt_sample, candidate_sample):
+    """
+    Calculates the FS statistic for a candidate
+    against the long term sample, using
+    numpy.searchsorted instead of merging CDFs.
+    Gives the same result as
+    calculateFS(createCDF(lt), createCDF(candidate))
+    up to floating point summation order
+
+    lt_sample, candidate_sample - tuples from
+    sortedSample
+    """
+    lt_sorted, lt_size = lt_sample
+    candidate_sorted, candidate_size = candidate_sample
+
+    # The CDF of a measured value is the fraction
+    # of the sample below it (the first of any
+    # duplicates is kept, as in calculateFS). For
+    # the candidate that is the position of each
+    # unique value's first occurrence
+    unique, candidate_below = np.unique(candidate_sorted, return_index=True)
+    lt_below = np.searchsorted(lt_sorted, unique, side='left')
+    return calculateFSFromCounts(lt_below, len(lt_sorted), lt_size,
+        candidate_below, len(candidate_sorted), candidate_size)
+
+def calculateFSFromCounts(lt_below, lt_measured, lt_size, candidate_below, candidate_measured, candidate_size):
+    """
+    The last step of calculateFSSorted, from the
+    number of long term and candidate values below
+    each unique value of the candidate. Lets the
+    long term counts be added up from parts of the
+    long term sample (see tmy.windows)
+
+    lt_measured, candidate_measured - number of
+        values that aren't NaN
+    lt_size, candidate_size - sizes including NaNs
+    """
+    difference_vector = lt_below/lt_size - candidate_below/candidate_size
+
+    # calculateFS also matches the missing values of
+    # both samples (NaN joins with NaN), which sit
+    # after all the measured values
+    if candidate_measured<candidate_size and lt_measured<lt_size:
+        nan_difference = lt_measured/lt_size - candidate_measured/candidate_size
+        difference_vector = np.append(difference_vector, nan_difference)
+
+    sum_difference = difference_vector.sum()
+    return abs(sum_difference)
+
+def sketchBins(values, bin_width):
+    """
+    Bin of each value of a histogram sketch: bin k
+    holds the values from k*bin_width up to
+    (k+1)*bin_width
+    """
+    return np.floor(values/bin_width).astype(np.int64)
+
+def histogramSketch(sample, bin_width):
+    """
+    Fixed-bin histogram of a sample, for
+    calculateFSApproximate. Sketches made with the
+    same bin width (e.g. one for each year) can be
+    merged with mergeSketches
+
+    sample - tuple from sortedSample
+    Returns a dictionary with the bins that have
+    values (ascending), the number of values and
+    the smallest and largest value in each, the
+    number of measured values and the size of the
+    sample including NaNs
+    """
+    values, size = sample
+    bins = sketchBins(values, bin_width)
+
+    # The values are sorted, so each bin is a run
+    starts = np.flatnonzero(np.r_[True, bins[1:]!=bins[:-1]]) if len(bins) else np.zeros(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(bins)].astype(np.int64)
+
+    return {
+        'bin-width': bin_width,
+        'bins': bins[starts],
+        'counts': ends-starts,
+        'min': values[starts],
+        'max': values[ends-1],
+        'measured': len(values),
+        'size': size,
+    }
+
+def mergeSketches(sketches, size):
+    """
+    Merges histogram sketches with the same bin
+    width into the sketch of the joined sample
+
+    size - size of the joined sample including NaNs
+        (it can be larger than the sum of the
+        sketches, e.g. for years without the
+        variable)
+    """
+    bin_width = sketches[0]['bin-width']
+    if any(sketch['bin-width']!=bin_width for sketch in sketches):
+        raise ValueError('Can only merge sketches with the same bin width')
+
+    # Sort the bins of all sketches, and add up
+    # each run of the same bin
+    bins = np.concatenate([sketch['bins'] for sketch in sketches])
+    order = np.argsort(bins, kind='stable')
+    bins = bins[order]
+    starts = np.flatnonzero(np.r_[True, bins[1:]!=bins[:-1]]) if len(bins) else np.zeros(0, dtype=np.int64)
+
+    def reduce(ufunc, name):
+        values = np.concatenate([sketch[name] for sketch in sketches])[order]
+        return ufunc.reduceat(values, starts) if len(starts) else values
+
+    return {
+        'bin-width': bin_width,
+        'bins': bins[starts],
+        'counts': reduce(np.add, 'counts'),
+        'min': reduce(np.minimum, 'min'),
+        'max': reduce(np.maximum, 'max'),
+        'measured': sum(sketch['measured'] for sketch in sketches),
+        'size': size,
+    }
+
+def calculateFSApproximate(lt_sketch, candidate_sample):
+    """
+    Approximates calculateFSSorted with a histogram
+    sketch of the long term sample, so the long
+    term sample doesn't have to be sorted
+    Returns the approximate FS statistic and a bound
+    on its error (the exact statistic is at most
+    that far from the approximation)
+
+    lt_sketch - from histogramSketch or
+        mergeSketches
+    candidate_sample - tuple from sortedSample
+    """
+    candidate_sorted, candidate_size = candidate_sample
+    lt_size = lt_sketch['size']
+    n_bins = len(lt_sketch['bins'])
+
+    # Unique values of the candidate, and the
+    # position of their first occurrence
+    first = np.flatnonzero(np.r_[True, candidate_sorted[1:]!=candidate_sorted[:-1]]) if len(candidate_sorted) else np.zeros(0, dtype=np.int64)
+    unique = candidate_sorted[first]
+
+    # The long term values below a candidate value
+    # are all values of the bins before its bin,
+    # plus some of its own bin. None of them if the
+    # value is at or below the smallest value of
+    # the bin, all of them if it is above the
+    # largest. Otherwise it is taken as half, which
+    # is off by at most half of the bin
+    bins = sketchBins(unique, lt_sketch['bin-width'])
+    position = np.searchsorted(lt_sketch['bins'], bins)
+    cumulative = np.r_[0, np.cumsum(lt_sketch['counts'])]
+    lt_before = cumulative[position]
+    position = np.minimum(position, n_bins-1)
+    found = lt_sketch['bins'][position]==bins if n_bins else np.zeros(len(bins), dtype=bool)
+    lt_bin = np.where(found, lt_sketch['counts'][position], 0)
+    above = found & (unique>lt_sketch['max'][position])
+    inside = found & ~above & (unique>lt_sketch['min'][position])
+    lt_below = lt_before + np.where(above, lt_bin, 0) + np.where(inside, lt_bin/2, 0)
+    error = float(np.where(inside, lt_bin/2, 0).sum()/lt_size)
+
+    difference_vector = lt_below/lt_size - first/candidate_size
+
+    # Missing values, as in calculateFSSorted
+    if len(candidate_sorted)<candidate_size and lt_sketch['measured']<lt_size:
+        nan_difference = lt_sketch['measured']/lt_size - len(candidate_sorted)/candidate_size
+        difference_vector = np.append(difference_vector, nan_difference)
+
+    sum_difference = difference_vector.sum()
+    return abs(sum_difference), error
+
+
+if __name__=='__main__':
+    # Micro-benchmark of the two FS implementations
+    # on random data shaped like one calendar month
+    # (20 years of minutely data)
+    import time
+
+    rng = np.random.default_rng(0)
+    years = [pd.DataFrame({'ghi': np.round(rng.gamma(2, 150, 44640), 1)}) for i in range(20)]
+    for df in years:
+        df.loc[rng.random(len(df))<0.02, 'ghi'] = np.nan
+
+    t0 = time.perf_counter()
+    lt_CDF = createCDF(pd.concat(years))
+    reference = [calculateFS(lt_CDF['ghi'], createCDF(df)['ghi']) for df in years]
+    t1 = time.perf_counter()
+    lt_sample = sortedSample(pd.concat(years)['ghi'].values)
+    fast = [calculateFSSorted(lt_sample, sortedSample(df['ghi'].values)) for df in years]
+    t2 = time.perf_counter()
+
+    samples = [sortedSample(df['ghi'].values) for df in years]
+    lt_sketch = mergeSketches([histogramSketch(sample, 0.1) for sample in samples], sum(len(df) for df in years))
+    approximate = [calculateFSApproximate(lt_sketch, sample) for sample in samples]
+    t3 = time.perf_counter()
+
+    relative_error = np.max(np.abs(np.array(fast)-np.array(reference))/np.array(reference))
+    approximate_error = np.max(np.abs(np.array([x[0] for x in approximate])-np.array(fast)))
+    print('calculateFS:            {:.3f} s'.format(t1-t0))
+    print('calculateFSSorted:      {:.3f} s'.format(t2-t1))
+    print('calculateFSApproximate: {:.3f} s (incl. sorting the years)'.format(t3-t2))
+    print('Maximum relative difference: {:.2e}'.format(relative_error))
+    print('Maximum approximation error: {:.2e} (largest bound {:.2e})'.format(approximate_error, max(x[1] for x in approximate)))
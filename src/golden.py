@@ -0,0 +1,514 @@
+"""
+Golden-output harness: checks that the fast code
+paths (FS engines, low-memory mode, calendar month
+workers, binary caches, the vectorised loading, gap
+filling and smoothing, ...) choose the same months
+and make the same TMY as the original
+implementation
+
+The golden output is made by the original
+implementation itself: the baseline commit of the
+repository (BASELINE) is extracted with git archive
+and run in its own process on the fixture station.
+Its tmy.decide.month and
+tmy.polish.fillRemainingGaps are wrapped (see
+BASELINE_DRIVER) to record the ranked and extended
+candidates of every calendar month, and the month
+each gap day was replaced from. The baseline itself
+is not changed, so the intentional differences of
+the current code are declared in
+EXPECTED_DIFFERENCES, and the TMY values they
+concern aren't compared
+
+The fixture stations are synthetic (see
+synthetic.py), with long outages so that the
+final gap replace step has days to replace. Each
+variant is a set of config.yml settings of the
+current code, including the reference FS engine.
+For every calendar month, a run records the same
+candidates and replaced days (see
+onetmy.decideMonth), and the checksum of the TMY it
+made
+
+record runs the baseline and saves its results
+(and TMY) as the golden output. check runs the
+variants and compares them with it: the candidates
+and replaced days have to be the same, and the
+values of the TMY the same within the tolerances
+(the checksums show whether they are identical)
+
+python golden.py record [--stations ...] [--baseline <commit>]
+python golden.py check [--variants ...] [--rtol 1e-9] [--atol 1e-9]
+"""
+
+import os
+import sys
+import copy
+import json
+import shutil
+import tarfile
+import hashlib
+import logging
+import argparse
+import subprocess
+import yaml
+import numpy as np
+import pandas as pd
+
+from config_parse import CONFIG
+
+import benchmark
+import onetmy
+from tmy.stack import MINUTES_PER_DAY
+
+YEARS = 10
+
+# Synthetic data of the fixture stations (see
+# synthetic.generate)
+FIXTURE = {'gaps': 'mixed', 'outages': 3, 'outage_minutes': 360, 'flag_rate': 0.01, 'files_per_month': 1, 'seed': 1}
+
+# Commit of the original implementation, that the
+# golden output is made with
+BASELINE = 'd8eb06b'
+
+# Runs the baseline's onetmy.py, and saves the
+# candidates and replaced days of every calendar
+# month as JSON (the path is the first argument).
+# The baseline runs as it is: its functions are
+# only wrapped to record what they did. A gap day
+# was replaced from the first candidate (in the
+# order fillRemainingGaps tries them) whose day is
+# the same as the filled one. Like the baseline,
+# days are compared by column position. The days
+# replaced from a month whose columns are in
+# another order than the winner's are recorded as
+# reordered
+BASELINE_DRIVER = '''
+import sys
+import json
+import runpy
+import numpy as np
+import tmy
+
+outcomes = {}
+month = tmy.decide.month
+fillRemainingGaps = tmy.polish.fillRemainingGaps
+
+def dayRows(df, month_no, day):
+	return (df.index.month==month_no) & (df.index.day==day)
+
+def recordMonth(data):
+	ranked, extended = month(data)
+	outcomes['{:02d}'.format(ranked[0].month)] = {
+		'ranked': [key.isoformat() for key in ranked],
+		'extended': [key.isoformat() for key in extended],
+		'replaced': {},
+		'reordered': [],
+	}
+	return ranked, extended
+
+def recordFill(data, ranked, extended):
+	wkey = ranked[0]
+	wdf = data[wkey]
+	columns = list(wdf.columns)
+	candidates = [key for key in list(ranked[1:])+list(extended) if key!=wkey]
+	month_no = wdf.index[0].month
+	days = sorted(set(wdf.index[wdf.isnull().values.any(axis=1) & (wdf.index.month==month_no)].day))
+	key, df = fillRemainingGaps(data, ranked, extended)
+
+	outcome = outcomes['{:02d}'.format(wkey.month)]
+	for day in days:
+		values = df.values[dayRows(df, month_no, day)]
+		if np.isnan(values).any():
+			outcome['replaced'][str(day)] = None
+			break
+		for other in candidates:
+			odf = data[other]
+			day_values = odf.values[dayRows(odf, month_no, day)]
+			if day_values.shape==values.shape and np.array_equal(day_values, values, equal_nan=True):
+				outcome['replaced'][str(day)] = other.isoformat()
+				if list(odf.columns)!=columns:
+					outcome['reordered'].append(day)
+				break
+	return key, df
+
+tmy.decide.month = recordMonth
+tmy.polish.fillRemainingGaps = recordFill
+runpy.run_path('onetmy.py', run_name='__main__')
+
+with open(sys.argv[1], 'w') as f:
+	json.dump(outcomes, f)
+'''
+
+# Intentional differences from the baseline: the
+# entry of the golden output of each calendar month
+# that lists the days concerned, and why they
+# differ. The TMY values of those days (and the
+# day either side, which smoothing can reach) are
+# not compared
+EXPECTED_DIFFERENCES = {
+    'reordered': 'replaced from a month whose columns are in another order than the winner\'s. '
+        'The baseline copies replacement days by column position, the current code by name (see tmy.polish.fillRemainingGaps)',
+}
+
+# Settings of the current code that all variants
+# start from
+REFERENCE = {
+    'tmy': {'fs-engine': 'reference', 'pre-ranking': {'enabled': False}},
+    'processing': {'month-workers': 1, 'low-memory': False, 'cache-format': 'npz', 'measurement-dtype': 'float64'},
+}
+
+# Settings of each variant, on top of the
+# reference. Variants with warm set are run twice,
+# and the second run (from the caches) is checked
+VARIANTS = {
+    'reference': {},
+    'searchsorted': {'tmy': {'fs-engine': 'searchsorted'}},
+    'approximate': {'tmy': {'fs-engine': 'approximate'}},
+    'low-memory': {'tmy': {'fs-engine': 'searchsorted'}, 'processing': {'low-memory': True}, 'warm': True},
+    'month-workers': {'tmy': {'fs-engine': 'searchsorted'}, 'processing': {'month-workers': 2}},
+    'npz-cache': {'tmy': {'fs-engine': 'searchsorted'}, 'warm': True},
+    'csv-cache': {'tmy': {'fs-engine': 'searchsorted'}, 'processing': {'cache-format': 'csv'}, 'warm': True},
+}
+
+def merge(base, settings):
+    """
+    Merges nested dictionaries of settings into a
+    copy of base
+    """
+    merged = copy.deepcopy(base)
+    for key, value in settings.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def checksum(path):
+    """
+    SHA-256 of a file
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1<<20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def outcomeJson(outcome):
+    """
+    The outcome of a calendar month (see
+    onetmy.decideMonth), with text keys
+    """
+    return {
+        'ranked': [key.isoformat() for key in outcome['ranked']],
+        'extended': [key.isoformat() for key in outcome['extended']],
+        'replaced': {str(day): None if key is None else key.isoformat() for day, key in sorted(outcome['replaced'].items())},
+    }
+
+def logConfig(work):
+    """
+    Writes a copy of logconfig.yml whose log files
+    are in the folder work
+    Returns its path
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logconfig.yml')) as f:
+        log_config = yaml.safe_load(f)
+    for handler in log_config.get('handlers', {}).values():
+        if 'filename' in handler:
+            handler['filename'] = os.path.join(work, os.path.basename(handler['filename']))
+    path = os.path.join(work, 'logconfig.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(log_config, f)
+    return path
+
+def runVariant(directory, station, name, settings):
+    """
+    Runs the pipeline on a fixture station with the
+    settings of a variant
+    Returns the result: whether it succeeded, the
+    outcome of each calendar month, and the path
+    and checksum of the TMY
+    """
+
+    source = benchmark.dataset(directory, station, YEARS, FIXTURE)
+    work = os.path.join(directory, 'runs', name, station)
+    shutil.rmtree(work, ignore_errors=True)
+    preprocesspath = os.path.join(work, 'filtered')
+    outpath = os.path.join(work, station+'_TMY.csv')
+    os.makedirs(preprocesspath)
+
+    # Worker processes log to the folder of the run,
+    # not to the working directory
+    log_config = logConfig(work)
+    original_log_config = os.environ.get(onetmy.LOGCONFIG_VARIABLE)
+    os.environ[onetmy.LOGCONFIG_VARIABLE] = log_config
+
+    original = copy.deepcopy(CONFIG)
+    CONFIG.update(merge(merge(CONFIG, REFERENCE), {key: value for key, value in settings.items() if key!='warm'}))
+    CONFIG['processing']['solar-cache'] = dict(CONFIG['processing'].get('solar-cache') or {}, directory=os.path.join(directory, 'solar_cache'))
+    CONFIG['processing']['instrument'] = {'enabled': False}
+    try:
+        for attempt in range(2 if settings.get('warm') else 1):
+            outcomes = {}
+            success = onetmy.processStation(station, source, CONFIG['folders']['pattern'], outpath, preprocesspath, outcomes)
+    finally:
+        CONFIG.clear()
+        CONFIG.update(original)
+        if original_log_config is None:
+            del os.environ[onetmy.LOGCONFIG_VARIABLE]
+        else:
+            os.environ[onetmy.LOGCONFIG_VARIABLE] = original_log_config
+
+    result = {'station': station, 'variant': name, 'success': bool(success) and os.path.exists(outpath)}
+    result['months'] = {'{:02d}'.format(month_no): outcomeJson(outcomes[month_no]) for month_no in sorted(outcomes)}
+    if result['success']:
+        result['tmy'] = outpath
+        result['checksum'] = checksum(outpath)
+    return result
+
+def extractBaseline(directory, revision):
+    """
+    Extracts the src folder of a commit of the
+    repository (with git archive)
+    Returns the folder it was extracted to
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    target = os.path.join(directory, 'baseline', revision)
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+    archive = os.path.join(target, 'src.tar')
+    subprocess.run(['git', 'archive', '--format=tar', '-o', archive, revision, 'src'],
+        cwd=os.path.dirname(here), check=True)
+    with tarfile.open(archive) as f:
+        f.extractall(target)
+    os.remove(archive)
+    return os.path.join(target, 'src')
+
+def baselineConfig(src, source, work, station):
+    """
+    Writes the config.yml of the baseline: its own
+    file, with the folders of the fixture station,
+    only that station, and the time, weather, solar
+    and tmy settings of the current configuration
+    that the baseline knows
+    """
+    path = os.path.join(src, 'config.yml')
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f)
+
+    config['folders'] = dict(config['folders'],
+        source=os.path.dirname(source)+'/',
+        **{'destination-tmy': os.path.join(work, '{}_TMY.csv'), 'destination-filtered': os.path.join(work, 'filtered')+'/'})
+    config['stations'] = {station: copy.deepcopy(dict(CONFIG['stations'][station]))}
+    for block in ['time', 'weather', 'solar']:
+        config[block] = copy.deepcopy(dict(CONFIG[block]))
+    for key in config['tmy']:
+        if key in CONFIG['tmy']:
+            config['tmy'][key] = copy.deepcopy(CONFIG['tmy'][key])
+
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+
+def runBaseline(directory, station, revision=BASELINE):
+    """
+    Runs the original implementation (a commit of
+    the repository) on a fixture station, in its own
+    process
+    Returns the result, as runVariant
+    """
+
+    source = benchmark.dataset(directory, station, YEARS, FIXTURE)
+    src = extractBaseline(directory, revision)
+    work = os.path.join(directory, 'runs', 'baseline', station)
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(os.path.join(work, 'filtered', station))
+    baselineConfig(src, source, work, station)
+
+    driver = os.path.join(src, 'golden_driver.py')
+    with open(driver, 'w') as f:
+        f.write(BASELINE_DRIVER)
+    outcomes_path = os.path.join(work, 'outcomes.json')
+    logging.info('Running the baseline (%s) on station %s', revision, station)
+    with open(os.path.join(work, 'baseline.log'), 'w') as log:
+        completed = subprocess.run([sys.executable, driver, outcomes_path], cwd=src, stdout=log, stderr=subprocess.STDOUT)
+
+    outpath = os.path.join(work, station+'_TMY.csv')
+    result = {'station': station, 'variant': 'baseline', 'revision': revision,
+        'success': completed.returncode==0 and os.path.exists(outpath) and os.path.exists(outcomes_path)}
+    result['months'] = {}
+    if os.path.exists(outcomes_path):
+        with open(outcomes_path, 'r') as f:
+            result['months'] = dict(sorted(json.load(f).items()))
+    if result['success']:
+        result['tmy'] = outpath
+        result['checksum'] = checksum(outpath)
+    return result
+
+def goldenPath(directory, station):
+    return os.path.join(directory, 'golden', station+'.json')
+
+def record(directory, station, revision=BASELINE):
+    """
+    Runs the baseline on a fixture station, and
+    saves its result and TMY as the golden output
+    Returns the result
+    """
+    result = runBaseline(directory, station, revision)
+    if not result['success']:
+        raise RuntimeError('The baseline run of station "'+station+'" failed (see '+os.path.join(directory, 'runs', 'baseline', station, 'baseline.log')+')')
+    path = goldenPath(directory, station)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmy_path = os.path.join(os.path.dirname(path), station+'_TMY.csv')
+    shutil.copyfile(result['tmy'], tmy_path)
+    result['tmy'] = tmy_path
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=1)
+    return result
+
+def load(directory, station):
+    """
+    Loads the golden output of a station, or None
+    if it hasn't been recorded
+    """
+    path = goldenPath(directory, station)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def expectedRows(golden, index):
+    """
+    The rows of a TMY (index of its timestamps)
+    that are expected to differ from the golden TMY
+    (see EXPECTED_DIFFERENCES)
+    """
+    times = pd.to_datetime(index.str[:19])
+    days = [int(month)*100+day for month, outcome in golden['months'].items()
+        for entry in EXPECTED_DIFFERENCES for day in outcome.get(entry, [])]
+    expected = np.isin(times.month*100+times.day, days)
+    # The day either side as well
+    positions = np.flatnonzero(expected)
+    for shift in [-MINUTES_PER_DAY, MINUTES_PER_DAY]:
+        shifted = positions+shift
+        expected[shifted[(shifted>=0) & (shifted<len(expected))]] = True
+    return expected
+
+def expectedDifferences(golden):
+    """
+    Descriptions of the intentional differences
+    from the baseline in the golden output
+    """
+    descriptions = []
+    for entry, reason in EXPECTED_DIFFERENCES.items():
+        days = ['{}-{:02d}'.format(month, day) for month, outcome in golden['months'].items() for day in outcome.get(entry, [])]
+        if days:
+            descriptions.append(' '.join(days)+': '+reason)
+    return descriptions
+
+def compareTmy(golden_path, path, rtol=1e-9, atol=1e-9, ignore=None):
+    """
+    Compares the values of two TMY files
+    Returns a list of differences (empty if they
+    match within the tolerances)
+
+    ignore - optional function of the golden TMY's
+        index, that gives the rows not to compare
+    """
+    expected = pd.read_csv(golden_path, index_col=0)
+    actual = pd.read_csv(path, index_col=0)
+    if list(expected.columns)!=list(actual.columns):
+        return ['columns differ: '+str(list(expected.columns))+' and '+str(list(actual.columns))]
+    if not expected.index.equals(actual.index):
+        return ['timestamps differ']
+    compared = np.ones(len(expected), dtype=bool) if ignore is None else ~ignore(expected.index)
+
+    differences = []
+    for column in expected:
+        a = expected[column].values.astype(np.float64)
+        b = actual[column].values.astype(np.float64)
+        close = np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True) | ~compared
+        if not close.all():
+            worst = np.nanmax(np.abs(a-b)[~close])
+            differences.append('{}: {} values differ (largest difference {:.3g}, first at {})'.format(column,
+                int((~close).sum()), worst, expected.index[np.argmin(close)]))
+    return differences
+
+def compare(golden, result, rtol=1e-9, atol=1e-9):
+    """
+    Compares the result of a variant with the
+    golden output
+    Returns a list of differences (empty if it
+    matches)
+    """
+    if not result['success']:
+        return ['the run failed']
+
+    differences = []
+    for month, expected in golden['months'].items():
+        actual = result['months'].get(month)
+        if actual is None:
+            differences.append(month+': not decided')
+            continue
+        for entry in ['ranked', 'extended', 'replaced']:
+            if actual[entry]!=expected[entry]:
+                differences.append('{}: {} {} instead of {}'.format(month, entry, actual[entry], expected[entry]))
+
+    if result['checksum']!=golden['checksum']:
+        differences += compareTmy(golden['tmy'], result['tmy'], rtol, atol, lambda index: expectedRows(golden, index))
+    return differences
+
+def check(directory, station, variants, rtol=1e-9, atol=1e-9):
+    """
+    Runs variants on a fixture station and
+    compares them with its golden output (which is
+    recorded first if there isn't one)
+    Returns a dictionary of variant -> list of
+    differences
+    """
+    golden = load(directory, station)
+    if golden is None or 'revision' not in golden:
+        logging.warning('No golden output of station "'+station+'" made by the baseline. Recording it first')
+        golden = record(directory, station)
+
+    results = {}
+    for name in variants:
+        result = runVariant(directory, station, name, VARIANTS[name])
+        results[name] = compare(golden, result, rtol, atol)
+        identical = result.get('checksum')==golden['checksum']
+        logging.info('%s %s: %s', station, name, 'identical' if identical else str(len(results[name]))+' differences')
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Checks that the fast code paths make the same TMYs as the original implementation')
+    parser.add_argument('command', choices=['record', 'check'])
+    parser.add_argument('--directory', default='../golden', help='folder for the fixture data, the runs and the golden output')
+    parser.add_argument('--stations', nargs='+', default=list(CONFIG['stations'])[:1], help='fixture stations from config.yml (default: the first one)')
+    parser.add_argument('--variants', nargs='+', choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument('--baseline', default=BASELINE, help='commit of the original implementation that record runs (default: '+BASELINE+')')
+    parser.add_argument('--rtol', type=float, default=1e-9)
+    parser.add_argument('--atol', type=float, default=1e-9)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+    if args.command=='record':
+        for station in args.stations:
+            result = record(args.directory, station, args.baseline)
+            print('Recorded the golden output of station "'+station+'" with '+args.baseline+' ('+result['checksum'][:12]+')')
+        return 0
+
+    failed = False
+    for station in args.stations:
+        results = check(args.directory, station, args.variants, args.rtol, args.atol)
+        print('Station "'+station+'"')
+        for description in expectedDifferences(load(args.directory, station)):
+            print('\texpected\t'+description)
+        for name, differences in results.items():
+            print('\t'+name.ljust(14)+'\t'+('ok' if not differences else str(len(differences))+' differences'))
+            for difference in differences:
+                print('\t\t'+difference)
+            failed = failed or bool(differences)
+    return 1 if failed else 0
+
+if __name__=='__main__':
+    sys.exit(main())
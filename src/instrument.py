@@ -0,0 +1,255 @@
+"""
+Timing and memory of each stage of a run (loading,
+validation, gap filling, deciding, ...), broken
+down per station and calendar month
+
+Stages are timed with the stage() context manager,
+and the calendar month they belong to is set with
+scope(). The records of a station are collected in
+the process that runs it (calendar month workers
+return theirs, see onetmy.processMonthTask), and
+written as a JSON report next to its TMY (see
+report())
+
+The memory of a stage is measured as set by
+instrument in the processing block of config.yml:
+rss (the resident memory of the process at the end
+of the stage, and the peak of the process so far),
+tracemalloc (the peak of the memory allocated
+during the stage, which is exact but makes the
+whole run slower) or none
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import datetime
+import tracemalloc
+import contextlib
+
+from config_parse import CONFIG
+
+_records = []
+_scope = {'station': None, 'month': None}
+_stack = []
+
+def settings():
+    """
+    Returns the instrument settings from the
+    processing block of config.yml
+    """
+    return CONFIG.get('processing', {}).get('instrument') or {}
+
+def enabled():
+    return settings().get('enabled', True)
+
+def memoryMode():
+    return settings().get('memory') or 'rss'
+
+def reset(station=None):
+    """
+    Forgets all records, and starts recording the
+    stages of a station
+    """
+    del _records[:]
+    del _stack[:]
+    _scope['station'] = station
+    _scope['month'] = None
+    if enabled() and memoryMode()=='tracemalloc' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def records():
+    """
+    The records of this process (e.g. to return
+    them from a worker process)
+    """
+    return list(_records)
+
+def extend(new_records):
+    """
+    Adds records of another process
+    """
+    _records.extend(new_records)
+
+@contextlib.contextmanager
+def scope(month):
+    """
+    The stages inside belong to a calendar month
+    (number)
+    """
+    previous = _scope['month']
+    _scope['month'] = month
+    try:
+        yield
+    finally:
+        _scope['month'] = previous
+
+def rss():
+    """
+    Resident memory of this process in bytes, or
+    None if it can't be read (only Linux has
+    /proc)
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def peakRss():
+    """
+    Peak resident memory of this process in bytes,
+    or None if it isn't available (Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform=='darwin':
+        return peak    # bytes on macOS
+    return peak*1024
+
+def peakMemory():
+    """
+    Peak memory of this process, as text
+    """
+    peak = peakRss()
+    if peak is None:
+        return 'unknown'
+    return '%.0f MB' % (peak/1024**2)
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """
+    Records the wall time, CPU time and memory of
+    the code inside, as stage name of the current
+    station and calendar month
+    Yields the record, so the rows can also be set
+    once they are known (record['rows'])
+
+    Stages can be nested (e.g. timetools.convert
+    inside load). The time of the inner stage is
+    then also part of the outer one
+    """
+
+    if not enabled():
+        yield {}
+        return
+
+    record = {'station': _scope['station'], 'month': _scope['month'], 'stage': name, 'rows': rows}
+    tracing = memoryMode()=='tracemalloc' and tracemalloc.is_tracing()
+    if tracing:
+        # The peak is reset for each stage. The
+        # peak of the stage it is nested in is
+        # kept first
+        peak = tracemalloc.get_traced_memory()[1]
+        for outer in _stack:
+            outer['_peak'] = max(outer['_peak'], peak)
+        tracemalloc.reset_peak()
+        record['_start'] = tracemalloc.get_traced_memory()[0]
+        record['_peak'] = 0
+    _stack.append(record)
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall-s'] = time.perf_counter()-wall
+        record['cpu-s'] = time.process_time()-cpu
+        _stack.remove(record)
+        if tracing:
+            peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1])
+            record['peak-mb'] = (peak-record.pop('_start'))/1024**2
+            for outer in _stack:
+                outer['_peak'] = max(outer['_peak'], peak)
+        elif memoryMode()=='rss':
+            current, peak = rss(), peakRss()
+            record['rss-mb'] = None if current is None else current/1024**2
+            record['peak-mb'] = None if peak is None else peak/1024**2
+        _records.append(record)
+
+def summarise(stage_records):
+    """
+    Adds up records of the same stage
+    Returns a dictionary of stage -> calls, wall
+    time, CPU time, rows and the largest memory
+    figures (and the share of each column masked
+    against flags, and the memory of the month
+    summaries of low-memory mode, for the stages
+    that record them)
+    """
+    stages = {}
+    for record in stage_records:
+        total = stages.setdefault(record['stage'], {'calls': 0, 'wall-s': 0.0, 'cpu-s': 0.0, 'rows': 0})
+        total['calls'] += 1
+        total['wall-s'] += record['wall-s']
+        total['cpu-s'] += record['cpu-s']
+        total['rows'] += record['rows'] or 0
+        for key in ['rss-mb', 'peak-mb', 'summaries-mb']:
+            if record.get(key) is not None:
+                total[key] = max(total.get(key, 0), record[key])
+        for column, (masked, rows) in (record.get('masked') or {}).items():
+            counts = total.setdefault('_masked', {}).setdefault(column, [0, 0])
+            counts[0] += masked
+            counts[1] += rows
+
+    # Share of the values of each column that were
+    # masked against flags
+    for total in stages.values():
+        if '_masked' in total:
+            total['masked'] = {column: masked/rows if rows else 0.0 for column, (masked, rows) in total.pop('_masked').items()}
+    return stages
+
+def reportPath(outpath):
+    """
+    Path of the report of a station, next to its
+    TMY
+    """
+    root, ext = os.path.splitext(outpath)
+    return root+'_report.json'
+
+def report(outpath, station, success, wall):
+    """
+    Writes the JSON report of a station: the
+    totals of each stage, and the stages of each
+    calendar month (and of the station as a whole,
+    e.g. filesearch and export)
+    Returns the path of the report, or None if
+    instrumentation is disabled
+
+    outpath - output path of the TMY
+    success - whether the TMY was created
+    wall - wall time of the whole station
+    """
+
+    if not enabled():
+        return None
+
+    station_records = [r for r in _records if r['station']==station]
+    months = sorted({r['month'] for r in station_records if r['month'] is not None})
+    content = {
+        'station': station,
+        'success': bool(success),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'wall-s': wall,
+        'memory': memoryMode(),
+        'peak-mb': None if peakRss() is None else peakRss()/1024**2,
+        'stages': summarise(station_records),
+        'station-stages': summarise([r for r in station_records if r['month'] is None]),
+        'calendar-months': {'{:02d}'.format(month): summarise([r for r in station_records if r['month']==month]) for month in months},
+    }
+
+    path = reportPath(outpath)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(content, f, indent=1)
+    except OSError:
+        logging.warning('Could not write the run report '+path)
+        return None
+    logging.info('Run report written to '+path)
+    return path
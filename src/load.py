@@ -1,41 +1,94 @@
 import os
 import re
+import time
+import functools
 import pandas as pd
 import logging
 import pytz
 
-from config_parse import CONFIG, HEADER_MAP
+from config_parse import CONFIG, HEADER_MAP, timeHeaderMap, onLoad, csvEngine, measurementDtype
 import timetools, flagtools
+import instrument
 
-def stripRenameColumns(df):
+@functools.lru_cache(maxsize=None)
+def renameMap():
     """
-    Renames all of the columns in a data file, and
-    removes any that aren't needed
-    Applys these changes in-place
-    CONFIG is the configuration file
+    Mapping of the old headers -> new headers
+    (the reverse of HEADER_MAP)
     """
+    rename = {}
+    for new_header in HEADER_MAP:
+        old_header = HEADER_MAP[new_header]
+        if old_header not in rename:
+            rename[old_header] = new_header
+    return rename
 
-    logging.debug('Stripping and renaming columns')
+onLoad(renameMap.cache_clear)
 
-    # The mapping of the old headers
-    # to the new ones has been imported
-    # from config_parse.py - HEADER_MAP
+@functools.lru_cache(maxsize=None)
+def columnDtypes():
+    """
+    dtype of each column when reading a data file
+    (by new header): small integers for the time
+    columns, category for the flags and
+    measurement-dtype from the processing block of
+    config.yml (default float64) for the rest
+    """
+    measurement_dtype = measurementDtype()
+    time_headers = timeHeaderMap()
 
-    # Rename columns
+    dtypes = {}
     for new_header in HEADER_MAP:
-        old_header = HEADER_MAP[new_header]
-        if old_header in df:
-            df.rename(columns={old_header:new_header}, inplace=True)
+        if new_header in time_headers:
+            dtypes[new_header] = 'int16'
+        elif '-flag' in new_header:
+            dtypes[new_header] = 'category'
+        else:
+            dtypes[new_header] = measurement_dtype
+    return dtypes
 
-    # Delete columns that aren't needed
-    current_headers = list(df)
-    allowed_headers = list(HEADER_MAP.keys())
-    for current_header in current_headers:
-        if current_header not in allowed_headers:
-            #logging.info('Deleting '+ current_header)
-            del df[current_header]
+onLoad(columnDtypes.cache_clear)
 
+def readFile(path):
+    """
+    Reads a data file. Only the columns in
+    HEADER_MAP are parsed, and they are renamed to
+    the new headers
+
+    The columns get their dtypes from
+    columnDtypes(), so the flags are read as
+    categories and the time parts as small
+    integers. The c parser infers float64 itself,
+    so it only gets the measurement dtype if
+    measurement-dtype isn't float64 (float32
+    halves the memory)
+    If the typed read fails (e.g. text in a number
+    column or a missing time), the file is read
+    again with only the flags typed, and load()
+    converts the other columns to numbers
+    Returns the dataframe
+    """
 
+    rename = renameMap()
+    dtypes = columnDtypes()
+    engine = csvEngine()
+
+    # Only parse the columns we need
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [x for x in header if x in rename]
+    typed = {x: dtypes[rename[x]] for x in usecols}
+    if engine!='pyarrow':
+        typed = {x: dtype for x, dtype in typed.items() if dtype!='float64'}
+
+    try:
+        df = pd.read_csv(path, usecols=usecols, dtype=typed or None, engine=engine)
+    except (ValueError, TypeError, OverflowError) as e:
+        logging.debug('Typed read of "'+path+'" failed ('+str(e)+'). Reading with only the flags typed')
+        flags = {x: dtype for x, dtype in typed.items() if dtype=='category'}
+        df = pd.read_csv(path, usecols=usecols, dtype=flags or None, low_memory=False)
+
+    df.rename(columns=rename, inplace=True)
+    return df
 
 def load(paths, station, year, month):
     """
@@ -55,20 +108,31 @@ def load(paths, station, year, month):
     # Make the timeseries for this month
     offset = CONFIG['stations'][station]['offset']
     timezone = pytz.FixedOffset(offset)
-    timeseries = timetools.generateTimeseries(year, month, timezone)
+    timeseries = timetools.generateTimeseries(year, month, timezone, df_type=False)
 
     # Clean each file
     dataFiles = []
+    names = []
     logging.debug(paths)
 	
+    masked = {}
+    flagged_rows = {}
+    n_bytes = 0
+    n_rows = 0
+    parse_time = 0
+
     for path in paths:
 
         logging.debug('Loading %s', path)
 
-        df = pd.read_csv(path, low_memory=False)
-
-        # Rename and delete useless columns
-        stripRenameColumns(df)
+        # Read, rename and delete useless columns
+        start = time.perf_counter()
+        df = readFile(path)
+        elapsed = time.perf_counter()-start
+        logging.debug('Parsed %d rows in %.3fs', len(df), elapsed)
+        n_bytes += os.path.getsize(path)
+        n_rows += len(df)
+        parse_time += elapsed
 
         # If the dataframe is now empty, stop
         if df.empty:
@@ -76,45 +140,58 @@ def load(paths, station, year, month):
             continue
 
         # Convert time columns into datetimes
-        timetools.convert(df, station)
+        with instrument.stage('timetools.convert', len(df)):
+            timetools.convert(df, station)
 
-        # Decide on which time column to use
-        q = timetools.decideTimeColumn(df)
+            # Decide on which time column to use
+            q = timetools.decideTimeColumn(df)
         if not q:
             # Couldn't decide time column
             # Quit this file
             continue
 
-        # Convert the flags columns
-        flagtools.convert(df)
-
-        # Mask data against flags
-        flagtools.maskData(df)
-
-        # Delete the flag columns
-        flagtools.deleteFlagColumns(df)
+        with instrument.stage('flagtools', len(df)) as record:
+            # Convert the flags columns
+            flagtools.convert(df)
+
+            # Mask data against flags. The masked
+            # values of each column go in the run
+            # report as well
+            fractions = flagtools.maskData(df)
+            for col in fractions:
+                logging.debug('Masked %.2f%% of "%s" against flags', 100*fractions[col], col)
+                masked[col] = masked.get(col, 0) + fractions[col]*len(df)
+                flagged_rows[col] = flagged_rows.get(col, 0) + len(df)
+            record['masked'] = {col: (round(fractions[col]*len(df)), len(df)) for col in fractions}
+
+            # Delete the flag columns
+            flagtools.deleteFlagColumns(df)
         # Convert all columns to numeric
         # APART FROM the datetime column
-        cols = [x for x in list(df) if x!='datetime']
-        df[cols] = df[cols].apply(pd.to_numeric, errors='coerce')
+        # (typed reads already are)
+        cols = [x for x in list(df) if x!='datetime' and not pd.api.types.is_numeric_dtype(df[x])]
+        if cols:
+            df[cols] = df[cols].apply(pd.to_numeric, errors='coerce')
 
-        # Merge against master timeseries
-        df = timetools.mergeAgainstMasterTimeseries(df, timeseries)
         dataFiles.append(df)
+        names.append(path)
+
+    if parse_time>0:
+        logging.info('Parsed %.1f MB/s, %d rows/s', n_bytes/parse_time/1e6, n_rows/parse_time)
+
+    if masked:
+        output = ', '.join('%s %.2f%%' % (col, 100*masked[col]/flagged_rows[col]) for col in masked)
+        logging.info('Masked against flags: '+output)
 
     if not dataFiles:
         logging.warning('No files successfully loaded for %d/%d', year, month)
         return
 
-    # Merge all of the found datafiles
-    df = dataFiles[0]
-    del dataFiles[0]
-    for df2 in dataFiles:
-        df = pd.merge(df, df2, right_on='datetime', left_on='datetime')
-
-    # Set index to the datetime. This now means all
-    # columns are numerical dtypes, therefore you can
-    # interpolate without errors
-    df.set_index('datetime', inplace=True)
+    # Align all of the found datafiles against the
+    # master timeseries, which becomes the index.
+    # This now means all columns are numerical
+    # dtypes, therefore you can interpolate without
+    # errors
+    df = timetools.alignAgainstMasterTimeseries(dataFiles, timeseries, names)
 
     return df
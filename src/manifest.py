@@ -0,0 +1,224 @@
+"""
+Manifests of the cached gap-filled months. Each
+cached month has a manifest (<name>.manifest.json)
+with the fingerprint of everything it was made
+from:
+
+- the source files (path, size and modification
+time, or a hash of their content)
+- the config.yml sections used by preprocessing
+(time, weather, solar, flags, the station entry,
+the required columns, and the measurement-dtype
+and csv-engine of the processing block)
+- the version of the preprocessing code
+
+A cached month is only used while its fingerprint
+still matches, so reissued source files and config
+changes are picked up without deleting the cache
+by hand. To report which months of stations are
+cached and up to date:
+
+python manifest.py [station ...]
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import datetime
+import functools
+
+from config_parse import CONFIG, stationPaths, csvEngine, measurementDtype
+
+import monthcache
+
+# Modules whose code changes the gap-filled months
+PREPROCESSING_MODULES = ['config_parse.py', 'load.py', 'timetools.py', 'flagtools.py', 'validation.py', 'fill.py']
+
+# Bump when the preprocessing changes outside of
+# PREPROCESSING_MODULES (e.g. the steps of
+# onetmy.prepareMonths)
+PREPROCESSING_VERSION = 1
+
+def settings():
+    """
+    Returns the processing block of config.yml
+    """
+    return CONFIG.get('processing') or {}
+
+def manifestPath(preprocesspath, name):
+    return os.path.normpath(preprocesspath+'/'+name+'.manifest.json')
+
+def hashFile(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def hashJson(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+def sources(paths):
+    """
+    Fingerprint of the source files of a month.
+    With source-fingerprint: hash in the processing
+    block, the content of the files is hashed.
+    Otherwise (stat) their size and modification
+    time are used
+    """
+    mode = settings().get('source-fingerprint') or 'stat'
+    if mode not in ['stat', 'hash']:
+        raise ValueError('Unknown source fingerprint "'+str(mode)+'"')
+
+    result = []
+    for path in sorted(paths):
+        entry = {'path': os.path.normpath(path)}
+        stat = os.stat(path)
+        entry['size'] = stat.st_size
+        if mode=='hash':
+            entry['sha256'] = hashFile(path)
+        else:
+            entry['mtime-ns'] = stat.st_mtime_ns
+        result.append(entry)
+    return result
+
+def configSections(station):
+    """
+    The parts of config.yml that change the
+    gap-filled months of a station
+    """
+    return {
+        'time': CONFIG['time'],
+        'weather': CONFIG['weather'],
+        'solar': CONFIG['solar'],
+        'flags': CONFIG.get('flags'),
+        'station': CONFIG['stations'][station],
+        'required-columns': CONFIG['tmy']['required-columns'],
+        'measurement-dtype': measurementDtype(),
+        'csv-engine': csvEngine(),
+    }
+
+@functools.lru_cache(maxsize=None)
+def codeVersion():
+    """
+    Hash of the preprocessing code
+    """
+    h = hashlib.sha256(str(PREPROCESSING_VERSION).encode())
+    dir = os.path.dirname(os.path.abspath(__file__))
+    for module in PREPROCESSING_MODULES:
+        h.update(module.encode())
+        h.update(hashFile(os.path.join(dir, module)).encode())
+    return h.hexdigest()
+
+def fingerprint(station, paths):
+    """
+    Fingerprint of a month of a station
+
+    paths - list of the source files of the month
+    """
+    return {
+        'sources': sources(paths),
+        'config': hashJson(configSections(station)),
+        'code': codeVersion(),
+    }
+
+def load(preprocesspath, name):
+    """
+    Loads the manifest of a cached month. Returns
+    None if there isn't one (or it can't be read)
+    """
+    path = manifestPath(preprocesspath, name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logging.warning('Could not read manifest '+path)
+        return None
+
+def save(preprocesspath, name, fingerprint):
+    """
+    Saves the manifest of a month that has just
+    been cached
+    """
+    path = manifestPath(preprocesspath, name)
+    manifest = dict(fingerprint)
+    manifest['created'] = datetime.datetime.now().isoformat(timespec='seconds')
+
+    tmp_path = path+'.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+def check(preprocesspath, name, fingerprint):
+    """
+    Checks whether a month can be loaded from the
+    cache
+    Returns None for a cache hit, otherwise the
+    reason for the miss
+    """
+    cache_path, fmt = monthcache.find(preprocesspath, name)
+    if cache_path is None:
+        return 'not cached'
+
+    manifest = load(preprocesspath, name)
+    if manifest is None:
+        return 'no manifest'
+    if manifest.get('sources')!=fingerprint['sources']:
+        return 'source files changed'
+    if manifest.get('config')!=fingerprint['config']:
+        return 'config changed'
+    if manifest.get('code')!=fingerprint['code']:
+        return 'code changed'
+    return None
+
+def status(station, paths=None):
+    """
+    Checks the cache of every month of a station
+    Returns a dictionary of month key -> None for
+    a cache hit, or the reason for the miss
+
+    paths - the station's files by month (found
+        with filesearch if None)
+    """
+
+    indir, pattern, outpath, preprocesspath = stationPaths(station)
+    if paths is None:
+        import filesearch
+        paths = filesearch.run(indir, pattern)
+
+    results = {}
+    for month in sorted(paths):
+        name = station+month.strftime("_%Y_%m")
+        results[month] = check(preprocesspath, name, fingerprint(station, paths[month]))
+    return results
+
+def main(argv):
+    stations = argv or list(CONFIG['stations'])
+
+    total_hits = 0
+    total_misses = 0
+    for station in stations:
+        try:
+            results = status(station)
+        except FileNotFoundError:
+            print('Station "'+station+'": source folder not found')
+            continue
+
+        hits = sum(1 for reason in results.values() if reason is None)
+        misses = len(results)-hits
+        total_hits += hits
+        total_misses += misses
+
+        print('Station "'+station+'": '+str(hits)+' hits, '+str(misses)+' misses')
+        for month, reason in results.items():
+            if reason is not None:
+                print('\t'+month.strftime('%Y-%m')+'\t'+reason)
+
+    print('Total: '+str(total_hits)+' hits, '+str(total_misses)+' misses')
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,223 @@
+"""
+Cache of the gap-filled months. Every month that
+has been loaded, validated and gap-filled is saved
+to the destination-filtered folder, so reruns can
+skip straight to deciding on the TMY months
+
+The cache format is set by cache-format in the
+processing block of config.yml:
+feather - Feather file (needs pyarrow)
+npz - numpy bundle, one array per column
+csv - plain .csv file (slow to read back)
+auto - feather if pyarrow is installed, else npz
+
+The binary formats keep the timezone of the index
+and the dtypes of the columns exactly. Set
+cache-csv to also write a .csv copy for humans
+
+numpy, pandas and pyarrow are only imported when
+months are saved or read, so finding cached
+months (e.g. python manifest.py) starts quickly
+"""
+
+import os
+import json
+import logging
+import datetime
+import importlib.util
+
+from config_parse import CONFIG
+
+FORMATS = ['feather', 'npz', 'csv']
+EXTENSIONS = {'feather': '.feather', 'npz': '.npz', 'csv': '.csv'}
+METADATA_KEY = b'onetmy'
+
+def settings():
+    """
+    Returns the processing block of config.yml
+    """
+    return CONFIG.get('processing') or {}
+
+def hasPyarrow():
+    return importlib.util.find_spec('pyarrow') is not None
+
+def cacheFormat():
+    """
+    The format new months are cached in
+    """
+    fmt = settings().get('cache-format') or 'auto'
+    if fmt=='auto':
+        return 'feather' if hasPyarrow() else 'npz'
+    if fmt not in FORMATS:
+        raise ValueError('Unknown cache format "'+str(fmt)+'"')
+    if fmt=='feather' and not hasPyarrow():
+        logging.warning('pyarrow is not installed. Caching as npz instead of feather')
+        return 'npz'
+    return fmt
+
+def cachePath(preprocesspath, name, fmt):
+    return os.path.normpath(preprocesspath+'/'+name+EXTENSIONS[fmt])
+
+def find(preprocesspath, name):
+    """
+    Looks for a cached month. The configured format
+    is tried first, then the other formats (e.g.
+    .csv files of older runs)
+    Returns the path and format, or None, None if
+    the month isn't cached
+    """
+    preferred = cacheFormat()
+    for fmt in [preferred]+[x for x in FORMATS if x!=preferred]:
+        if fmt=='feather' and not hasPyarrow():
+            continue
+        path = cachePath(preprocesspath, name, fmt)
+        if os.path.exists(path):
+            return path, fmt
+    return None, None
+
+def tzSpec(tz):
+    """
+    Describes the timezone of an index so it can
+    be stored with the data
+    """
+    import pytz
+    if tz is None:
+        return None
+    if isinstance(tz, datetime.timezone):
+        return {'type': 'timezone', 'seconds': tz.utcoffset(None).total_seconds()}
+    if isinstance(tz, pytz._FixedOffset):
+        return {'type': 'fixed', 'minutes': tz.utcoffset(None).total_seconds()/60}
+    return {'type': 'zone', 'name': str(tz)}
+
+def tzFromSpec(spec):
+    """
+    Timezone described by tzSpec()
+    """
+    import pytz
+    if spec is None:
+        return None
+    if spec['type']=='timezone':
+        return datetime.timezone(datetime.timedelta(seconds=spec['seconds']))
+    if spec['type']=='fixed':
+        return pytz.FixedOffset(int(spec['minutes']))
+    return pytz.timezone(spec['name'])
+
+def metadata(df):
+    return {
+        'index-name': df.index.name,
+        'tz': tzSpec(df.index.tz),
+        'columns': [str(x) for x in df.columns],
+    }
+
+def saveNpz(df, path):
+    import numpy as np
+    arrays = {'index': df.index.asi8}
+    for i, column in enumerate(df.columns):
+        arrays['column_'+str(i)] = df[column].values
+    arrays['metadata'] = np.array(json.dumps(metadata(df)))
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+def readNpz(path):
+    import numpy as np
+    import pandas as pd
+    with np.load(path, allow_pickle=False) as bundle:
+        meta = json.loads(str(bundle['metadata']))
+        index = pd.DatetimeIndex(bundle['index'].view('datetime64[ns]'), name=meta['index-name'])
+        columns = {column: bundle['column_'+str(i)] for i, column in enumerate(meta['columns'])}
+    index = restoreTz(index, meta['tz'])
+    return pd.DataFrame(columns, index=index, copy=False)
+
+def saveFeather(df, path):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[METADATA_KEY] = json.dumps(metadata(df)).encode()
+    table = table.replace_schema_metadata(schema_metadata)
+    feather.write_feather(table, path)
+
+def readFeather(path):
+    import pyarrow.feather as feather
+    table = feather.read_table(path)
+    meta = json.loads(table.schema.metadata[METADATA_KEY])
+    df = table.to_pandas()
+    # Arrow keeps the offset but not the kind of
+    # timezone object, so it is restored as well
+    index = df.index
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    df.index = restoreTz(index, meta['tz']).rename(meta['index-name'])
+    return df
+
+def restoreTz(index, spec):
+    """
+    Puts the timezone back on an index of naive
+    UTC timestamps
+    """
+    tz = tzFromSpec(spec)
+    if tz is None:
+        return index
+    return index.tz_localize('UTC').tz_convert(tz)
+
+def save(df, preprocesspath, name, csv_copy=True):
+    """
+    Caches a gap-filled month, plus a .csv copy if
+    cache-csv is set (and csv_copy is True)
+    """
+
+    import tmy
+    fmt = cacheFormat()
+    path = cachePath(preprocesspath, name, fmt)
+
+    if fmt=='csv':
+        tmy.export.to_csv(df, path)
+        return path
+
+    logging.info('Caching to '+path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Written under a temporary name first, so a
+    # worker that gets stopped halfway through never
+    # leaves a partial file behind
+    tmp_path = path+'.tmp'
+    if fmt=='feather':
+        saveFeather(df, tmp_path)
+    else:
+        saveNpz(df, tmp_path)
+    os.replace(tmp_path, path)
+
+    if csv_copy and settings().get('cache-csv'):
+        tmy.export.to_csv(df, cachePath(preprocesspath, name, 'csv'))
+
+    return path
+
+def read(path, fmt):
+    """
+    Reads a cached month
+    """
+    if fmt=='feather':
+        return readFeather(path)
+    if fmt=='npz':
+        return readNpz(path)
+    import pandas as pd
+    return pd.read_csv(path, parse_dates=True, index_col=0)
+
+def load(preprocesspath, name):
+    """
+    Loads a cached month. Months cached as .csv by
+    older runs are converted to the configured
+    format, so they load quickly next time
+    Returns None if the month isn't cached
+    """
+    path, fmt = find(preprocesspath, name)
+    if path is None:
+        return None
+
+    df = read(path, fmt)
+
+    if fmt=='csv' and cacheFormat()!='csv':
+        logging.info('Converting '+path+' to '+cacheFormat())
+        save(df, preprocesspath, name, csv_copy=False)
+
+    return df
@@ -2,21 +2,42 @@ import yaml
 import logging
 import logging.config
 import os
+import sys
+import time
+import datetime
+import multiprocessing
+import concurrent.futures
 import pandas as pd
 import load
-from config_parse import CONFIG, HEADER_MAP
+from config_parse import CONFIG, HEADER_MAP, stationPaths
 import fill
 import filesearch
 import validation
+import ranking
+import monthcache
+import manifest
+import tmystate
+import planner
+import instrument
 import tmy
 import pytz
 
-def processMonth(station, paths):
+LOGCONFIG_VARIABLE = 'ONETMY_LOGCONFIG'
+
+def processMonth(station, paths, preprocesspath, low_memory=None, outcome=None):
 	"""
 	Processes a calendar month (e.g. all Jan
 	files) for a station. Returns the month key
 	and month datafile for the month that needs
 	to be put in the TMY (all processing complete)
+
+	preprocesspath - folder for the gap-filled
+	data of this station
+	low_memory - rank from month summaries. None
+	uses low-memory in the processing block of
+	config.yml
+	outcome - optional dict for the candidates and
+	replaced days (see decideMonth)
 	"""
 
 	if len(paths)==0:
@@ -26,30 +47,81 @@ def processMonth(station, paths):
 
 	calendar_month = list(paths.keys())[0].strftime('%B')
 
-	
-	
+	if low_memory is None:
+		low_memory = CONFIG.get('processing', {}).get('low-memory', False)
+
+	with instrument.scope(list(paths.keys())[0].month):
+		data = prepareMonths(station, paths, preprocesspath, low_memory)
+		return decideMonth(station, data, calendar_month, preprocesspath, low_memory, outcome=outcome)
+
+def prepareMonths(station, paths, preprocesspath, low_memory):
+	"""
+	Loads, validates and gap-fills the months of a
+	calendar month, or reads them back from the
+	cache
+	Returns a dictionary of month key -> dataframe
+	(or tmy.summary.MonthSummary in low-memory
+	mode)
+
+	Arguments as for processMonth
+	"""
+
 	# Data is a dictionary with keys that are
 	# datetime.datetime objects, values that are
 	# dataframes
+	# In low-memory mode, only a summary of each
+	# month is kept (tmy.summary.MonthSummary), and
+	# the best candidates are reloaded from the
+	# cache after ranking. The samples of the
+	# summaries are read back from their files
+	# through a cache of at most low-memory-mb
 	data = {}
+	variables = tmy.decide.scoreVariables()
+	coarse_resolution = tmy.decide.coarseResolution()
+	samples_cache = None
+	if low_memory:
+		samples_cache = tmy.summary.MemoryCache(CONFIG.get('processing', {}).get('low-memory-mb') or tmy.summary.SAMPLES_CACHE_MB)
 
 	for month in paths:	# remember: month is a datetime object
 
 		name = station+month.strftime("_%Y_%m")
-		out_path = os.path.normpath(preprocesspath+'/'+name+'.csv')
 		
-		if not os.path.exists(out_path):
+		# Gap-filled months from previous runs are
+		# read back from the cache (see monthcache.py),
+		# as long as their source files, config and
+		# code haven't changed (see manifest.py)
+		fingerprint = manifest.fingerprint(station, paths[month])
+		reason = manifest.check(preprocesspath, name, fingerprint)
+		tag = manifest.hashJson(fingerprint)
+		df = None
+		if reason is None:
+			# The saved summary of a cached month is
+			# all low-memory mode needs
+			if low_memory:
+				month_summary = tmy.summary.load(preprocesspath, name, variables, tag, coarse_resolution, samples_cache)
+				if month_summary is not None:
+					logging.info('Loading summary of existing '+str(month))
+					data[month] = month_summary
+					continue
+			df = monthcache.load(preprocesspath, name)
+		else:
+			logging.info('Cache miss for '+str(month)+': '+reason)
+		if df is None:
 			# Load any files associated with this particular month
 			#logging.info('Loading...')
-			df = load.load(paths[month], station, month.year, month.month)
+			with instrument.stage('load') as record:
+				df = load.load(paths[month], station, month.year, month.month)
+				record['rows'] = 0 if df is None else len(df)
 			
 			if df is None:
 				logging.warning('Skipping this month')
 				continue
 			logging.info('Validation...')
 			# Run some validation to check we should keep going
-			validation.removePatchyColumns(df, 0.7)
-			if not validation.requiredColumns(df):
+			with instrument.stage('validation', len(df)):
+				validation.removePatchyColumns(df, validation.COLUMN_REQUIREMENT)
+				required = validation.requiredColumns(df)
+			if not required:
 				logging.warning('Required columns not present in dataframe. Skipping this month')
 				continue
 			logging.info('Fill gaps...')
@@ -58,26 +130,62 @@ def processMonth(station, paths):
 			# logical filling and interpolation, as specified by
 			# our theory. If we don't meet the requirement, quit
 			# this month
-			fill_success = fill.fill(df, station)
+			fill_success = fill.fill(df, station, validation.DATA_REQUIREMENT)
 			if not fill_success: continue
 
 			logging.info('Successful load of '+str(month))
-			data[month] = df
-			
-			# exporting gap-filled data
-			tmy.export.to_csv(df, out_path)
 			
+			# caching gap-filled data
+			monthcache.save(df, preprocesspath, name)
+			manifest.save(preprocesspath, name, fingerprint)
 			
 		else:
 			logging.info('Loading of existing '+str(month))
-			df = pd.read_csv(out_path, parse_dates=True, index_col=0)
+
+		if low_memory:
+			# The summary is saved next to the cached
+			# month, so later low-memory runs and
+			# updates (see updateStation) can rank it
+			# without loading it
+			month_summary = tmy.summary.MonthSummary(df, month.month, variables, coarse_resolution)
+			tmy.summary.save(month_summary, preprocesspath, name, tag)
+			month_summary.release(tmy.summary.summaryPath(preprocesspath, name), samples_cache)
+			data[month] = month_summary
+		else:
 			data[month] = df
+		del df
+
+	return data
+
+def decideMonth(station, data, calendar_month, preprocesspath, low_memory, save_scores=True, statistics=None, loaded=None, outcome=None):
+	"""
+	Decides on the month of a calendar month that
+	goes in the TMY, and fills its remaining gaps.
+	Returns the month key and dataframe, or None,
+	None if it failed
+
+	data - from prepareMonths. Its dataframes are
+	removed as they are stacked
+	calendar_month - name of the calendar month
+	save_scores - save the score matrix (see
+	ranking.py)
+	statistics - tmy.windows.SharedStatistics of
+	the summaries (low-memory mode only)
+	loaded - optional dict of the months reloaded
+	from the cache in low-memory mode, to reuse and
+	add to
+	outcome - optional dict that the ranked and
+	extended candidates and the replaced days (see
+	tmy.polish.fillRemainingGaps) are stored in
+	"""
 
 	# Check to see if we have enough of this
 	# calendar month to continue. If we don't,
 	# the TMY can't be made and we should quit
 	# the processing of this month
-	if not validation.month(list(data.keys()), 10):
+	with instrument.stage('validation'):
+		enough = validation.month(list(data.keys()), CONFIG['tmy']['min-years'])
+	if not enough:
 		logging.error('Not enough data for this calendar month('+calendar_month+'). Quitting processing of station "'+station+'"')
 		return None, None
 
@@ -89,14 +197,64 @@ def processMonth(station, paths):
 	#	path = os.path.normpath(dir+name+'.pkl')
 	#	df.to_pickle(path)
 
+	# Hold the whole calendar month in one array
+	# (years x minutes x variables) for deciding
+	# and gap filling. The dataframes are dropped
+	# from data as they are copied in, so the
+	# calendar month isn't held twice
+	if not low_memory:
+		data = stackMonths(data, calendar_month, release=True)
+
 	# This entire calendar month has been loaded.
 	# Decide on which one we want in the TMY
 	# (winner is first in the returned list)
-	ranked_candidates, extented_candidates = tmy.decide.month(data)
+	# The days with gaps found while deciding are
+	# reused by the gap replace step
+	# The score matrix is saved so the month can be
+	# re-ranked later (see ranking.py)
+	gap_days = {}
+	scores_path = None
+	if save_scores:
+		scores_path = ranking.scoresPath(preprocesspath, station, list(data.keys())[0].month)
+	with instrument.stage('decide', totalRows(data)) as record:
+		ranked_candidates, extented_candidates = tmy.decide.month(data, gap_days, scores_path, statistics)
+		if low_memory:
+			summary_size = sum(x.nbytes() for x in data.values())
+			samples_cache = tmy.summary.samplesCache(data)
+			samples_size = 0 if samples_cache is None else samples_cache.peak_bytes
+			record['summaries-mb'] = round((summary_size+samples_size)/1e6, 1)
+
+	if low_memory:
+		# Only the candidates are needed from here on
+		candidates = list(dict.fromkeys(list(ranked_candidates)+list(extented_candidates)))
+		if loaded is None:
+			loaded = {}
+		data = {}
+		for month in candidates:
+			if month not in loaded:
+				loaded[month] = monthcache.load(preprocesspath, station+month.strftime("_%Y_%m"))
+			if loaded[month] is None:
+				logging.error('Could not reload '+str(month)+' from the cache. Quitting processing of station "'+station+'"')
+				return None, None
+			data[month] = loaded[month]
+		data = stackMonths(data, calendar_month)
+		if not isinstance(data, tmy.MonthStack):
+			# The gaps are filled in place
+			data = {month: df.copy() for month, df in data.items()}
+		logging.info('Low-memory mode: kept %.1f MB of month summaries and at most %.1f MB of their samples, reloaded %d candidates. Peak memory %s',
+			summary_size/1e6, samples_size/1e6, len(candidates), instrument.peakMemory())
 
 	# Execute the final gap replace step on the
 	# winner, using the other candidates as 'spare parts'
-	winning_key, winning_df = tmy.polish.fillRemainingGaps(data, ranked_candidates, extented_candidates)
+	if outcome is None:
+		outcome = {}
+	outcome['ranked'] = list(ranked_candidates)
+	outcome['extended'] = list(extented_candidates)
+	outcome['replaced'] = {}
+	with instrument.stage('polish') as record:
+		winning_key, winning_df = tmy.polish.fillRemainingGaps(data, ranked_candidates, extented_candidates,
+			gap_days, outcome['replaced'])
+		record['rows'] = len(winning_df)
 	
 	if winning_df.isnull().values.any():
 		logging.warning('TMY generation for %s of station %s still has some gaps.', calendar_month, station)
@@ -106,7 +264,86 @@ def processMonth(station, paths):
 
 
 
-def processStation(station, source_dir, pattern, outpath):
+def stackMonths(data, calendar_month, release=False):
+	"""
+	Stacks a dictionary of months into a
+	tmy.MonthStack. Returns the dictionary if
+	the months can't be stacked
+
+	release - see tmy.MonthStack.fromDict
+	"""
+	try:
+		return tmy.MonthStack.fromDict(data, release=release)
+	except ValueError as e:
+		logging.warning('Could not stack '+calendar_month+' ('+str(e)+'). Using separate dataframes')
+		return data
+
+def totalRows(data):
+	"""
+	Number of rows of all months of a calendar
+	month (dataframes, a MonthStack or summaries)
+	"""
+	if isinstance(data, tmy.MonthStack):
+		return int(data.minutes.sum())
+	return sum(x.rows if isinstance(x, tmy.summary.MonthSummary) else len(x) for x in data.values())
+
+def processMonthTask(args):
+	"""
+	Runs processMonth in a worker process.
+	args is a tuple of processMonth's arguments
+	Returns the month key and dataframe, its
+	outcome (see decideMonth) and the stages it
+	recorded (see instrument.py)
+	"""
+	instrument.reset(args[0])
+	outcome = {}
+	winning_key, winning_df = processMonth(*args, outcome=outcome)
+	return winning_key, winning_df, outcome, instrument.records()
+
+def processMonthsParallel(station, paths_subsets, preprocesspath, workers, outcomes=None, order=None):
+	"""
+	Processes the calendar months of a station in
+	a pool of worker processes. As soon as one
+	calendar month fails, the remaining months are
+	cancelled, as the station can't be completed
+	Returns the dictionary of winning months, or
+	None if any calendar month failed
+
+	paths_subsets - dictionary of calendar month
+	number -> paths dictionary of that month
+	outcomes - optional dict that the outcome of
+	each calendar month is stored in (see
+	processStation)
+	order - the calendar months in the order they
+	are started (default: January first)
+	"""
+
+	logging.info('Processing calendar months with %d workers', workers)
+
+	tmy_months = {}
+	tasks = [(station, paths_subsets[m], preprocesspath) for m in (order or sorted(paths_subsets))]
+	pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=initWorker, initargs=(station,))
+	try:
+		for winning_key, winning_df, outcome, records in pool.imap_unordered(processMonthTask, tasks):
+			instrument.extend(records)
+			if outcomes is not None and 'ranked' in outcome:
+				outcomes[outcome['ranked'][0].month] = outcome
+			if winning_key is None:
+				# Processing month failed. Stop the
+				# months that are still running
+				logging.info('Cancelling remaining calendar months of station "'+station+'"')
+				return None
+			tmy_months[winning_key] = winning_df
+	except Exception:
+		logging.exception('Calendar month worker failed for station "'+station+'"')
+		return None
+	finally:
+		pool.terminate()
+		pool.join()
+
+	return tmy_months
+
+def processStation(station, source_dir, pattern, outpath, preprocesspath, outcomes=None):
 	"""
 	Creates the TMY for a station
 	returns True or False if its successful
@@ -116,121 +353,466 @@ def processStation(station, source_dir, pattern, outpath):
 	source_dir - directory to search for data files
 	pattern - regex pattern used to find files
 	outpath - path for the output TMY file
+	preprocesspath - folder for the gap-filled data
+	outcomes - optional dict that the outcome of
+	each calendar month (see decideMonth) is stored
+	in, by calendar month number
+	"""
+
+	paths = findFiles(station, source_dir, pattern)
+	if paths is None:
+		return False
+
+
+	#subset = {}
+	#for key in paths:
+	#	if key.month==1 and key.year>2003 and key.year<2008:
+	#		subset[key] = paths[key]
+	#paths = subset
+
+
+	# Load and gap fill the files
+	logging.info('Starting load process')
+	tmy_months = {}
+
+	paths_subsets = calendarMonths(paths)
+
+	# Skip stations that can't be completed, and
+	# start with the calendar month most likely to
+	# fail
+	order = planStation(station, paths, preprocesspath)
+	if order is None:
+		return False
+
+	month_workers = CONFIG.get('processing', {}).get('month-workers') or 1
+	if month_workers>1:
+		tmy_months = processMonthsParallel(station, paths_subsets, preprocesspath, month_workers, outcomes, order)
+		if tmy_months is None:
+			return False
+	else:
+		# Loop through each calendar month. This
+		# allows you to decide on which one you
+		# want in the TMY at the end of the loop,
+		# and dump any unnecessary data at the same
+		# time
+		for month_no in order:
+
+			# Process this calendar month. Put the
+			# winning month in the TMY dictionary
+			outcome = {}
+			winning_key, winning_df = processMonth(station, paths_subsets[month_no], preprocesspath, outcome=outcome)
+			if outcomes is not None and 'ranked' in outcome:
+				outcomes[month_no] = outcome
+			if winning_key is None:
+				# Processing month failed
+				# Quit processing of station
+				return False
+			tmy_months[winning_key] = winning_df
+
+	# Keep the winners, so the TMY can be updated
+	# one calendar month at a time
+	tmystate.record(preprocesspath, station, paths_subsets, tmy_months)
+
+	writeTmy(tmy_months, outpath)
+	return True
+
+def findFiles(station, source_dir, pattern):
+	"""
+	Finds the data files of a station
+	Returns the dictionary of month key -> paths,
+	or None if there aren't enough
 	"""
 
 	# Find files. If we didn't find any,
 	# or if we don't have enough, quit
 	try:
-		paths = filesearch.run(source_dir, pattern)
+		with instrument.stage('filesearch') as record:
+			paths = filesearch.run(source_dir, pattern)
+			record['rows'] = len(paths)
 	except FileNotFoundError:
 		logging.warning(source_dir+' is not a directory. Skipping processing of this station')
-		return False
+		return None
 
 	if not paths:
 		logging.warning('No files found. Quitting processing of station "'+station+'"')
-		return False
+		return None
 
 	dates = list(paths.keys())
 	if not validation.months(dates, CONFIG['tmy']['min-years']):
 		logging.warning('Data requirement not satisfied. Quitting processing of station "'+station+'"')
-		return False
+		return None
 
+	return paths
 
-	#subset = {}
-	#for key in paths:
-	#	if key.month==1 and key.year>2003 and key.year<2008:
-	#		subset[key] = paths[key]
-	#paths = subset
+def planStation(station, paths, preprocesspath):
+	"""
+	Pre-flight check of a station (see planner.py),
+	unless plan is disabled in the processing block
+	of config.yml
+	Returns the calendar month numbers in the order
+	to process them (worst first), or None if a
+	calendar month can't have enough good months
+	"""
 
+	if not planner.enabled():
+		return list(range(1, 13))
 
-	# Load and gap fill the files
-	logging.info('Starting load process')
-	tmy_months = {}
-
-	# Loop through each calendar month. This
-	# allows you to decide on which one you
-	# want in the TMY at the end of the loop,
-	# and dump any unnecessary data at the same
-	# time
+	try:
+		with instrument.stage('plan', len(paths)):
+			station_plan = planner.plan(station, paths, preprocesspath)
+	except Exception:
+		logging.exception('Planning of station "'+station+'" failed. Processing the calendar months in order')
+		return list(range(1, 13))
+
+	output = ''
+	for month_no, counts in station_plan['calendar-months'].items():
+		month_name = datetime.datetime(2000, month_no, 1).strftime('%B')
+		output += '\n\t'+month_name.ljust(9)+'\t'+'  '.join(status+' '+str(counts[status]) for status in planner.STATUSES if counts[status])
+	logging.debug('Plan of station "'+station+'":'+output)
+
+	if not station_plan['feasible']:
+		names = [datetime.datetime(2000, month_no, 1).strftime('%B') for month_no in station_plan['infeasible']]
+		logging.warning('Not enough good months of '+', '.join(names)+' (min-years '+str(CONFIG['tmy']['min-years'])+'). Skipping station "'+station+'"')
+		return None
+
+	logging.info('Processing calendar months in the order '+str(station_plan['order']))
+	return station_plan['order']
+
+def calendarMonths(paths):
+	"""
+	Creates a subset of the paths dictionary for
+	each calendar month. Each subset only has path
+	lists for files of that calendar month
+	Returns a dictionary of calendar month number
+	-> subset
+	"""
+	paths_subsets = {}
 	for month_no in range(1, 13):
-
-		# Create a subset of the paths dictionary
-		# The subset only has path lists for files
-		# of a specific calendar month
-		paths_subset = {}
+		paths_subsets[month_no] = {}
 		for key in paths:
 			if key.month==month_no:
-				paths_subset[key] = paths[key]
+				paths_subsets[month_no][key] = paths[key]
+	return paths_subsets
 
-		# Process this calendar month. Put the
-		# winning month in the TMY dictionary
-		winning_key, winning_df = processMonth(station, paths_subset)
-		if winning_key is None:
-			# Processing month failed
-			# Quit processing of station
-			return False
-		tmy_months[winning_key] = winning_df
+def writeTmy(tmy_months, outpath):
+	"""
+	Joins the winning months into the TMY and
+	exports it (unless it still has gaps)
 
-	# Join all of those datafiles
-	df = tmy.export.merge(tmy_months)
+	tmy_months - dictionary of the winning month
+	keys -> dataframes
+	"""
 
-	# Smooth interfaces between different years
-	tmy.polish.smooth(df, 4*60)
+	with instrument.stage('export', sum(len(df) for df in tmy_months.values())):
+		# Join all of those datafiles
+		df = tmy.export.merge(tmy_months)
 
-	if df.isnull().values.any():
-		logging.warning('Dataset still contains gaps! Please check!!')
-	else:
-		# Export to a file
-		tmy.export.to_csv(df, outpath)
+		# Smooth interfaces between different years
+		tmy.polish.smooth(df, 4*60)
+
+		if df.isnull().values.any():
+			logging.warning('Dataset still contains gaps! Please check!!')
+		else:
+			# Export to a file
+			tmy.export.to_csv(df, outpath)
 		
-		#apply_offset = CONFIG['stations'][station]['apply_offset']
-		#offset = CONFIG['stations'][station]['offset']
-		#if offset!=apply_offset:
-	#		df = df.tz_convert(pytz.FixedOffset(apply_offset))
+			#apply_offset = CONFIG['stations'][station]['apply_offset']
+			#offset = CONFIG['stations'][station]['offset']
+			#if offset!=apply_offset:
+		#		df = df.tz_convert(pytz.FixedOffset(apply_offset))
 			
-		df.reset_index(inplace=True)
-		df['Year'] = pd.DatetimeIndex(df['datetime']).year
-		df['Month'] = pd.DatetimeIndex(df['datetime']).month
-		df['Day'] = pd.DatetimeIndex(df['datetime']).day
-		df['Hour'] = pd.DatetimeIndex(df['datetime']).hour
-		df['Minute (Local Standard Time)'] = pd.DatetimeIndex(df['datetime']).minute
-		del df['datetime']
+			df.reset_index(inplace=True)
+			df['Year'] = pd.DatetimeIndex(df['datetime']).year
+			df['Month'] = pd.DatetimeIndex(df['datetime']).month
+			df['Day'] = pd.DatetimeIndex(df['datetime']).day
+			df['Hour'] = pd.DatetimeIndex(df['datetime']).hour
+			df['Minute (Local Standard Time)'] = pd.DatetimeIndex(df['datetime']).minute
+			del df['datetime']
 		
-		for new_header in HEADER_MAP:
-			old_header = HEADER_MAP[new_header]
-			if new_header in df:
-				df.rename(columns={new_header:old_header}, inplace=True)
+			for new_header in HEADER_MAP:
+				old_header = HEADER_MAP[new_header]
+				if new_header in df:
+					df.rename(columns={new_header:old_header}, inplace=True)
 		
-		cols = df.columns.tolist()
-		cols = cols[-1:] + cols[:-1]
-		cols = cols[-1:] + cols[:-1]
-		cols = cols[-1:] + cols[:-1]
-		cols = cols[-1:] + cols[:-1]
-		cols = cols[-1:] + cols[:-1]
-		df = df[cols]
+			cols = df.columns.tolist()
+			cols = cols[-1:] + cols[:-1]
+			cols = cols[-1:] + cols[:-1]
+			cols = cols[-1:] + cols[:-1]
+			cols = cols[-1:] + cols[:-1]
+			cols = cols[-1:] + cols[:-1]
+			df = df[cols]
 		
-		tmy.export.to_csv_no_index(df, outpath.replace(".csv","_formattedHeader.csv"))
+			tmy.export.to_csv_no_index(df, outpath.replace(".csv","_formattedHeader.csv"))
+
+def updateStation(station, source_dir, pattern, outpath, preprocesspath):
+	"""
+	Updates the TMY of a station with new months of
+	data (e.g. the monthly delivery of new files).
+	Only the calendar months with new, changed or
+	removed months are decided again, ranked from
+	the saved month summaries, so only the new
+	months are loaded and gap-filled. The TMY is
+	only rewritten if a winner changes
+	Stations without a recorded TMY (see
+	tmystate.py) are processed in full
+	returns True or False if its successful
+
+	Arguments as for processStation
+	"""
+
+	state = tmystate.load(preprocesspath, station)
+	if state is None:
+		logging.info('No recorded TMY for station "'+station+'". Processing all months')
+		return processStation(station, source_dir, pattern, outpath, preprocesspath)
+
+	paths = findFiles(station, source_dir, pattern)
+	if paths is None:
+		return False
+	paths_subsets = calendarMonths(paths)
+
+	changed = tmystate.changedCalendarMonths(state, station, paths_subsets)
+
+	# The other calendar months keep their winners
+	tmy_months = {}
+	for month_no in range(1, 13):
+		if month_no in changed:
+			continue
+		winning_key, winning_df = tmystate.loadWinner(preprocesspath, station, state, month_no)
+		if winning_key is None:
+			logging.info('Winner of calendar month '+str(month_no)+' not found. Deciding it again')
+			changed.append(month_no)
+			continue
+		tmy_months[winning_key] = winning_df
+
+	if not changed and os.path.exists(outpath):
+		logging.info('TMY of station "'+station+'" is up to date')
+		return True
+
+	logging.info('Updating calendar months '+str(sorted(changed)))
+	new_winners = {}
+	winner_changed = False
+	for month_no in sorted(changed):
+		winning_key, winning_df = processMonth(station, paths_subsets[month_no], preprocesspath, low_memory=True)
+		if winning_key is None:
+			# Processing month failed
+			# Quit processing of station
+			return False
+		new_winners[winning_key] = winning_df
+
+		previous_key, previous_df = tmystate.loadWinner(preprocesspath, station, state, month_no)
+		if previous_key!=winning_key or not winning_df.equals(previous_df):
+			logging.info('New winner for calendar month '+str(month_no)+': '+str(winning_key)+' (was '+str(previous_key)+')')
+			winner_changed = True
+
+	tmystate.record(preprocesspath, station, paths_subsets, new_winners, state)
+	tmy_months.update(new_winners)
+
+	if not winner_changed and os.path.exists(outpath):
+		logging.info('No winner changed. Keeping the TMY of station "'+station+'"')
+		return True
+
+	writeTmy(tmy_months, outpath)
 	return True
 
 
 
-# Set up logger
-with open('logconfig.yml', 'r') as f:
-	logconfig = yaml.safe_load(f.read())
+def windowPath(outpath, first, last):
+	"""
+	Output path of the TMY of a window of years
+	"""
+	root, ext = os.path.splitext(outpath)
+	return root+'_{}-{}'.format(first, last)+ext
+
+def processWindows(station, source_dir, pattern, outpath, preprocesspath, periods=None):
+	"""
+	Creates one TMY of a station for each window of
+	years (e.g. 2000-2014, 2001-2015, ...). Every
+	month is loaded and gap-filled (or read back
+	from the cache) only once. The years are
+	summarised, so the long-term statistics of
+	each window are added up from its years
+	instead of being sorted again (see
+	tmy.windows), and the candidates of all windows
+	are reloaded from the cache only once
+	returns True if the TMYs of all windows were
+	created
+
+	periods - list of the windows of years, as in
+	windows in the tmy block of config.yml (which
+	is used if None)
+	Other arguments as for processStation
+	"""
+
+	paths = findFiles(station, source_dir, pattern)
+	if paths is None:
+		return False
+	paths_subsets = calendarMonths(paths)
+
+	if periods is None:
+		periods = CONFIG['tmy'].get('windows')
+	periods = tmy.windows.periods(periods, sorted({key.year for key in paths}))
+	if not periods:
+		logging.warning('No windows of years defined. Quitting processing of station "'+station+'"')
+		return False
+	logging.info('Windows: '+', '.join('{}-{}'.format(*period) for period in periods))
+
+	window_months = {period: {} for period in periods}
+	failed = set()
+	for month_no in range(1, 13):
+		if len(paths_subsets[month_no])==0:
+			logging.error('No files for calendar month '+str(month_no)+'. Quitting processing of station "'+station+'"')
+			return False
+		calendar_month = list(paths_subsets[month_no].keys())[0].strftime('%B')
+
+		with instrument.scope(month_no):
+			summaries = prepareMonths(station, paths_subsets[month_no], preprocesspath, True)
+			statistics = tmy.windows.SharedStatistics(summaries, CONFIG.get('processing', {}).get('windows-cache-mb'))
+			loaded = {}
+
+			for period in periods:
+				if period in failed:
+					continue
+				first, last = period
+				logging.info('Window {}-{}'.format(first, last))
+				subset = {key: summary for key, summary in summaries.items() if first<=key.year<=last}
+				winning_key, winning_df = decideMonth(station, subset, calendar_month, preprocesspath, True,
+					save_scores=False, statistics=statistics, loaded=loaded)
+				if winning_key is None:
+					failed.add(period)
+					continue
+				window_months[period][winning_key] = winning_df
+
+	for period in periods:
+		if period in failed:
+			logging.warning('TMY of window {}-{} of station "{}" failed'.format(period[0], period[1], station))
+			continue
+		writeTmy(window_months[period], windowPath(outpath, *period))
+
+	return not failed
+
+def setupLogging(stream_name=None):
+	"""
+	Configures the logger from logconfig.yml (or
+	the file in the ONETMY_LOGCONFIG environment
+	variable). If stream_name is given, the log
+	file is suffixed with it so each worker process
+	writes to its own log file
+	Logging is left as it is if there's no such
+	file (e.g. when OneTMY is used as a library)
+	"""
+	path = os.environ.get(LOGCONFIG_VARIABLE) or 'logconfig.yml'
+	if not os.path.exists(path):
+		return
+
+	with open(path, 'r') as f:
+		logconfig = yaml.safe_load(f.read())
+
+	if stream_name is not None:
+		for handler in logconfig.get('handlers', {}).values():
+			if 'filename' in handler:
+				root, ext = os.path.splitext(handler['filename'])
+				handler['filename'] = root+'_'+stream_name+ext
+
 	logging.config.dictConfig(logconfig)
 
+def initWorker(prefix=None):
+	"""
+	Initialiser for the worker processes. Gives
+	each worker its own log stream. prefix is
+	added to the stream name (e.g. the station
+	of calendar month workers)
+	"""
+	name = multiprocessing.current_process().name
+	if prefix is not None:
+		name = prefix+'_'+name
+	setupLogging(name)
 
-for station_name in CONFIG['stations']:
-	logging.info('Processing station "'+station_name+'"')
+def runStation(station, update=False, windows=None):
+	"""
+	Processes one station. Used by both the serial
+	and the parallel scheduler, so one failing
+	station can't stop the rest of the batch
+	Returns True if the TMY was created
+
+	update - only update the TMY with new months
+	of data (see updateStation)
+	windows - create TMYs of windows of years
+	instead (see processWindows). A list of
+	periods, or True for the windows in config.yml
+	"""
 
-	station_info = CONFIG['stations'][station_name]
-	indir = os.path.normpath(CONFIG['folders']['source'] + '/' + station_name + '/')
-	pattern = CONFIG['folders']['pattern']
-	outpath = os.path.normpath(CONFIG['folders']['destination-tmy'].format(station_name))
-	preprocesspath = os.path.normpath(CONFIG['folders']['destination-filtered'] + '/' + station_name + '/')
+	logging.info('Processing station "'+station+'"')
+	instrument.reset(station)
+	start = time.perf_counter()
 
-	q = processStation(station_name, indir, pattern, outpath)
+	try:
+		if windows:
+			q = processWindows(station, *stationPaths(station), periods=None if windows is True else windows)
+		elif update:
+			q = updateStation(station, *stationPaths(station))
+		else:
+			q = processStation(station, *stationPaths(station))
+	except Exception:
+		logging.exception('Unexpected error while processing station "'+station+'"')
+		q = False
 
-	tmp = 'Processing of station "'+station_name+'"'
+	# Time and memory of each stage, next to the TMY
+	try:
+		instrument.report(stationPaths(station)[2], station, q, time.perf_counter()-start)
+	except Exception:
+		logging.exception('Could not write the run report of station "'+station+'"')
+
+	tmp = 'Processing of station "'+station+'"'
 	if q: logging.info(tmp+' was successful')
-	else: logging.info(tmp+' failed')
\ No newline at end of file
+	else: logging.info(tmp+' failed')
+	return q
+
+def run(stations, workers=None, update=False, windows=None):
+	"""
+	Processes a list of stations. If more than one
+	worker is requested, stations are processed
+	in a pool of worker processes, one station per
+	worker at a time
+	Returns a dictionary of station -> True/False
+
+	workers - number of worker processes. None
+	uses the number of cores
+	update - only update the TMYs with new months
+	of data (see updateStation)
+	windows - create TMYs of windows of years (see
+	runStation)
+	"""
+
+	if workers is None:
+		workers = os.cpu_count() or 1
+	workers = max(1, min(workers, len(stations)))
+
+	results = {}
+	if workers==1:
+		for station in stations:
+			results[station] = runStation(station, update, windows)
+	else:
+		logging.info('Processing %d stations with %d workers', len(stations), workers)
+		with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initWorker) as executor:
+			futures = {station: executor.submit(runStation, station, update, windows) for station in stations}
+			for station in stations:
+				try:
+					results[station] = futures[station].result()
+				except Exception:
+					# The worker process itself died
+					logging.exception('Worker for station "'+station+'" failed')
+					results[station] = False
+
+	# Summary of the whole batch
+	output = ''
+	for station in stations:
+		output += '\n\t'+station.ljust(9)+'\t'+('success' if results[station] else 'failed')
+	logging.info('Station summary:'+output)
+
+	return results
+
+
+if __name__=='__main__':
+	# Same as python pipeline.py run
+	import pipeline
+	pipeline.main(['run']+sys.argv[1:])
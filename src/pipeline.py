@@ -0,0 +1,283 @@
+"""
+Library API and command line of OneTMY
+
+Pipeline runs OneTMY with the configuration of a
+Config, so OneTMY can be driven from other Python
+code without a config.yml in the working directory:
+
+    from pipeline import Config, Pipeline
+    pipeline = Pipeline(Config('/data/onetmy/config.yml'))
+    pipeline.plan(['003003'])
+    pipeline.run(['003003'])
+
+Importing this module is cheap: the configuration
+is read when it is first used, and pandas, numpy
+and the TMY generator are only imported by run.
+So the commands that don't process data start
+quickly:
+
+python pipeline.py [--config PATH] run [stations] [--update] [--windows ...]
+python pipeline.py [--config PATH] plan [stations]
+python pipeline.py [--config PATH] rerank <stations> [--variables ...] [--weighting ...]
+python pipeline.py [--config PATH] cache-status [stations]
+
+python onetmy.py [stations] is the same as the run
+command
+"""
+
+import os
+import sys
+import argparse
+import datetime
+
+import config_parse
+
+class Config:
+    """
+    A configuration file (config.yml in the working
+    directory if path is None)
+
+    OneTMY's modules share the configuration of the
+    process (config_parse.CONFIG), so there is one
+    active configuration at a time: the one of the
+    Config last used by a Pipeline. Its path is kept
+    in the ONETMY_CONFIG environment variable, so
+    worker processes read the same file
+    """
+
+    def __init__(self, path=None):
+        self.path = os.path.abspath(path or config_parse.DEFAULT_PATH)
+        if not os.path.exists(self.path):
+            raise FileNotFoundError('Configuration file '+self.path+' not found')
+
+    def activate(self):
+        """
+        Makes this the configuration of the process
+        Returns the configuration dictionary
+        """
+        if config_parse.path()!=self.path:
+            config_parse.load(self.path)
+        return config_parse.CONFIG
+
+    def __getitem__(self, key):
+        return self.activate()[key]
+
+    def stations(self):
+        """
+        Names of the stations in the stations block
+        """
+        return list(self.activate()['stations'])
+
+class Pipeline:
+    """
+    Runs OneTMY with the configuration of a Config
+
+    log_config - logging configuration file, used
+        like logconfig.yml by run (which leaves
+        logging as it is if None)
+    """
+
+    def __init__(self, config=None, log_config=None):
+        self.config = config if config is not None else Config()
+        self.log_config = None if log_config is None else os.path.abspath(log_config)
+
+    def stations(self, stations=None):
+        return list(stations) if stations else self.config.stations()
+
+    def run(self, stations=None, update=False, windows=None, workers=None):
+        """
+        Creates the TMYs of stations (default: all
+        stations of the configuration)
+        Returns a dictionary of station -> True if
+        the TMY was created
+
+        update - only update the TMYs with new months
+            of data (see onetmy.updateStation)
+        windows - create one TMY for each window of
+            years (see onetmy.processWindows)
+        workers - number of station workers (default:
+            processing.workers of the configuration)
+        """
+        self.config.activate()
+        import onetmy
+
+        if self.log_config is not None:
+            os.environ[onetmy.LOGCONFIG_VARIABLE] = self.log_config
+            onetmy.setupLogging()
+
+        if workers is None:
+            workers = (self.config.activate().get('processing') or {}).get('workers')
+        return onetmy.run(self.stations(stations), workers, update, windows)
+
+    def plan(self, stations=None, scan=None):
+        """
+        What run would do, without loading any data:
+        the months found for each station, the years
+        of each calendar month, the months that are
+        cached, the calendar months that changed
+        since the TMY was recorded (see tmystate.py)
+        and the pre-flight check (see planner.py)
+        Returns a dictionary of station -> plan
+
+        scan - scan the months that aren't cached
+            (see planner.plan)
+        """
+        self.config.activate()
+        import filesearch
+        import manifest
+        import tmystate
+        import planner
+
+        min_years = self.config['tmy']['min-years']
+        plans = {}
+        for station in self.stations(stations):
+            indir, pattern, outpath, preprocesspath = config_parse.stationPaths(station)
+            plan = {'source': indir, 'tmy': outpath, 'tmy-exists': os.path.exists(outpath)}
+            plans[station] = plan
+            try:
+                paths = filesearch.run(indir, pattern)
+            except FileNotFoundError:
+                plan['error'] = 'source folder not found'
+                continue
+
+            paths_subsets = {month_no: {key: paths[key] for key in paths if key.month==month_no} for month_no in range(1, 13)}
+            plan['months'] = len(paths)
+            plan['years'] = {month_no: sorted(key.year for key in subset) for month_no, subset in paths_subsets.items()}
+            plan['enough-years'] = all(len(years)>=min_years for years in plan['years'].values())
+
+            cache = manifest.status(station, paths)
+            plan['cached'] = sum(1 for reason in cache.values() if reason is None)
+            plan['to-process'] = {key: reason for key, reason in cache.items() if reason is not None}
+
+            state = tmystate.load(preprocesspath, station)
+            plan['changed'] = None if state is None else tmystate.changedCalendarMonths(state, station, paths_subsets)
+            plan['check'] = planner.plan(station, paths, preprocesspath, scan)
+        return plans
+
+    def rerank(self, stations=None, variables=None, weighting=None, sort_by_windspeed=None, sort_by_least_number_missing_days=None):
+        """
+        Ranks the candidates of stations again from
+        their saved score matrices (see
+        ranking.rerank)
+        Returns a dictionary of station -> calendar
+        month -> ranked candidates
+        """
+        self.config.activate()
+        import ranking
+        return {station: ranking.rerank(station, variables, weighting, sort_by_windspeed, sort_by_least_number_missing_days)
+            for station in self.stations(stations)}
+
+    def cacheStatus(self, stations=None):
+        """
+        Checks the gap-filled month cache of stations
+        (see manifest.status)
+        Returns a dictionary of station -> month key
+        -> None for a hit, or the reason for the miss
+        (None if the source folder isn't found)
+        """
+        self.config.activate()
+        import manifest
+        results = {}
+        for station in self.stations(stations):
+            try:
+                results[station] = manifest.status(station)
+            except FileNotFoundError:
+                results[station] = None
+        return results
+
+def printPlan(plans, min_years):
+    import planner
+    for station, plan in plans.items():
+        if 'error' in plan:
+            print('Station "'+station+'": '+plan['error'])
+            continue
+        print('Station "'+station+'": '+str(plan['months'])+' months, '+str(plan['cached'])+' cached, '
+            +str(len(plan['to-process']))+' to load and gap-fill')
+        check = plan['check']
+        for month_no, years in plan['years'].items():
+            month_name = datetime.datetime(2000, month_no, 1).strftime('%B')
+            counts = check['calendar-months'][month_no]
+            statuses = '  '.join(status+' '+str(counts[status]) for status in planner.STATUSES if counts[status])
+            note = '\tspare '+str(counts['spare'])
+            if month_no in check['infeasible']:
+                note += '\tnot enough good months'
+            if plan['changed'] is not None and month_no in plan['changed']:
+                note += '\tchanged'
+            print('\t'+month_name.ljust(9)+'\t'+str(len(years))+'\t'+statuses+note)
+        if not plan['enough-years']:
+            print('\tNot enough years (min-years '+str(min_years)+'). The station would be skipped')
+        elif not check['feasible']:
+            print('\tNot enough good months (min-years '+str(min_years)+'). The station would be skipped')
+        else:
+            names = [datetime.datetime(2000, month_no, 1).strftime('%b') for month_no in check['order']]
+            print('\tOrder (worst first): '+' '.join(names))
+            if plan['changed'] is None:
+                print('\tNo recorded TMY. --update would process all months')
+            elif not plan['changed'] and plan['tmy-exists']:
+                print('\tThe TMY is up to date')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Creates typical meteorological years from minutely station data')
+    parser.add_argument('--config', help='configuration file (default: config.yml in the working directory)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='create the TMYs of stations')
+    run.add_argument('stations', nargs='*', help='stations to process (default: all stations in config.yml)')
+    run.add_argument('--update', action='store_true', help='only update the TMYs with new months of data')
+    run.add_argument('--windows', nargs='*', metavar='PERIOD', help='create one TMY for each window of years (e.g. 2000-2014 2001-2015). Without periods, the windows in config.yml are used')
+
+    plan = subparsers.add_parser('plan', help='show what run would do, without loading any data')
+    plan.add_argument('stations', nargs='*', help='stations (default: all stations in config.yml)')
+    plan.add_argument('--scan', action=argparse.BooleanOptionalAction, default=None, help='read the required columns of the months that aren\'t cached (default: scan in the plan block of config.yml)')
+
+    rerank = subparsers.add_parser('rerank', help='rank the candidates again from the saved score matrices')
+    rerank.add_argument('stations', nargs='+', help='station names, as defined in config.yml')
+    rerank.add_argument('--variables', nargs='+', help='test variables (default: tmy.variables)')
+    rerank.add_argument('--weighting', nargs='+', type=float, help='weighting of each test variable (default: tmy.weighting)')
+    rerank.add_argument('--sort-by-windspeed', action=argparse.BooleanOptionalAction, default=None)
+    rerank.add_argument('--sort-by-least-number-missing-days', action=argparse.BooleanOptionalAction, default=None)
+
+    cache_status = subparsers.add_parser('cache-status', help='check the gap-filled month cache')
+    cache_status.add_argument('stations', nargs='*', help='stations (default: all stations in config.yml)')
+
+    args = parser.parse_args(argv)
+
+    try:
+        pipeline = Pipeline(Config(args.config))
+    except FileNotFoundError as e:
+        parser.error(str(e))
+
+    if args.command=='run':
+        windows = None
+        if args.windows is not None:
+            windows = args.windows or True
+            import tmy
+            try:
+                tmy.windows.periods(args.windows or pipeline.config['tmy'].get('windows'), [2000])
+            except ValueError as e:
+                parser.error(str(e))
+
+        import onetmy
+        onetmy.setupLogging()
+        pipeline.run(args.stations, args.update, windows)
+
+    elif args.command=='plan':
+        printPlan(pipeline.plan(args.stations, args.scan), pipeline.config['tmy']['min-years'])
+
+    elif args.command=='rerank':
+        import ranking
+        for station in args.stations:
+            try:
+                results = pipeline.rerank([station], args.variables, args.weighting,
+                    args.sort_by_windspeed, args.sort_by_least_number_missing_days)[station]
+            except ValueError as e:
+                parser.error(str(e))
+            ranking.printRanking(station, results)
+
+    elif args.command=='cache-status':
+        import manifest
+        pipeline.config.activate()
+        manifest.main(args.stations)
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,409 @@
+"""
+Pre-flight check of a station, before any month is
+loaded and gap-filled
+
+A station fails as soon as one calendar month has
+fewer than min-years months that pass loading and
+gap filling (see onetmy.decideMonth). The planner
+estimates which months will pass:
+
+- cached months (see manifest.py) passed before
+- the files of the other months are scanned
+without parsing them (see countFields): the share
+of minutes with an accepted value of each
+measurement is compared with the checks of
+onetmy.prepareMonths (validation.COLUMN_REQUIREMENT
+for each column, validation.DATA_REQUIREMENT for
+the month after logical filling)
+
+Months within margin of a threshold are doubtful,
+and counted as passing. Months without any
+measurement the scan recognises are unknown, and
+left to loading. Stations with a calendar month
+that has fewer than min-years cached or ok months,
+and no doubtful or unknown ones, are skipped, and
+the calendar months of the others are
+processed worst-first (fewest spare months first),
+so a station that fails, fails early
+
+The scans are kept in <station>_plan.json in the
+gap-filled data folder, by month fingerprint, so
+unchanged months are only scanned once
+
+python pipeline.py plan [stations]
+"""
+
+import os
+import json
+import logging
+import pytz
+import calendar
+
+from config_parse import CONFIG, HEADER_MAP, weatherHeaderMap, solarHeaderMap
+
+import manifest
+import validation
+
+STATUSES = ['cached', 'ok', 'doubtful', 'short', 'unknown']
+
+# Bump when scanMonth changes, so saved scans are
+# made again
+SCAN_VERSION = 1
+
+# Columns and zenith limit of fill.logicalfill
+LOGICAL_FILL_COLUMNS = ['mean-ghi', 'mean-dni', 'mean-dhi']
+ZENITH_LIMIT = 96
+
+def settings():
+    """
+    Returns the plan block of the processing block
+    of config.yml
+    """
+    return (CONFIG.get('processing') or {}).get('plan') or {}
+
+def enabled():
+    return settings().get('enabled', True)
+
+def planPath(preprocesspath, station):
+    return os.path.normpath(preprocesspath+'/'+station+'_plan.json')
+
+def loadScans(preprocesspath, station):
+    path = planPath(preprocesspath, station)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logging.warning('Could not read plan '+path)
+        return {}
+
+def saveScans(preprocesspath, station, scans):
+    os.makedirs(preprocesspath, exist_ok=True)
+    with open(planPath(preprocesspath, station), 'w') as f:
+        json.dump(scans, f, indent=1)
+
+def measurementColumns():
+    """
+    New headers of the measurements of the weather
+    and solar blocks (the columns that are left
+    after loading, apart from the flags)
+    """
+    return [column for column in {**weatherHeaderMap(), **solarHeaderMap()} if '-flag' not in column]
+
+def isContent(chars):
+    """
+    Characters that aren't delimiters or spaces
+    """
+    return (chars!=ord(',')) & (chars!=ord('\n')) & (chars!=ord('\r')) & (chars!=ord(' '))
+
+def fieldChars(body, starts, lengths):
+    """
+    The characters of some fields, one row per
+    field, padded with zeros to the longest field
+    """
+    import numpy as np
+    width = max(int(lengths.max()), 1) if len(lengths) else 1
+    offsets = np.arange(width)
+    chars = body[np.minimum(starts[:, None]+offsets, len(body)-1)]
+    chars[offsets>=lengths[:, None]] = 0
+    return chars
+
+def countFields(path, headers, flag_headers, accepted):
+    """
+    Counts the accepted values of the measurements
+    of a data file without parsing it: the fields
+    are found from the positions of the commas and
+    line ends, and a value counts if its field
+    isn't blank and its flag field (if there is one
+    in the file) is one of the accepted flags
+    Returns a dictionary of measurement -> count, or
+    None if the file isn't a plain table (quoted
+    fields, or lines with another number of fields)
+    or none of its headers is a measurement, so it
+    is read with pandas instead (see readFields)
+
+    headers - old header -> measurement
+    flag_headers - old header of a flag ->
+        measurement
+    accepted - measurement -> accepted flags
+    """
+
+    import numpy as np
+
+    data = np.fromfile(path, dtype=np.uint8)
+    header_end = data[:1<<16].tobytes().find(b'\n')
+    if header_end<0:
+        return None
+    header = data[:header_end].tobytes().decode(errors='replace').rstrip('\r')
+    if '"' in header:
+        return None
+    header = header.split(',')
+    if not any(old_header in headers for old_header in header):
+        return None
+    body = data[header_end+1:]
+    if len(body) and body[-1]!=ord('\n'):
+        body = np.append(body, np.uint8(ord('\n')))
+
+    # Positions of the delimiters, one row per line
+    n = len(header)
+    ends = np.flatnonzero((body==ord(',')) | (body==ord('\n')) | (body==ord('"')))
+    if len(ends)%n:
+        return None
+    delimiters = body[ends]
+    if np.any(delimiters==ord('"')) or np.count_nonzero(delimiters==ord('\n'))!=len(ends)//n:
+        return None
+    ends = ends.reshape(-1, n)
+    if np.any(body[ends[:, -1]]!=ord('\n')):
+        return None
+    line_starts = np.concatenate([[0], ends[:-1, -1]+1])
+
+    def field(i):
+        starts = line_starts if i==0 else ends[:, i-1]+1
+        return starts, ends[:, i]-starts
+
+    flags = {}
+    for i, old_header in enumerate(header):
+        if old_header in flag_headers:
+            # The flag fields as they are, like
+            # pandas reads them
+            chars = fieldChars(body, *field(i))
+            if i==n-1:
+                chars[chars==ord('\r')] = 0
+            values = chars.view('S'+str(chars.shape[1])).ravel()
+            column = flag_headers[old_header]
+            flags[column] = np.isin(values, [flag.encode() for flag in accepted[column]])
+
+    counts = {}
+    for i, old_header in enumerate(header):
+        if old_header not in headers:
+            continue
+        column = headers[old_header]
+
+        # A field is filled if it has a character
+        # that isn't a space. Numbers are padded on
+        # one side, so the first and last characters
+        # tell, and only the other fields are checked
+        # in full
+        starts, lengths = field(i)
+        nonempty = lengths>0
+        filled = nonempty & (isContent(body[starts]) | isContent(body[np.maximum(starts+lengths-1, 0)]))
+        unsure = np.flatnonzero(nonempty & ~filled & (lengths>2))
+        if len(unsure):
+            chars = fieldChars(body, starts[unsure], lengths[unsure])
+            filled[unsure] = (isContent(chars) & (chars!=0)).any(axis=1)
+
+        if column in flags:
+            filled &= flags[column]
+        counts[column] = int(np.count_nonzero(filled))
+    return counts
+
+def readFields(path, headers, flag_headers, accepted):
+    """
+    Counts the accepted values of the measurements
+    of a data file like countFields, by reading
+    the columns with pandas
+    """
+
+    import pandas as pd
+
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [x for x in header if x in headers or x in flag_headers]
+    if not any(x in headers for x in usecols):
+        return {}
+    df = pd.read_csv(path, usecols=usecols, low_memory=False)
+
+    flags = {flag_headers[x]: x for x in usecols if x in flag_headers}
+    counts = {}
+    for old_header in usecols:
+        if old_header not in headers:
+            continue
+        column = headers[old_header]
+        valid = pd.to_numeric(df[old_header], errors='coerce').notna()
+        if column in flags:
+            valid &= df[flags[column]].isin(accepted[column])
+        counts[column] = int(valid.sum())
+    return counts
+
+def dayShare(station, year, month_no):
+    """
+    Share of the minutes of a month that logical
+    filling doesn't fill with zero irradiance (see
+    fill.logicalfill), from the zenith of every
+    hour
+    """
+    import solarcache
+    import timetools
+    settings = CONFIG['stations'][station]
+    minutes = timetools.generateTimeseries(year, month_no, pytz.FixedOffset(settings['offset']), df_type=False)
+    zenith = solarcache.zenith(minutes[::60], settings['latitude'], settings['longitude'])
+    return float((zenith<=ZENITH_LIMIT).mean())
+
+def scanMonth(paths, year, month_no):
+    """
+    Counts the accepted values of the measurements
+    in the files of a month (see countFields)
+    Returns a dictionary of measurement -> share of
+    the minutes of the month with an accepted value
+    (for the measurements in the files)
+    """
+
+    import flagtools
+
+    headers = {HEADER_MAP[column]: column for column in measurementColumns()}
+    flag_headers = {HEADER_MAP[column]: column[:-5] for column in HEADER_MAP if '-flag' in column}
+    accepted = {column: flagtools.acceptedFlags(column) for column in flag_headers.values()}
+
+    counts = {}
+    for path in paths:
+        file_counts = countFields(path, headers, flag_headers, accepted)
+        if file_counts is None:
+            file_counts = readFields(path, headers, flag_headers, accepted)
+        for column, count in file_counts.items():
+            counts[column] = counts.get(column, 0)+count
+
+    minutes = calendar.monthrange(year, month_no)[1]*1440
+    return {column: min(1.0, count/minutes) for column, count in counts.items()}
+
+def estimate(scan, night_gaps=False):
+    """
+    Estimates the checks of onetmy.prepareMonths
+    from the scan of a month (available from
+    scanMonth and day from dayShare):
+    measurements with less than
+    validation.COLUMN_REQUIREMENT are removed, and
+    logical filling fills the missing night-time
+    irradiance (assuming the gaps are spread evenly
+    over the day)
+    Returns the smallest share of a required column
+    (0 if one is missing) and the share of data
+    after logical filling
+
+    night_gaps - assume instead that the gaps of
+        the irradiance are at night as far as they
+        can be, so logical filling fills the most it
+        can (the scan doesn't know when the gaps
+        are)
+    """
+    available = scan['available']
+    required = CONFIG['tmy']['required-columns']
+    worst_column = min(available.get(column, 0.0) for column in required)
+
+    kept = {column: share for column, share in available.items() if share>=validation.COLUMN_REQUIREMENT}
+    for column in LOGICAL_FILL_COLUMNS:
+        if column in kept:
+            if night_gaps:
+                kept[column] = min(1.0, kept[column]+1-scan['day'])
+            else:
+                kept[column] = 1-(1-kept[column])*scan['day']
+    share = sum(kept.values())/len(kept) if kept else 0.0
+    return worst_column, share
+
+def monthStatus(scan, margin):
+    """
+    Status of a scanned month: ok, doubtful (less
+    than margin from a threshold) or short
+    Months that are short with gaps spread evenly
+    over the day, but not with the gaps at night
+    (see estimate), are doubtful
+    """
+    worst_column, share = estimate(scan)
+    best_share = estimate(scan, night_gaps=True)[1]
+    if worst_column<validation.COLUMN_REQUIREMENT-margin or best_share<validation.DATA_REQUIREMENT-margin:
+        return 'short'
+    if worst_column<validation.COLUMN_REQUIREMENT or share<validation.DATA_REQUIREMENT+margin:
+        return 'doubtful'
+    return 'ok'
+
+def plan(station, paths, preprocesspath, scan=None):
+    """
+    Estimates which months of a station will pass
+    loading and gap filling, without loading them
+    Returns a dictionary with
+    months - month key -> status (see STATUSES)
+    calendar-months - calendar month number -> count
+        of each status, and spare (months that are
+        cached or ok, less min-years)
+    feasible - False if a calendar month can't have
+        min-years good months: fewer than min-years
+        are cached or ok, and none is doubtful or
+        unknown
+    infeasible - the calendar months that can't
+    order - the calendar months, worst first
+
+    paths - dictionary of month key -> source files
+    scan - scan the months that aren't cached
+        (default: scan in the plan block of
+        config.yml). Unscanned months are unknown,
+        and counted like doubtful ones
+    """
+
+    if scan is None:
+        scan = settings().get('scan', True)
+    margin = settings().get('margin', 0.05)
+    min_years = CONFIG['tmy']['min-years']
+
+    scans = loadScans(preprocesspath, station)
+    scanned = False
+    days = {}
+    months = {}
+    for key in sorted(paths):
+        name = station+key.strftime("_%Y_%m")
+        fingerprint = manifest.fingerprint(station, paths[key])
+        if manifest.check(preprocesspath, name, fingerprint) is None:
+            months[key] = 'cached'
+            continue
+
+        tag = manifest.hashJson({'scan-version': SCAN_VERSION, 'fingerprint': fingerprint})
+        entry = scans.get(name)
+        if entry is None or entry.get('tag')!=tag:
+            if not scan:
+                months[key] = 'unknown'
+                continue
+            try:
+                if key.month not in days:
+                    days[key.month] = dayShare(station, key.year, key.month)
+                entry = {'available': scanMonth(paths[key], key.year, key.month), 'day': days[key.month]}
+            except Exception as e:
+                # load.load reads what it can of broken
+                # files, so they aren't ruled out here
+                logging.warning('Could not scan '+name+' ('+str(e)+')')
+                months[key] = 'unknown'
+                continue
+            entry['tag'] = tag
+            scans[name] = entry
+            scanned = True
+        if not entry['available']:
+            # No measurement found in the files (e.g.
+            # headers that aren't in config.yml).
+            # Loading decides
+            months[key] = 'unknown'
+            continue
+        months[key] = monthStatus(entry, margin)
+
+    if scanned:
+        saveScans(preprocesspath, station, scans)
+
+    calendar_months = {}
+    for month_no in range(1, 13):
+        counts = {status: 0 for status in STATUSES}
+        for key, status in months.items():
+            if key.month==month_no:
+                counts[status] += 1
+        counts['spare'] = counts['cached']+counts['ok']-min_years
+        calendar_months[month_no] = counts
+
+    # Only calendar months whose every month is
+    # settled count as infeasible, so a wrong scan
+    # of a doubtful or unknown month can't skip a
+    # station that would succeed
+    infeasible = [month_no for month_no, counts in calendar_months.items()
+        if counts['cached']+counts['ok']<min_years and counts['doubtful']+counts['unknown']==0]
+
+    return {
+        'months': months,
+        'calendar-months': calendar_months,
+        'feasible': not infeasible,
+        'infeasible': infeasible,
+        'order': sorted(calendar_months, key=lambda month_no: (calendar_months[month_no]['spare'], month_no)),
+    }
@@ -0,0 +1,368 @@
+"""
+Ranks the candidate months of a calendar month
+from their score matrix: the unweighted FS
+statistic of each year and variable, the wind
+speed deviation and the days with gaps of each
+year (see tmy.decide.scoreMatrix)
+
+The score matrix of every calendar month is saved
+next to the gap-filled data when a station is
+processed, so different weightings and test
+variables can be tried without touching the
+minutely data:
+
+python ranking.py <station> [--variables ...] [--weighting ...]
+
+With the approximate FS engine, --approximation
+reports how many years of each calendar month were
+scored exactly, and how often the exact scores
+changed the winner of the approximate ones. Its
+score matrices are only re-ranked where the error
+bounds show the result is the same as with exact
+scores (see checkRerank). With the pre-ranking
+enabled, --pre-ranking reports how
+many years were scored at minute resolution, and
+(with compare) whether ranking every year at
+minute resolution picks the same winner. Its
+score matrices can only be re-ranked with the
+test variables and weighting they were cut with
+"""
+
+import os
+import json
+import logging
+import calendar
+import datetime
+import argparse
+
+from config_parse import CONFIG
+
+def rank(scores, test_variables, variable_weightings, sort_by_windspeed, sort_by_least_number_missing_days):
+    """
+    Ranks the months of a score matrix
+    Returns the ranked candidates (winner first)
+    and the extended list of candidates, as
+    tmy.decide.month does
+
+    A month without a score for one of the test
+    variables can't win. Raises ValueError if a
+    test variable isn't in the score matrix
+    """
+
+    fs_scores = weightedScores(scores, test_variables, variable_weightings)
+
+    # Rank all months based on their fs scores
+    # (lowest wins)
+    ranked_keys = sorted(fs_scores, key=lambda x: (x[1]))
+    candidates = [x[0] for x in ranked_keys][:3]   # Keys for the best 3
+    candidates_top_five = [x[0] for x in ranked_keys][:6]   # Keys for the best 6
+
+    logging.debug('Candidates: '+str(candidates))
+    logging.debug('candidates_top_five: '+str(candidates_top_five))
+
+    ranked_candidates = candidates
+    extented_candidates = candidates_top_five
+
+    if sort_by_windspeed:
+        logging.debug("Sorting by wind-speed")
+        # The 3 months with the best ranking undergo one
+        # more selection step: winner has the smallest
+        # deviation in average monthly windspeed
+        deviances = dict(zip(scores['keys'], scores['wind-speed-deviation']))
+        if any(deviances[key] is None for key in candidates_top_five):
+            logging.debug('Wind-speed missing. Not sorting by wind-speed')
+        else:
+            extented_candidates = sorted(candidates_top_five, key=lambda x: deviances[x])
+            ranked_candidates = sorted(candidates, key=lambda x: deviances[x])
+            logging.debug('Winning candidate based on wind-speed: '+str(ranked_candidates[0]))
+            logging.debug('Ranked candidates based on wind-speed: '+str(ranked_candidates))
+
+    if sort_by_least_number_missing_days:
+        logging.debug("Sorting by least number of missing days")
+        # ranking for best three candidates based on least number
+        # of days with gaps, counted up to the last day of the
+        # month of the best scoring candidate
+        eomday = calendar.monthrange(candidates[0].year, candidates[0].month)[1]
+        gap_days = dict(zip(scores['keys'], scores['gap-days']))
+        number_of_gaps_per_candidate = {}
+        for key in ranked_candidates:
+            number_of_gaps_per_candidate[key] = len([d for d in gap_days[key] if d<=eomday])
+            logging.debug('Number of days with gaps for '+str(key)+': '+str(number_of_gaps_per_candidate[key]))
+        ranked_candidates = sorted(number_of_gaps_per_candidate, key=lambda x: number_of_gaps_per_candidate[x])
+
+    return ranked_candidates, extented_candidates
+
+def weightedScores(scores, test_variables, variable_weightings):
+    """
+    Weighted FS score of each month of a score
+    matrix. Months without a score for one of the
+    test variables get infinity
+    Returns a list of [key, score]
+    Raises ValueError if a test variable isn't in
+    the score matrix
+    """
+
+    for tv in test_variables:
+        if tv not in scores['variables']:
+            raise ValueError('"'+tv+'" is not in the score matrix. Add it to score-variables and reprocess the station')
+    columns = [scores['variables'].index(tv) for tv in test_variables]
+
+    # Weighted score of each month
+    fs_scores = []
+    for key, fs in zip(scores['keys'], scores['fs']):
+        cum_score = 0
+        for idx, column in enumerate(columns):
+            if fs[column] is None:
+                cum_score = float('inf')
+                break
+            cum_score += fs[column] * variable_weightings[idx]
+        fs_scores.append([key, cum_score])
+    return fs_scores
+
+def approximateBounds(scores, test_variables, variable_weightings):
+    """
+    Range of the weighted score of each month of a
+    score matrix made with the approximate FS
+    engine: the months that weren't scored exactly
+    have the error bounds of their approximate
+    scores (see tmy.decide.approximateFsScores)
+    Returns a list of [lower, upper]
+    """
+    approximation = scores['approximation']
+    columns = [scores['variables'].index(tv) for tv in test_variables]
+    bounds = []
+    for i, fs in enumerate(scores['fs']):
+        if any(fs[column] is None for column in columns):
+            bounds.append([float('inf'), float('inf')])
+            continue
+        score = sum(fs[column]*w for column, w in zip(columns, variable_weightings))
+        error = 0.0
+        if not approximation['exact'][i]:
+            error = sum((approximation['fs-error'][i][column] or 0.0)*abs(w) for column, w in zip(columns, variable_weightings))
+        bounds.append([score-error, score+error])
+    return bounds
+
+def checkRerank(scores, test_variables, variable_weightings):
+    """
+    Raises ValueError if ranking a score matrix
+    with these test variables and weighting could
+    give other candidates than scoring every month
+    exactly: with the approximate FS engine, a
+    month that wasn't scored exactly may be among
+    the six best within the error bounds of its
+    score. With the pre-ranking, only the best
+    months of the test variables and weighting of
+    the cut were scored at all, so it can only be
+    ranked with those
+    """
+    pre_ranking = scores.get('pre-ranking')
+    if pre_ranking is not None and not all(pre_ranking['fine']):
+        cut = (pre_ranking.get('variables'), pre_ranking.get('weighting'))
+        if cut!=(list(test_variables), [float(w) for w in variable_weightings]):
+            raise ValueError('The score matrix was made with the pre-ranking, which only scored the best years of '
+                +('a ranking that wasn\'t recorded' if cut[0] is None else 'variables '+' '.join(cut[0])+' with weighting '+' '.join(str(w) for w in cut[1]))
+                +' at minute resolution. Reprocess the station with the pre-ranking disabled to re-rank it with other variables or weighting')
+
+    approximation = scores.get('approximation')
+    if approximation is None or all(approximation['exact']):
+        return
+
+    bounds = approximateBounds(scores, test_variables, variable_weightings)
+    threshold = sorted(upper for lower, upper in bounds)[min(6, len(bounds))-1]
+    for (lower, upper), exact in zip(bounds, approximation['exact']):
+        if not exact and lower<=threshold:
+            raise ValueError('The score matrix was made with the approximate FS engine, and years that weren\'t scored exactly could be among the best with these variables and weighting. Reprocess the station with fs-engine searchsorted (or a larger top-k in fs-approximate)')
+
+def scoresPath(preprocesspath, station, month):
+    """
+    Path of the score matrix of a calendar month
+    of a station
+    """
+    return os.path.normpath(preprocesspath+'/'+station+'_scores_{:02d}.json'.format(month))
+
+def save(scores, path):
+    """
+    Saves a score matrix as .json
+    """
+
+    logging.debug('Saving score matrix to '+path)
+
+    dir = os.path.dirname(path)
+    if dir:
+        os.makedirs(dir, exist_ok=True)
+
+    tmp = dict(scores)
+    tmp['keys'] = [key.isoformat() for key in scores['keys']]
+
+    tmp_path = path+'.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(tmp, f)
+    os.replace(tmp_path, path)
+
+def load(path):
+    """
+    Loads a score matrix saved with save()
+    """
+    with open(path, 'r') as f:
+        scores = json.load(f)
+    scores['keys'] = [datetime.datetime.fromisoformat(key) for key in scores['keys']]
+    return scores
+
+def rerank(station, test_variables=None, variable_weightings=None, sort_by_windspeed=None, sort_by_least_number_missing_days=None):
+    """
+    Ranks the candidates of every calendar month of
+    a station from its saved score matrices. Settings
+    that aren't given are taken from the tmy block
+    of config.yml
+    Returns a dictionary of calendar month ->
+    ranked candidates (None if the calendar month
+    has no score matrix)
+    Raises ValueError if a score matrix isn't
+    exact enough to re-rank with these settings
+    (see checkRerank)
+    """
+
+    tmy_config = CONFIG['tmy']
+    if test_variables is None:
+        test_variables = tmy_config['variables']
+    if variable_weightings is None:
+        variable_weightings = tmy_config['weighting']
+    if sort_by_windspeed is None:
+        sort_by_windspeed = tmy_config['sort-by-windspeed']
+    if sort_by_least_number_missing_days is None:
+        sort_by_least_number_missing_days = tmy_config['sort-by-least-number-missing-days']
+
+    if len(test_variables)!=len(variable_weightings):
+        raise ValueError('Need one weighting for each test variable')
+
+    preprocesspath = os.path.normpath(CONFIG['folders']['destination-filtered'] + '/' + station + '/')
+
+    results = {}
+    for month in range(1, 13):
+        path = scoresPath(preprocesspath, station, month)
+        if not os.path.exists(path):
+            results[month] = None
+            continue
+        scores = load(path)
+        results[month], extented_candidates = rank(scores, test_variables, variable_weightings,
+            sort_by_windspeed, sort_by_least_number_missing_days)
+        try:
+            checkRerank(scores, test_variables, variable_weightings)
+        except ValueError as e:
+            month_name = datetime.datetime(2000, month, 1).strftime('%B')
+            raise ValueError('Can\'t re-rank '+month_name+' of station "'+station+'". '+str(e)) from None
+
+    return results
+
+def scoresEntries(station, entry):
+    """
+    One entry of the saved score matrix of every
+    calendar month of a station
+    Returns a dictionary of calendar month -> the
+    entry (None if the calendar month has no score
+    matrix, or its matrix doesn't have the entry)
+    """
+
+    preprocesspath = os.path.normpath(CONFIG['folders']['destination-filtered'] + '/' + station + '/')
+
+    results = {}
+    for month in range(1, 13):
+        path = scoresPath(preprocesspath, station, month)
+        results[month] = load(path).get(entry) if os.path.exists(path) else None
+    return results
+
+def approximationReport(station):
+    """
+    The results of the approximate FS engine (see
+    tmy.decide.approximateFsScores) of every
+    calendar month of a station
+    """
+    return scoresEntries(station, 'approximation')
+
+def preRankingReport(station):
+    """
+    The results of the pre-ranking on coarse means
+    (see tmy.decide.preRank) of every calendar
+    month of a station
+    """
+    return scoresEntries(station, 'pre-ranking')
+
+def printApproximationReport(station):
+    results = approximationReport(station)
+    changed = 0
+    approximated = 0
+    print('Station "'+station+'"')
+    for month, approximation in results.items():
+        month_name = datetime.datetime(2000, month, 1).strftime('%B')
+        if approximation is None:
+            print('\t'+month_name.ljust(9)+'\tnot scored with the approximate FS engine')
+            continue
+        approximated += 1
+        exact = approximation['exact']
+        line = '\t'+month_name.ljust(9)+'\t'+str(sum(exact))+' of '+str(len(exact))+' years scored exactly'
+        if approximation.get('changed-winner'):
+            changed += 1
+            line += ', changed the winner (approximate winner '+approximation['approximate-winner'][:4]+')'
+        print(line)
+    print('\tThe exact scores changed the winner of '+str(changed)+' of '+str(approximated)+' months')
+
+def printPreRankingReport(station):
+    results = preRankingReport(station)
+    changed = 0
+    compared = 0
+    print('Station "'+station+'"')
+    for month, pre_ranking in results.items():
+        month_name = datetime.datetime(2000, month, 1).strftime('%B')
+        if pre_ranking is None:
+            print('\t'+month_name.ljust(9)+'\tnot pre-ranked')
+            continue
+        fine = pre_ranking['fine']
+        line = '\t'+month_name.ljust(9)+'\t'+str(sum(fine))+' of '+str(len(fine))+' years scored at minute resolution ('+str(pre_ranking['resolution'])+' minute means)'
+        if 'full-winner' in pre_ranking:
+            compared += 1
+            if pre_ranking['changed-winner']:
+                changed += 1
+                line += ', changed the winner (minute resolution winner '+pre_ranking['full-winner'][:4]+')'
+        print(line)
+    if compared:
+        print('\tThe pre-ranking changed the winner of '+str(changed)+' of '+str(compared)+' months')
+
+def printRanking(station, results):
+    """
+    Prints the results of rerank
+    """
+    print('Station "'+station+'"')
+    for month, ranked_candidates in results.items():
+        month_name = datetime.datetime(2000, month, 1).strftime('%B')
+        if ranked_candidates is None:
+            print('\t'+month_name.ljust(9)+'\tno score matrix')
+        else:
+            print('\t'+month_name.ljust(9)+'\t'+'  '.join(str(key.year) for key in ranked_candidates))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-ranks the candidate months of stations from their saved score matrices')
+    parser.add_argument('stations', nargs='+', help='station names, as defined in config.yml')
+    parser.add_argument('--variables', nargs='+', help='test variables (default: tmy.variables)')
+    parser.add_argument('--weighting', nargs='+', type=float, help='weighting of each test variable (default: tmy.weighting)')
+    parser.add_argument('--sort-by-windspeed', action=argparse.BooleanOptionalAction, default=None)
+    parser.add_argument('--sort-by-least-number-missing-days', action=argparse.BooleanOptionalAction, default=None)
+    parser.add_argument('--approximation', action='store_true', help='report the results of the approximate FS engine instead of re-ranking')
+    parser.add_argument('--pre-ranking', action='store_true', help='report the results of the pre-ranking on coarse means instead of re-ranking')
+    args = parser.parse_args(argv)
+
+    for station in args.stations:
+        if args.approximation:
+            printApproximationReport(station)
+            continue
+        if args.pre_ranking:
+            printPreRankingReport(station)
+            continue
+        try:
+            results = rerank(station, args.variables, args.weighting,
+                args.sort_by_windspeed, args.sort_by_least_number_missing_days)
+        except ValueError as e:
+            parser.error(str(e))
+        printRanking(station, results)
+
+if __name__=='__main__':
+    main()
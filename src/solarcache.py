@@ -0,0 +1,183 @@
+"""
+Disk cache of solar zenith angles. The solar
+position of a station only depends on its
+location and the time, so it is calculated once
+and reused by every rerun
+
+The cache holds one file per location and (UTC)
+year, with one zenith value per minute. The files
+are .npy arrays, so they can be memory-mapped and
+only the minutes that are needed are read. Minutes
+that haven't been calculated yet are NaN
+"""
+
+import os
+import logging
+import datetime
+import numpy as np
+import pandas as pd
+
+from config_parse import CONFIG
+
+NS_PER_MINUTE = 60*10**9
+
+def settings():
+    """
+    Returns the solar-cache settings from the
+    processing block of config.yml
+    """
+    return CONFIG.get('processing', {}).get('solar-cache') or {}
+
+def calculate(times, lat, lon):
+    """
+    Calculates the solar zenith for a
+    DatetimeIndex without using the cache
+    Returns a numpy array
+    """
+    from pvlib import solarposition
+    solpos = solarposition.get_solarposition(times, lat, lon)
+    return solpos['zenith'].values
+
+def cachePath(directory, lat, lon, year):
+    """
+    Path of the cache file for a location and
+    a UTC year
+    """
+    name = 'zenith_{:.6f}_{:.6f}_{}.npy'.format(lat, lon, year)
+    return os.path.normpath(os.path.join(directory, name))
+
+def openCache(path, year):
+    """
+    Memory-maps the cache file for a year,
+    creating it (full of NaNs) if it doesn't
+    exist yet
+    """
+    if not os.path.exists(path):
+        start = datetime.datetime(year, 1, 1)
+        end = datetime.datetime(year+1, 1, 1)
+        minutes = int((end-start).total_seconds()//60)
+
+        # Written under a temporary name so other
+        # processes never see a half-made file
+        tmp_path = path+'.'+str(os.getpid())+'.tmp'
+        cache = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64, shape=(minutes,))
+        cache[:] = np.nan
+        cache.flush()
+        del cache
+        os.replace(tmp_path, path)
+    else:
+        # Mark the file as recently used
+        os.utime(path)
+
+    return np.load(path, mmap_mode='r+')
+
+def zenith(times, lat, lon):
+    """
+    Returns the solar zenith for each timestamp
+    of a DatetimeIndex as a Series. Zenith angles
+    are read from the cache, and only the minutes
+    that aren't cached yet are calculated
+
+    Timestamps that aren't on a whole minute are
+    always calculated. If no cache directory is
+    set, everything is calculated
+    """
+
+    directory = settings().get('directory')
+    if not directory:
+        return pd.Series(calculate(times, lat, lon), index=times, name='zenith')
+
+    os.makedirs(directory, exist_ok=True)
+
+    # Nanoseconds since the epoch (UTC). Naive
+    # timestamps are treated as UTC, as pvlib does
+    if times.tz is None:
+        utc = times.tz_localize('UTC')
+    else:
+        utc = times.tz_convert('UTC')
+    ns = utc.asi8
+    cacheable = (ns%NS_PER_MINUTE)==0
+    years = utc.year.values
+
+    values = np.full(len(times), np.nan)
+    n_calculated = 0
+
+    for year in np.unique(years[cacheable]):
+        rows = np.flatnonzero(cacheable & (years==year))
+        year_start = pd.Timestamp(datetime.datetime(year, 1, 1), tz='UTC').value
+        offsets = (ns[rows]-year_start)//NS_PER_MINUTE
+
+        cache = openCache(cachePath(directory, lat, lon, year), year)
+        cached = np.array(cache[offsets])
+        missing = np.isnan(cached)
+        if missing.any():
+            # Only calculate the minutes we don't have
+            cached[missing] = calculate(times[rows[missing]], lat, lon)
+            cache[offsets[missing]] = cached[missing]
+            cache.flush()
+            n_calculated += int(missing.sum())
+        del cache
+
+        values[rows] = cached
+
+    # Timestamps that aren't on the minute
+    if not cacheable.all():
+        rows = np.flatnonzero(~cacheable)
+        values[rows] = calculate(times[rows], lat, lon)
+        n_calculated += len(rows)
+
+    logging.debug('Solar zenith: %d minutes from cache, %d calculated', len(times)-n_calculated, n_calculated)
+
+    if n_calculated:
+        limitSize(directory, settings().get('max-size-mb'))
+
+    return pd.Series(values, index=times, name='zenith')
+
+def cacheFiles(directory):
+    """
+    Returns the cache files in a directory,
+    least recently used first
+    """
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.join(directory, x) for x in os.listdir(directory) if x.startswith('zenith_') and x.endswith('.npy')]
+    return sorted(paths, key=os.path.getmtime)
+
+def limitSize(directory, max_size_mb):
+    """
+    Deletes the least recently used cache files
+    until the cache is no larger than max_size_mb
+    """
+    if not max_size_mb:
+        return
+
+    paths = cacheFiles(directory)
+    size = sum(os.path.getsize(x) for x in paths)
+    limit = max_size_mb*1024*1024
+    for path in paths:
+        if size<=limit:
+            break
+        try:
+            file_size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            # In use by another process
+            continue
+        logging.debug('Evicted '+path+' from the solar cache')
+        size -= file_size
+
+def evict(directory=None):
+    """
+    Deletes every file in the solar cache
+    """
+    if directory is None:
+        directory = settings().get('directory')
+    if not directory:
+        return
+
+    for path in cacheFiles(directory):
+        try:
+            os.remove(path)
+        except OSError:
+            logging.warning('Could not evict '+path+' from the solar cache')
+    logging.info('Solar cache evicted')
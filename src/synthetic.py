@@ -0,0 +1,260 @@
+"""
+Writes synthetic minutely data files in the BoM
+format, for trying and benchmarking OneTMY without
+the real archives (see benchmark.py)
+
+Each station of the stations block gets a solar
+file and a weather file per month
+(<station>/sl_<station>_<YYYY>_<MM>.csv and
+aw_..., as matched by the default pattern), with
+the headers of the time, weather and solar blocks
+of config.yml. The irradiance follows the sun at
+the station's location under a changing cloud
+cover, so direct, diffuse and global irradiance
+agree with each other as in real data. The
+weather follows daily and annual cycles with
+noise. Files are the same for the same seed
+
+python synthetic.py <directory> [stations] [--years 2000-2009] [--gaps mixed] [--flag-rate 0.01] [--files-per-month 1]
+"""
+
+import os
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+from config_parse import CONFIG, timeHeaderMap
+
+GAP_PATTERNS = ['none', 'random', 'outages', 'mixed']
+
+def cosZenith(utc_minutes, lat, lon):
+    """
+    Cosine of the solar zenith (a simple
+    approximation, good to about a degree)
+
+    utc_minutes - minutes since the epoch (UTC)
+    """
+    days = utc_minutes/1440.0
+    day_of_year = days%365.25
+    declination = np.deg2rad(23.44)*np.sin(2*np.pi*(day_of_year-80)/365.25)
+    solar_time = (utc_minutes%1440)/60.0 + lon/15.0
+    hour_angle = np.deg2rad(15.0*(solar_time-12))
+    lat = np.deg2rad(lat)
+    return np.sin(lat)*np.sin(declination) + np.cos(lat)*np.cos(declination)*np.cos(hour_angle)
+
+def hourlyNoise(rng, n, scale, hours=1):
+    """
+    Smooth noise: random values every few hours,
+    interpolated to every minute
+    """
+    knots = np.arange(0, n+hours*60, hours*60)
+    return np.interp(np.arange(n), knots, rng.normal(0, scale, len(knots)))
+
+def solar(rng, utc_minutes, lat, lon):
+    """
+    Global, direct and diffuse irradiance (W/sq m)
+    of each minute
+    """
+    n = len(utc_minutes)
+    cos_zenith = np.clip(cosZenith(utc_minutes, lat, lon), 0, None)
+    with np.errstate(divide='ignore'):
+        clear = np.where(cos_zenith>0, 1098*cos_zenith*np.exp(-0.057/cos_zenith), 0)
+
+    # Clearness changes from day to day and hour
+    # to hour, with a little minutely flicker
+    days = n//1440+2
+    daily = np.repeat(rng.beta(4, 1.5, days), 1440)[:n]
+    clearness = np.clip(daily+hourlyNoise(rng, n, 0.15)+rng.normal(0, 0.03, n), 0.05, 1.0)
+
+    ghi = clear*clearness
+    direct_share = np.clip((clearness-0.3)/0.7, 0, 1)*0.85
+    dni = np.where(cos_zenith>0.01, ghi*direct_share/np.maximum(cos_zenith, 0.01), 0)
+    dhi = ghi-dni*cos_zenith
+    return ghi, dni, dhi
+
+def weather(rng, utc_minutes, lst_minutes, lat):
+    """
+    Weather of each minute, by new header (see the
+    weather block of config.yml)
+    """
+    n = len(utc_minutes)
+    hour = (lst_minutes%1440)/60.0
+    day_of_year = (lst_minutes/1440.0)%365.25
+    # Southern summer is warmer in the south
+    season = np.cos(2*np.pi*(day_of_year-15)/365.25)*np.sign(-lat)
+    daily = np.sin(2*np.pi*(hour-9)/24)
+
+    air_temp = 22+6*season+5*daily+hourlyNoise(rng, n, 1.5, 3)+rng.normal(0, 0.1, n)
+    depression = np.clip(6+3*daily+hourlyNoise(rng, n, 2, 6), 0.2, None)
+    dew_point = air_temp-depression
+    relative_humidity = 100*np.exp(17.625*dew_point/(243.04+dew_point))/np.exp(17.625*air_temp/(243.04+air_temp))
+    wind_speed = np.clip(12+4*daily+hourlyNoise(rng, n, 5)+rng.normal(0, 1.5, n), 0, None)
+
+    rain = np.clip(hourlyNoise(rng, n, 1, 2)-1.8, 0, None)*(rng.random(n)<0.3)
+
+    values = {
+        'air-temp': air_temp,
+        'dew-point': dew_point,
+        'wet-bulb': air_temp-depression/3,
+        'relative-humidity': np.clip(relative_humidity, 1, 100),
+        'wind-speed': wind_speed,
+        'wind-speed-max': wind_speed*(1.2+np.abs(rng.normal(0, 0.15, n))),
+        'wind-speed-min': wind_speed*np.clip(1-np.abs(rng.normal(0, 0.15, n)), 0, 1),
+        'wind-direction': (180+np.cumsum(rng.normal(0, 2, n)))%360,
+        'station-level-pressure': 1012+hourlyNoise(rng, n, 3, 12),
+        'precip': np.round(rain, 1),
+    }
+    for header in ['air-temp', 'wet-bulb']:
+        values[header+'-max'] = values[header]+np.abs(rng.normal(0, 0.1, n))
+        values[header+'-min'] = values[header]-np.abs(rng.normal(0, 0.1, n))
+    return values
+
+def timeColumns(utc, offset):
+    """
+    The time columns of the time block of
+    config.yml, by old header
+
+    utc - DatetimeIndex of the minutes (UTC)
+    offset - offset of the station's standard time
+        in minutes
+    """
+    times = {'utc': utc, 'lst': utc+pd.Timedelta(minutes=offset)}
+    columns = {}
+    for new_header, old_header in timeHeaderMap().items():
+        component, time_format = new_header.rsplit('-', 1)
+        local = times.get(time_format, times['lst'])
+        columns[old_header] = getattr(local, component)
+    return columns
+
+def isFlag(new_header):
+    return new_header.endswith('-flag') or new_header.endswith('-quality')
+
+def month(rng, station, year, month_no, gaps='mixed', missing_rate=0.01, outages=1, outage_minutes=120, flag_rate=0.01):
+    """
+    Makes the solar and weather files of one
+    month of a station
+    Returns a dictionary of file type (sl, aw) ->
+    dataframe with the old headers
+    """
+
+    if gaps not in GAP_PATTERNS:
+        raise ValueError('Unknown gap pattern "'+str(gaps)+'". Use one of '+', '.join(GAP_PATTERNS))
+
+    settings = CONFIG['stations'][station]
+    offset = settings['offset']
+    start = pd.Timestamp(year, month_no, 1)-pd.Timedelta(minutes=offset)
+    end = (pd.Timestamp(year, month_no, 1)+pd.offsets.MonthBegin(1))-pd.Timedelta(minutes=offset)
+    utc = pd.date_range(start, end, freq='min', inclusive='left')
+    utc_minutes = utc.asi8//(60*10**9)
+    n = len(utc)
+
+    ghi, dni, dhi = solar(rng, utc_minutes, settings['latitude'], settings['longitude'])
+    values = weather(rng, utc_minutes, utc_minutes+offset, settings['latitude'])
+    values.update({'mean-ghi': ghi, 'mean-dni': dni, 'mean-dhi': dhi})
+
+    files = {}
+    for file_type, block in [('sl', CONFIG['solar']), ('aw', CONFIG['weather'])]:
+        columns = timeColumns(utc, offset)
+        for new_header, old_header in block.items():
+            if isFlag(new_header):
+                columns[old_header] = np.where(rng.random(n)<flag_rate, 'N', 'Y')
+                continue
+            column = values.get(new_header)
+            if column is None:
+                column = 10+hourlyNoise(rng, n, 2)
+            column = np.round(column, 1)
+            if gaps in ['random', 'mixed']:
+                column[rng.random(n)<missing_rate] = np.nan
+            columns[old_header] = column
+        df = pd.DataFrame(columns)
+
+        # The logger was down: no rows at all
+        if gaps in ['outages', 'mixed'] and outage_minutes>0:
+            keep = np.ones(n, dtype=bool)
+            for i in range(rng.poisson(outages)):
+                first = rng.integers(0, n)
+                keep[first:first+rng.integers(1, outage_minutes+1)] = False
+            df = df[keep]
+        files[file_type] = df
+    return files
+
+def generate(directory, stations, years, gaps='mixed', missing_rate=0.01, outages=1, outage_minutes=120, flag_rate=0.01, files_per_month=1, seed=0):
+    """
+    Writes synthetic data files of stations
+    Returns the number of files written
+
+    directory - the files of each station go in
+        <directory>/<station>
+    stations - names of stations of the stations
+        block of config.yml
+    years - list of years
+    gaps - none, random (single missing values of
+        each column, missing_rate of them), outages
+        (missing rows, on average outages a month,
+        each up to outage_minutes long) or mixed
+        (both)
+    flag_rate - share of quality flags that aren't
+        accepted (N)
+    files_per_month - split each month into this
+        many files of consecutive rows, kept in
+        part_<i> subfolders of the station's folder
+    seed - seed of the random numbers
+    """
+
+    count = 0
+    for station in stations:
+        if station not in CONFIG['stations']:
+            raise ValueError('Station "'+station+'" is not in the stations block of config.yml')
+        for year in years:
+            for month_no in range(1, 13):
+                rng = np.random.default_rng([seed, int(station), year, month_no])
+                files = month(rng, station, year, month_no, gaps, missing_rate, outages, outage_minutes, flag_rate)
+                for file_type, df in files.items():
+                    name = '{}_{}_{}_{:02d}.csv'.format(file_type, station, year, month_no)
+                    parts = np.array_split(np.arange(len(df)), max(1, files_per_month))
+                    for i, rows in enumerate(parts):
+                        folder = os.path.join(directory, station)
+                        if files_per_month>1:
+                            folder = os.path.join(folder, 'part_'+str(i+1))
+                        os.makedirs(folder, exist_ok=True)
+                        df.iloc[rows].to_csv(os.path.join(folder, name), index=False)
+                        count += 1
+            logging.info('Wrote %d of station %s', year, station)
+    return count
+
+def parseYears(text):
+    """
+    Years from text like 2000-2009 (or a single
+    year)
+    """
+    first, _, last = text.partition('-')
+    return list(range(int(first), int(last or first)+1))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Writes synthetic BoM-style data files')
+    parser.add_argument('directory', help='folder for the files (one subfolder per station)')
+    parser.add_argument('stations', nargs='*', help='stations from config.yml (default: the first one)')
+    parser.add_argument('--years', default='2000-2009', help='years, e.g. 2000-2009 (default)')
+    parser.add_argument('--gaps', choices=GAP_PATTERNS, default='mixed')
+    parser.add_argument('--missing-rate', type=float, default=0.01, help='share of single missing values')
+    parser.add_argument('--outages', type=float, default=1, help='average number of outages a month')
+    parser.add_argument('--outage-minutes', type=int, default=120, help='longest outage')
+    parser.add_argument('--flag-rate', type=float, default=0.01, help='share of flags that aren\'t accepted')
+    parser.add_argument('--files-per-month', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    try:
+        years = parseYears(args.years)
+    except ValueError:
+        parser.error('"'+args.years+'" is not a range of years (e.g. 2000-2009)')
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    count = generate(args.directory, args.stations or list(CONFIG['stations'])[:1], years,
+        args.gaps, args.missing_rate, args.outages, args.outage_minutes, args.flag_rate,
+        args.files_per_month, args.seed)
+    print('Wrote '+str(count)+' files to '+args.directory)
+
+if __name__=='__main__':
+    main()
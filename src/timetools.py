@@ -9,56 +9,150 @@ import datetime
 import logging
 import numpy as np
 
-from config_parse import CONFIG, TIME_FORMATS
+from config_parse import CONFIG, timeFormats
 
-def convert(df, station):
+NS_PER_MINUTE = 60*10**9
+
+def convert(df, station, all_formats=False):
 	"""
 	Converts the groups of time columns
 	into single datetime columns
 
+	Only the time format with the fewest missing
+	timestamps is converted (the one
+	decideTimeColumn would keep), the others are
+	just deleted. Set all_formats to convert all
+	of them
+
 	NOTE!!! Currently stamps all but UTC times to
 	the given timezone
 	"""
 
 	logging.debug('Converting time columns')
 
-	# For each defined time format...
-	for fmt in TIME_FORMATS:
-
-		# Get the timezone of the time format
-		timezone_string = CONFIG['time'][fmt]['timezone']
-		fixed_offset = 0
-		
-		if timezone_string.lower()=='station':
-			# The timezone for this time format has
-			# been set to the timezone of the station
-			fixed_offset = CONFIG['stations'][station]['offset']
-			timezone_string = CONFIG['stations'][station]['timezone']
-
-			
-		try:
-			# Copy time columns
-			t = df[['year-'+fmt, 'month-'+fmt, 'day-'+fmt, 'hour-'+fmt, 'minute-'+fmt]]
-			# Rename into generic titles
-			t.columns = ['year', 'month', 'day', 'hour', 'minute']
-			# Convert them to naive datetime objects
-			df[fmt] = pd.to_datetime(t)
-
-			if fmt == 'lst': # local standard time, no DST, use fixed offset
-				timezone = pytz.FixedOffset(fixed_offset) # using fixed timezone offset, for dataset in local standard time (without daylight savings) http://www.bom.gov.au/climate/data-services/solar/content/data-time.html
-			elif fmt == 'lt': # including DST, use timezone string
-				timezone = pytz.timezone(timezone_string) # This function will also consider daylight savings. BOM data is in local standard time without daylight savings.
-			elif fmt == 'utc':
-				timezone = pytz.timezone('UTC')
-			df[fmt] = df[fmt].dt.tz_localize(timezone, ambiguous='raise')
-
-		except KeyError:
+	# Count the missing timestamps of each time
+	# format on the raw columns
+	null_counts = {}
+	for fmt in timeFormats():
+		cols = timeColumns(fmt)
+		if all(col in df for col in cols):
+			null_counts[fmt] = int(df[cols].isnull().any(axis=1).sum())
+		else:
 			logging.debug('Error with ' + fmt)
-			pass
+
+	if null_counts and not all_formats:
+		keep = min(null_counts, key=null_counts.get)
+		null_counts = {keep: null_counts[keep]}
+
+	# For each defined time format...
+	for fmt in timeFormats():
+		if fmt in null_counts:
+			try:
+				df[fmt] = toDatetime(df, fmt, station)
+			except KeyError:
+				logging.debug('Error with ' + fmt)
 
 		# Delete the old time columns
 		deleteGroup(df, fmt)
 
+def timeColumns(fmt):
+	"""
+	The time columns of a time format
+	"""
+	return ['year-'+fmt, 'month-'+fmt, 'day-'+fmt, 'hour-'+fmt, 'minute-'+fmt]
+
+def formatTimezone(fmt, station):
+	"""
+	Returns the timezone of a time format, and
+	its offset from UTC in minutes if it is a
+	fixed offset (None otherwise)
+	"""
+
+	# Get the timezone of the time format
+	timezone_string = CONFIG['time'][fmt]['timezone']
+	fixed_offset = 0
+
+	if timezone_string.lower()=='station':
+		# The timezone for this time format has
+		# been set to the timezone of the station
+		fixed_offset = CONFIG['stations'][station]['offset']
+		timezone_string = CONFIG['stations'][station]['timezone']
+
+	if fmt == 'lst': # local standard time, no DST, use fixed offset
+		return pytz.FixedOffset(fixed_offset), fixed_offset # using fixed timezone offset, for dataset in local standard time (without daylight savings) http://www.bom.gov.au/climate/data-services/solar/content/data-time.html
+	elif fmt == 'lt': # including DST, use timezone string
+		return pytz.timezone(timezone_string), None # This function will also consider daylight savings. BOM data is in local standard time without daylight savings.
+	elif fmt == 'utc':
+		return pytz.timezone('UTC'), 0
+	raise KeyError(fmt)
+
+def epochNanoseconds(year, month, day, hour, minute):
+	"""
+	Builds naive timestamps (nanoseconds since
+	1970-01-01) from arrays of their parts.
+	Missing parts give missing timestamps (NaT)
+	Returns None if any part isn't a whole number,
+	or a date doesn't exist, so the caller can
+	fall back to pd.to_datetime
+	"""
+
+	parts = np.stack([np.asarray(x, dtype=np.float64) for x in [year, month, day, hour, minute]])
+	valid = ~np.isnan(parts).any(axis=0)
+	values = parts[:, valid]
+	if (values!=np.floor(values)).any():
+		return None
+	values = values.astype(np.int64)
+	year, month, day, hour, minute = values
+
+	if ((month<1) | (month>12) | (day<1)).any():
+		return None
+	months = ((year-1970)*12 + month-1).astype('datetime64[M]')
+	first_day = months.astype('datetime64[D]')
+	days_in_month = (months+1).astype('datetime64[D]') - first_day
+	if (day>days_in_month.astype(np.int64)).any():
+		return None
+
+	# Hours and minutes are added like timedeltas,
+	# as pd.to_datetime does (so 24:00 is midnight
+	# of the next day)
+	dates = (first_day + (day-1)).astype('datetime64[ns]').astype(np.int64)
+	ns = np.full(len(valid), np.iinfo(np.int64).min)	# NaT
+	ns[valid] = dates + (hour*60 + minute)*NS_PER_MINUTE
+	return ns
+
+def toDatetime(df, fmt, station):
+	"""
+	Converts the time columns of one time format
+	into a timezone-aware datetime Series
+
+	Timestamps are built from the integer parts
+	with vectorised arithmetic. Fixed offsets (lst
+	and utc) are applied to the nanoseconds
+	directly, without localising through pytz.
+	Anything the fast path can't handle goes
+	through pd.to_datetime and tz_localize
+	"""
+
+	timezone, fixed_offset = formatTimezone(fmt, station)
+	cols = timeColumns(fmt)
+
+	ns = epochNanoseconds(*[df[col].values for col in cols])
+	if ns is None:
+		logging.debug('Using pd.to_datetime for ' + fmt)
+		# Copy time columns
+		t = df[cols]
+		# Rename into generic titles
+		t.columns = ['year', 'month', 'day', 'hour', 'minute']
+		# Convert them to naive datetime objects
+		return pd.to_datetime(t).dt.tz_localize(timezone, ambiguous='raise')
+
+	if fixed_offset is None:
+		times = pd.DatetimeIndex(ns.view('datetime64[ns]')).tz_localize(timezone, ambiguous='raise')
+	else:
+		utc = np.where(ns==np.iinfo(np.int64).min, ns, ns - fixed_offset*NS_PER_MINUTE)
+		times = pd.DatetimeIndex(utc.view('datetime64[ns]')).tz_localize('UTC').tz_convert(timezone)
+	return pd.Series(times, index=df.index)
+
 def deleteGroup(df, format):
 	"""
 	Deletes a set of time columns
@@ -82,7 +176,7 @@ def decideTimeColumn(df):
 	# Make a list of the number of null
 	# values in each time column
 	results = {}
-	for fmt in TIME_FORMATS:
+	for fmt in timeFormats():
 		if fmt in df:
 			results[fmt] = df[fmt].isnull().sum()
 
@@ -134,21 +228,101 @@ def generateTimeseries(year, month, timezone, df_type=True):
 		timeseries.columns = ['datetime']
 	return timeseries
 
-def mergeAgainstMasterTimeseries(df, timeseries, right_on='datetime', left_on='datetime'):
+def minuteOffsets(times, timeseries):
+	"""
+	Works out the row of the master timeseries
+	(generateTimeseries with df_type=False) that
+	each timestamp belongs to
+	Returns an integer array with -1 for
+	timestamps that aren't in the timeseries
+	(missing, outside the month or not on a
+	whole minute)
+	"""
+
+	# Nanoseconds since the epoch (UTC). NaT is
+	# the smallest int64, so it is outside the
+	# month too
+	ns = pd.DatetimeIndex(times).asi8 - timeseries[0].value
+	offsets = ns//NS_PER_MINUTE
+	valid = (ns%NS_PER_MINUTE==0) & (offsets>=0) & (offsets<len(timeseries))
+	return np.where(valid, offsets, -1)
+
+def alignAgainstMasterTimeseries(dataFiles, timeseries, names=None):
 	"""
-	Generates the master timeseries, then
-	left joins a dataframe against a complete
-	timeseries, ensuring each timestep is
-	represented in the dataframe
-	Returns a new dataframe
+	Aligns dataframes with a datetime column
+	against a complete timeseries (made by
+	generateTimeseries with df_type=False), so
+	each timestep is represented once
+	Rows are scattered into one preallocated
+	(minutes x columns) array using their minute
+	offset from the start of the month, so no
+	merges are needed
+
+	Duplicate timestamps are reported, and only
+	the first row of each is kept. A column that
+	is in more than one dataframe takes its values
+	from the first one, and missing values are
+	filled from the others
+	Returns one dataframe with the timeseries as
+	its index
+
+	names - optional names of the dataframes (e.g.
+	their file paths), used when reporting
 	"""
 
-	logging.debug('Merging against master timeseries')
+	logging.debug('Aligning against master timeseries')
+
+	if names is None:
+		names = [str(i) for i in range(len(dataFiles))]
+
+	# All columns, in the order they are found
+	columns = []
+	dtypes = {}
+	for df in dataFiles:
+		for col in df:
+			if col!='datetime' and col not in dtypes:
+				columns.append(col)
+				dtypes[col] = df[col].dtype
+	positions = {col: i for i, col in enumerate(columns)}
+
+	values = np.full((len(timeseries), len(columns)), np.nan)
+	filled = np.zeros(len(columns), dtype=bool)
+
+	for df, name in zip(dataFiles, names):
+		offsets = minuteOffsets(df['datetime'], timeseries)
+		rows = np.flatnonzero(offsets>=0)
+		outside = len(offsets)-len(rows)
+		if outside:
+			logging.debug('%d rows of %s are outside the timeseries', outside, name)
+
+		# Keep the first row of each timestamp
+		offsets, first = np.unique(offsets[rows], return_index=True)
+		duplicates = len(rows)-len(first)
+		if duplicates:
+			logging.warning('%d duplicate timestamps in %s. Keeping the first row of each', duplicates, name)
+		rows = rows[first]
+
+		for col in df:
+			if col=='datetime': continue
+			j = positions[col]
+			new = df[col].values[rows].astype(np.float64)
+			if filled[j]:
+				logging.debug('Column "'+col+'" is in more than one file. Filling its missing values from '+name)
+				current = values[offsets, j]
+				new = np.where(np.isnan(current), new, current)
+			values[offsets, j] = new
+			filled[j] = True
 
-	# Left-join the dataframe against the complete timeseries
-	df = pd.merge(timeseries, df, how='left', right_on=right_on, left_on=left_on)
+	index = pd.DatetimeIndex(timeseries, freq=None, name='datetime')
+	df = pd.DataFrame(values, index=index, columns=columns)
 
-	# Make sure that the datetime column is datetime, not object
-	df[left_on] = pd.to_datetime(df[left_on])
+	# Keep the dtypes of the files where they can
+	# hold the result
+	for col in columns:
+		dtype = dtypes[col]
+		if dtype==np.float32:
+			df[col] = df[col].astype(dtype)
+		elif pd.api.types.is_integer_dtype(dtype) and not df[col].isnull().any():
+			df[col] = df[col].astype(dtype)
 
 	return df
@@ -1 +1,2 @@
-from . import decide, polish, export
+from . import stack, summary, windows, decide, polish, export
+from .stack import MonthStack
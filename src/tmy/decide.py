@@ -1,17 +1,39 @@
 import pandas as pd
+import numpy as np
 import logging
 import validation
-import calendar
 import fs_stats
+import ranking
 
 from config_parse import CONFIG
+from . import polish
+from .stack import MonthStack
+from .summary import MonthSummary
+from . import summary
+from . import windows
 
-def month(data):
+def month(data, gap_days=None, scores_path=None, statistics=None):
 	"""
 	Decides which month to use from a
 	dictionary of months of the same
-	calendar month (e.g. all February)
+	calendar month (e.g. all February),
+	or a MonthStack of them. Can also be a
+	dictionary of MonthSummary objects (see
+	low-memory in the processing block of
+	config.yml)
 	Returns the key for the month
+
+	gap_days - optional dict that the per-day gap
+	results (see tmy.polish.gapDays) that
+	ranking.rank sorts on are stored in, so
+	tmy.polish.fillRemainingGaps can reuse them
+	scores_path - if given, the score matrix is
+	saved there, so the month can be re-ranked
+	later without the minutely data (see
+	ranking.py)
+	statistics - optional tmy.windows.
+	SharedStatistics of the summaries, to reuse
+	between windows of years
 	"""
 
 	calendar_month = list(data.keys())[0].strftime('%B')
@@ -28,131 +50,583 @@ def month(data):
 	sort_by_windspeed = CONFIG['tmy']['sort-by-windspeed']
 	sort_by_least_number_missing_days = CONFIG['tmy']['sort-by-least-number-missing-days']
 
-	# Make the master CDF
-	dfs = list(data.values())
-	master = pd.concat(dfs, sort=False)
-	master = fs_stats.createCDF(master)
-
 	# Score the months
-	fs_scores = []
-	for month in data:
-		df = data[month]
-
-		# Create CDF for this month
-		df = fs_stats.createCDF(df)
-
-		# Calculate FS statistic for each
-		# test variables (DNI, GHI, temp and humidity)
-        # with respective weighting
-		# For each month, the results are put in
-		# a list with the month key:
-		# [month, score]
-		tmp = []
-		
-		cum_score = 0
-		for idx,tv in enumerate(test_variables):
-			cum_score += fs_stats.calculateFS(master[tv], df[tv]) * variable_weightings[idx]
-        
-		fs_scores.append([month, cum_score])
+	if isSummaries(data):
+		scores = summaryScoreMatrix(data, scoreVariables(), gap_days, statistics)
+	else:
+		scores = scoreMatrix(data, scoreVariables(), gap_days)
+	scores['fs-engine'] = CONFIG['tmy'].get('fs-engine', 'searchsorted')
 
 	# Rank all months based on their fs scores
-	# (lowest wins, first sorted on test variable 1,
-	# then 2, and so on)
-	ranked_keys = sorted(fs_scores, key=lambda x: (x[1]))
-	candidates = [x[0] for x in ranked_keys][:3]   # Keys for the best 3
-	candidates_top_five = [x[0] for x in ranked_keys][:6]   # Keys for the best 6
-
-	logging.debug('Candidates: '+str(candidates))
-	logging.debug('candidates_top_five: '+str(candidates_top_five))
-
-	# Remove all dfs apart from the candidates
-	tmp = {}
-	for key in candidates:
-		tmp[key] = data[key]
-	
-	tmp_top_five = {}
-	for key in candidates_top_five:
-		tmp_top_five[key] = data[key]
-		
-	data = tmp
-	data_top_five = tmp_top_five
-
-	if sort_by_windspeed:
-		logging.debug("Sorting by wind-speed")
-        # The 3 months with the best ranking undergo one
-        # more selection step: winner has the smallest
-        # deviation in average monthly windspeed
-		try:
-			lt_average = master['wind-speed'].mean()
-			deviances = {}
-			for key in data_top_five:
-				x = data_top_five[key]['wind-speed'].mean()
-				x = abs(x-lt_average)
-				deviances[key] = x
-
-			extented_candidates = sorted(deviances, key=lambda x: deviances[x])
-            
-			deviances = {}
-			for key in data:
-				x = data[key]['wind-speed'].mean()
-				x = abs(x-lt_average)
-				deviances[key] = x
-
-			ranked_candidates = sorted(deviances, key=lambda x: deviances[x])
-            
-			logging.debug('Winning candidate based on wind-speed: '+str(ranked_candidates[0]))
-			logging.debug('Ranked candidates based on wind-speed: '+str(ranked_candidates))
-		except KeyError:
-			ranked_candidates = candidates
-			extented_candidates = candidates_top_five
-	else:
-		ranked_candidates = candidates
-		extented_candidates = candidates_top_five
-    
-	if sort_by_least_number_missing_days:
-		logging.debug("Sorting by least number of missing days")
-        # ranking for best three candidates based on least number of days with gaps
-		number_of_gaps_per_candidate = count_gap_days(data, ranked_candidates)
-		ranked_candidates = sorted(number_of_gaps_per_candidate, key=lambda x: number_of_gaps_per_candidate[x])
-	
+	# (lowest wins), then sort the best three
+	# by wind-speed and/or missing days
+	ranked_candidates, extented_candidates = ranking.rank(scores, test_variables,
+		variable_weightings, sort_by_windspeed, sort_by_least_number_missing_days)
+
+	# Record whether ranking every month at minute
+	# resolution would have picked another winner
+	if 'full-fs' in scores.get('pre-ranking', {}):
+		full_scores = dict(scores, fs=scores['pre-ranking']['full-fs'])
+		full_candidates, _ = ranking.rank(full_scores, test_variables,
+			variable_weightings, sort_by_windspeed, sort_by_least_number_missing_days)
+		scores['pre-ranking']['full-winner'] = full_candidates[0].isoformat()
+		scores['pre-ranking']['changed-winner'] = bool(full_candidates[0]!=ranked_candidates[0])
+		if full_candidates[0]!=ranked_candidates[0]:
+			logging.warning('The pre-ranking changed the winner from '+str(full_candidates[0])+' to '+str(ranked_candidates[0]))
+
+	# Record whether the approximate scores alone
+	# would have picked another winner
+	if 'approximation' in scores:
+		approximate_scores = dict(scores, fs=scores['approximation']['fs'])
+		approximate_candidates, _ = ranking.rank(approximate_scores, test_variables,
+			variable_weightings, sort_by_windspeed, sort_by_least_number_missing_days)
+		scores['approximation']['approximate-winner'] = approximate_candidates[0].isoformat()
+		scores['approximation']['changed-winner'] = bool(approximate_candidates[0]!=ranked_candidates[0])
+		if approximate_candidates[0]!=ranked_candidates[0]:
+			logging.info('Exact FS scores changed the winner from '+str(approximate_candidates[0])+' to '+str(ranked_candidates[0]))
+
+	if scores_path is not None:
+		ranking.save(scores, scores_path)
+
 	logging.info('Winning candidate: '+str(ranked_candidates[0]))
 	logging.debug('Ranked candidates: '+str(ranked_candidates))
 	return ranked_candidates, extented_candidates
 
-def count_gap_days(data, ranked_candidates):
-	"""
-	Counts number of days with any gaps remaining in the winning
-	
-	Returns the number of days for each ranked_candidate
-
-	data - dict, keys are datetime objects and
-		values are dataframes
-	ranked_candidates - list of candidates, ordered
-		by score (i.e. winning month is first entry)
-	"""
-
-	logging.debug('Counting days with any remaining gaps')
-	
-	number_of_gaps_per_candidate = {}
-	month=list(data.keys())[0].month
-	year=list(data.keys())[0].year
-	eomday = calendar.monthrange(year, month)[1]
-	
-	for current_candidate in ranked_candidates:
-		odf = data[current_candidate]	 # other dataframe
-		number_of_gaps = 0
-		
-		for day in range(1, eomday+1):
-			replacement_keys = [k for k in list(odf.index) if k.month==month and k.day==day]
-			replacement_day = odf.loc[replacement_keys]
-			
-			
-			if replacement_day.isnull().values.any():
-				# There are empty values in the
-				# day.
-				number_of_gaps = number_of_gaps + 1
-		
-		logging.debug('Number of days with gaps for '+str(current_candidate)+': '+str(number_of_gaps))
-		number_of_gaps_per_candidate[current_candidate] = number_of_gaps
-		
-	return number_of_gaps_per_candidate
\ No newline at end of file
+def scoreVariables():
+	"""
+	Variables that get an FS score: the test
+	variables, plus any listed in score-variables
+	in the tmy block of config.yml (so they can
+	be used when re-ranking)
+	"""
+	variables = list(CONFIG['tmy']['variables'])
+	variables += CONFIG['tmy'].get('score-variables') or []
+	return list(dict.fromkeys(variables))
+
+def scoreMatrix(data, variables, gap_days=None):
+	"""
+	Works out everything the ranking of a
+	calendar month needs, for every month
+	Returns a dictionary with:
+	keys - the month keys, in the order of data
+	variables - the scored variables
+	fs - unweighted FS statistic of each month
+		(rows) and variable (columns). None if
+		the month doesn't have the variable
+	wind-speed-deviation - deviation of each
+		month's average wind-speed from the long
+		term average. None if not available
+	gap-days - the days of each month that have
+		gaps
+	approximation - only with the approximate FS
+		engine, see approximateFsScores
+	pre-ranking - only with pre-ranking enabled,
+		see preRank. The months that weren't among
+		the best of the pre-ranking have no fs
+
+	gap_days - optional dict of key -> per-day gap
+	results (see tmy.polish.gapDays) to reuse and
+	add to
+	"""
+
+	keys = list(data.keys())
+	calendar_month = keys[0].month
+
+	# Rank the months on coarse means first, if
+	# enabled, and only score the best at minute
+	# resolution
+	pre_ranking = None
+	months = None
+	resolution = coarseResolution()
+	if resolution is not None:
+		coarse = {}
+		rows = {}
+		for key in keys:
+			coarse[key] = {}
+			for v in variables:
+				sample = monthSample(data, key, v)
+				if sample is not None:
+					coarse[key][v] = fs_stats.sortedSample(summary.coarseSample(sample, resolution))
+			rows[key] = -(-monthRows(data, key)//resolution)
+		pre_ranking, months = preRank(coarse, rows, variables, resolution)
+
+	approximation = {}
+	fs = fsScores(data, variables, approximation, months)
+	if pre_ranking is not None and preRankingSettings().get('compare'):
+		pre_ranking['full-fs'] = fsScores(data, variables)
+
+	# Deviation in average monthly windspeed
+	wind_speed_deviation = [None]*len(keys)
+	try:
+		lt_average = pd.Series(longTermSample(data, 'wind-speed')).mean()
+		for i, key in enumerate(keys):
+			sample = monthSample(data, key, 'wind-speed')
+			if sample is not None:
+				wind_speed_deviation[i] = float(abs(pd.Series(sample).mean()-lt_average))
+	except KeyError:
+		pass
+
+	# Days with gaps
+	if gap_days is None:
+		gap_days = {}
+	days_with_gaps = []
+	for key in keys:
+		if key not in gap_days:
+			gap_days[key] = polish.monthGapDays(data, key, calendar_month)
+		days_with_gaps.append([int(d)+1 for d in np.flatnonzero(gap_days[key][0])])
+
+	scores = {
+		'keys': keys,
+		'variables': list(variables),
+		'fs': fs,
+		'wind-speed-deviation': wind_speed_deviation,
+		'gap-days': days_with_gaps,
+	}
+	if approximation:
+		scores['approximation'] = approximation
+	if pre_ranking is not None:
+		scores['pre-ranking'] = pre_ranking
+	return scores
+
+def preRankingSettings():
+	"""
+	pre-ranking from the tmy block of config.yml,
+	or None if it isn't enabled
+	"""
+	settings = CONFIG['tmy'].get('pre-ranking') or {}
+	if not settings.get('enabled'):
+		return None
+	return settings
+
+def coarseResolution():
+	"""
+	Minutes of the blocks whose means the
+	pre-ranking ranks on, or None if it isn't
+	enabled
+	"""
+	settings = preRankingSettings()
+	if settings is None:
+		return None
+	resolution = int(settings.get('resolution', 60))
+	if resolution<1:
+		raise ValueError('The resolution of the pre-ranking must be at least one minute')
+	return resolution
+
+def preRank(coarse, rows, variables, resolution):
+	"""
+	Ranks the months on the FS statistic of their
+	coarse means (see tmy.summary.coarseSample),
+	weighted as in ranking.rank
+	Returns the pre-ranking entry of the score
+	matrix (resolution, the coarse FS of each
+	month and variable, which months are scored at
+	minute resolution, and the test variables and
+	weighting of the cut), and the list of the
+	top-n months, which are
+
+	coarse - month key -> variable -> sorted sample
+		of the coarse means
+	rows - month key -> number of blocks of the
+		month
+	"""
+
+	top_n = preRankingSettings().get('top-n', 6)
+	keys = list(coarse)
+
+	lt_samples = {}
+	for v in variables:
+		months = [key for key in keys if v in coarse[key]]
+		if months:
+			size = sum(coarse[key][v][1] if v in coarse[key] else rows[key] for key in keys)
+			lt_samples[v] = np.sort(np.concatenate([coarse[key][v][0] for key in months])), size
+	fs = [[fs_stats.calculateFSSorted(lt_samples[v], coarse[key][v]) if v in coarse[key] else None for v in variables] for key in keys]
+
+	test_variables = list(CONFIG['tmy']['variables'])
+	variable_weightings = [float(w) for w in CONFIG['tmy']['weighting']]
+	weighted = ranking.weightedScores({'keys': keys, 'variables': variables, 'fs': fs},
+		test_variables, variable_weightings)
+	best = [key for key, score in sorted(weighted, key=lambda x: x[1])][:top_n]
+	logging.debug('Pre-ranking on '+str(resolution)+' minute means: scoring '+str(best)+' at minute resolution')
+
+	pre_ranking = {
+		'resolution': resolution,
+		'fs': fs,
+		'fine': [key in best for key in keys],
+		'variables': test_variables,
+		'weighting': variable_weightings,
+	}
+	return pre_ranking, best
+
+def isSummaries(data):
+	"""
+	True if data is a dictionary of MonthSummary
+	objects
+	"""
+	if isinstance(data, MonthStack) or not data:
+		return False
+	return isinstance(next(iter(data.values())), MonthSummary)
+
+def summaryScoreMatrix(summaries, variables, gap_days=None, statistics=None):
+	"""
+	Same as scoreMatrix, from a dictionary of
+	month key -> MonthSummary. Uses the
+	searchsorted FS engine, unless fs-engine is
+	approximate
+
+	gap_days - optional dict that the per-day gap
+	results of the months are added to
+	statistics - optional tmy.windows.
+	SharedStatistics of (at least) the summaries,
+	e.g. to share between windows of years. One is
+	made if None. The long-term samples are added
+	up from its counts instead of being joined and
+	sorted, so the samples of all months never
+	have to be in memory at once
+	"""
+
+	keys = list(summaries.keys())
+	if statistics is None:
+		statistics = windows.SharedStatistics(summaries, CONFIG.get('processing', {}).get('windows-cache-mb'))
+
+	# Pre-ranking on the coarse means of the
+	# summaries, if enabled
+	pre_ranking = None
+	months = None
+	resolution = coarseResolution()
+	if resolution is not None:
+		if any(s.coarse_resolution!=resolution for s in summaries.values()):
+			raise ValueError('The month summaries have no means of '+str(resolution)+' minutes')
+		pre_ranking, months = preRank({key: summaries[key].coarse for key in keys},
+			{key: -(-summaries[key].rows//resolution) for key in keys}, variables, resolution)
+
+	approximation = {}
+	fs = summaryFsScores(summaries, variables, approximation, months, statistics)
+	if pre_ranking is not None and preRankingSettings().get('compare'):
+		pre_ranking['full-fs'] = summaryFsScores(summaries, variables, statistics=statistics)
+
+	# Deviation in average monthly windspeed
+	wind_speed_deviation = [None]*len(keys)
+	counts = [s.wind_speed_count for s in summaries.values() if s.wind_speed_count is not None]
+	if counts:
+		lt_count = sum(counts)
+		lt_average = sum(s.wind_speed_sum for s in summaries.values() if s.wind_speed_count is not None)/lt_count if lt_count else np.nan
+		for i, key in enumerate(keys):
+			if summaries[key].wind_speed_count is not None:
+				wind_speed_deviation[i] = float(abs(summaries[key].windSpeedMean()-lt_average))
+
+	# Days with gaps
+	if gap_days is None:
+		gap_days = {}
+	days_with_gaps = []
+	for key in keys:
+		if key not in gap_days:
+			gap_days[key] = tuple(x.copy() for x in summaries[key].gap_days)
+		days_with_gaps.append([int(d)+1 for d in np.flatnonzero(gap_days[key][0])])
+
+	scores = {
+		'keys': keys,
+		'variables': list(variables),
+		'fs': fs,
+		'wind-speed-deviation': wind_speed_deviation,
+		'gap-days': days_with_gaps,
+	}
+	if approximation:
+		scores['approximation'] = approximation
+	if pre_ranking is not None:
+		scores['pre-ranking'] = pre_ranking
+	return scores
+
+def summaryFsScores(summaries, variables, approximation=None, months=None, statistics=None):
+	"""
+	FS statistic of each month and variable, as
+	fsScores, from a dictionary of MonthSummary
+	objects
+
+	months - optional list of the months to score
+	(the others get None)
+	statistics - tmy.windows.SharedStatistics of
+	(at least) the summaries
+	Other arguments as for summaryScoreMatrix
+	"""
+
+	keys = list(summaries.keys())
+	fs_engine = CONFIG['tmy'].get('fs-engine', 'searchsorted')
+
+	if fs_engine=='approximate' and months is None:
+		return approximateFsScores({key: summaries[key].samples for key in keys},
+			{key: summaries[key].rows for key in keys}, variables, approximation, statistics)
+
+	if fs_engine not in ['searchsorted', 'approximate']:
+		logging.warning('Month summaries are scored with the searchsorted FS engine, not '+str(fs_engine))
+	if months is None:
+		months = keys
+	return [[statistics.exactFs(keys, key, v) if key in months else None for v in variables] for key in keys]
+
+def longTermSample(data, column):
+	"""
+	Joins one column of all months into a single
+	long-term sample. Has the same values as the
+	column of pd.concat of the whole dataframes
+	(months without the column add NaNs)
+	Raises KeyError if no month has the column
+	"""
+	if isinstance(data, MonthStack):
+		return data.longTermSample(column)
+
+	if not any(column in df for df in data.values()):
+		raise KeyError(column)
+
+	samples = []
+	for df in data.values():
+		if column in df:
+			samples.append(df[column].values)
+		else:
+			samples.append(np.full(len(df), np.nan))
+	return np.concatenate(samples)
+
+def monthSample(data, key, column):
+	"""
+	The values of one column of a month (a
+	dictionary of dataframes or a MonthStack)
+	None if the month doesn't have the column
+	"""
+	if isinstance(data, MonthStack):
+		return data.sample(key, column)
+	if column in data[key]:
+		return data[key][column].values
+	return None
+
+def monthRows(data, key):
+	"""
+	Number of rows of a month (of a dictionary of
+	dataframes or a MonthStack)
+	"""
+	if isinstance(data, MonthStack):
+		return int(data.minutes[data.slot[key]])
+	return len(data[key])
+
+def fsScores(data, variables, approximation=None, months=None):
+	"""
+	Scores each month against the long-term CDF
+	of the calendar month with the FS statistic
+	of each variable (lower is better)
+	Returns a list with a list of scores for each
+	month (None where the month doesn't have the
+	variable)
+
+	The FS engine is set by fs-engine in the tmy
+	block of config.yml: 'searchsorted' (default)
+	sorts the long-term sample of each variable
+	once and evaluates the candidate CDFs with
+	numpy.searchsorted, 'reference' merges the
+	CDFs of every column (fs_stats.calculateFS),
+	'approximate' ranks with histogram sketches
+	and only scores the best months exactly (see
+	approximateFsScores)
+
+	approximation - optional dict that the
+	approximate engine stores its results in
+	months - optional list of the months to score
+	(the others get None). The approximate engine
+	then scores them with searchsorted
+	"""
+
+	fs_engine = CONFIG['tmy'].get('fs-engine', 'searchsorted')
+	if months is None:
+		months = list(data.keys())
+	elif fs_engine=='approximate':
+		fs_engine = 'searchsorted'
+	logging.debug('Scoring with the '+fs_engine+' FS engine')
+
+	fs_scores = []
+
+	if fs_engine=='reference':
+		# Make the master CDF (a MonthStack has no
+		# values(), its months are made into
+		# dataframes)
+		dfs = [data[month] for month in data]
+		master = pd.concat(dfs, sort=False)
+		master = fs_stats.createCDF(master)
+
+		for month in data:
+			if month not in months:
+				fs_scores.append([None]*len(variables))
+				continue
+
+			# Create CDF for this month
+			df = fs_stats.createCDF(data[month])
+
+			# Calculate FS statistic for each
+			# variable
+			tmp = []
+			for v in variables:
+				if v in df and v in master:
+					tmp.append(fs_stats.calculateFS(master[v], df[v]))
+				else:
+					tmp.append(None)
+			fs_scores.append(tmp)
+
+	elif fs_engine=='searchsorted':
+		# Sort the long-term sample of each
+		# variable once
+		lt_samples = {}
+		for v in variables:
+			try:
+				lt_samples[v] = fs_stats.sortedSample(longTermSample(data, v))
+			except KeyError:
+				pass
+
+		for month in data:
+			if month not in months:
+				fs_scores.append([None]*len(variables))
+				continue
+			tmp = []
+			for v in variables:
+				sample = monthSample(data, month, v)
+				if sample is not None and v in lt_samples:
+					candidate_sample = fs_stats.sortedSample(sample)
+					tmp.append(fs_stats.calculateFSSorted(lt_samples[v], candidate_sample))
+				else:
+					tmp.append(None)
+			fs_scores.append(tmp)
+
+	elif fs_engine=='approximate':
+		samples = {}
+		rows = {}
+		for month in data:
+			samples[month] = {}
+			for v in variables:
+				sample = monthSample(data, month, v)
+				if sample is not None:
+					samples[month][v] = fs_stats.sortedSample(sample)
+			rows[month] = monthRows(data, month)
+		fs_scores = approximateFsScores(samples, rows, variables, approximation)
+
+	else:
+		raise ValueError('Unknown FS engine "'+str(fs_engine)+'"')
+
+	return fs_scores
+
+def binWidth(variable):
+	"""
+	Bin width of the histogram sketches of a
+	variable, from fs-approximate in the tmy block
+	of config.yml (a number, or a dictionary of
+	variable -> number with an optional default)
+	"""
+	bin_width = (CONFIG['tmy'].get('fs-approximate') or {}).get('bin-width', 0.1)
+	if isinstance(bin_width, dict):
+		bin_width = bin_width.get(variable, bin_width.get('default', 0.1))
+	if not bin_width or bin_width<=0:
+		raise ValueError('The bin width of "'+variable+'" must be positive')
+	return bin_width
+
+def approximateFsScores(samples, rows, variables, approximation=None, statistics=None):
+	"""
+	FS scores of the approximate engine. Every
+	month is scored against a histogram sketch of
+	the long-term sample (fs_stats.
+	calculateFSApproximate), which also gives a
+	bound on the error of each score. Months that
+	could be among the top-k of the weighted
+	ranking (see fs-approximate in the tmy block of
+	config.yml) within those bounds are then scored
+	exactly, so the top-k and their order are the
+	same as with the exact engines. The other
+	months keep their approximate scores
+	Returns the scores, as fsScores
+
+	samples - month key -> variable -> sorted
+		sample (fs_stats.sortedSample), for the
+		variables the month has
+	rows - month key -> number of rows of the month
+	approximation - optional dict that the
+		approximate scores (fs), their error bounds
+		(fs-error) and which months were scored
+		exactly (exact) are stored in
+	statistics - optional tmy.windows.
+		SharedStatistics of the months, whose
+		sketches and counts are used (and kept)
+	"""
+
+	settings = CONFIG['tmy'].get('fs-approximate') or {}
+	top_k = settings.get('top-k', 6)
+	test_variables = CONFIG['tmy']['variables']
+	variable_weightings = CONFIG['tmy']['weighting']
+	keys = list(samples)
+
+	# Sketch the long-term sample of each variable
+	# by merging sketches of the months, and score
+	# the months against it
+	approximate = [[None]*len(variables) for key in keys]
+	bounds = [[None]*len(variables) for key in keys]
+	lt_parts = {}
+	for j, v in enumerate(variables):
+		months = [key for key in keys if v in samples[key]]
+		if not months:
+			continue
+		bin_width = binWidth(v)
+		size = sum(samples[key][v][1] if v in samples[key] else rows[key] for key in keys)
+		# Merged one month at a time, so only one
+		# month's sample is needed at once
+		lt_sketch = None
+		for key in months:
+			if statistics is not None:
+				sketch = statistics.sketch(key, v, bin_width)
+			else:
+				sketch = fs_stats.histogramSketch(samples[key][v], bin_width)
+			lt_sketch = fs_stats.mergeSketches([sketch] if lt_sketch is None else [lt_sketch, sketch], size)
+		lt_parts[v] = months, size
+		for i, key in enumerate(keys):
+			if v in samples[key]:
+				approximate[i][j], bounds[i][j] = fs_stats.calculateFSApproximate(lt_sketch, samples[key][v])
+
+	# Range of the weighted score of each month, as
+	# in ranking.rank. A month without a score for
+	# one of the test variables can't win
+	columns = [variables.index(tv) for tv in test_variables if tv in variables]
+	lower = []
+	upper = []
+	for i in range(len(keys)):
+		if len(columns)<len(test_variables) or any(approximate[i][c] is None for c in columns):
+			lower.append(float('inf'))
+			upper.append(float('inf'))
+			continue
+		score = sum(approximate[i][c]*w for c, w in zip(columns, variable_weightings))
+		bound = sum(bounds[i][c]*abs(w) for c, w in zip(columns, variable_weightings))
+		lower.append(score-bound)
+		upper.append(score+bound)
+
+	# A month can only be among the top-k if its
+	# score can be below the k-th smallest upper
+	# bound
+	threshold = sorted(upper)[max(min(top_k, len(keys)), 1)-1]
+	exact = [bool(lower[i]<=threshold) for i in range(len(keys))]
+	if all(exact):
+		logging.debug('Approximate FS: the error bounds rule out no month. Scoring all months exactly')
+	else:
+		logging.debug('Approximate FS: scoring '+str(sum(exact))+' of '+str(len(keys))+' months exactly')
+
+	# The exact scores need the sorted long-term
+	# sample, but only if a month is scored exactly
+	fs_scores = [list(row) for row in approximate]
+	lt_samples = {}
+	for i, key in enumerate(keys):
+		if not exact[i]:
+			continue
+		for j, v in enumerate(variables):
+			if v not in samples[key]:
+				continue
+			if statistics is not None:
+				fs_scores[i][j] = statistics.exactFs(keys, key, v)
+				continue
+			if v not in lt_samples:
+				months, size = lt_parts[v]
+				lt_samples[v] = np.sort(np.concatenate([samples[k][v][0] for k in months])), size
+			fs_scores[i][j] = fs_stats.calculateFSSorted(lt_samples[v], samples[key][v])
+
+	if approximation is not None:
+		approximation['fs'] = approximate
+		approximation['fs-error'] = bounds
+		approximation['exact'] = exact
+	return fs_scores
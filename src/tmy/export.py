@@ -31,17 +31,22 @@ def merge(data):
 def to_csv(df, outpath):
 	"""
 	Exports the dataframe to .csv
+	The file is written under a temporary name
+	first, so a worker that gets stopped halfway
+	through never leaves a partial file behind
 	"""
 
 	logging.info('Exporting to '+outpath)
 
 	# If the directory doesn't exist, make it
 	dir = os.path.dirname(outpath)
-	if dir and not os.path.isdir(dir):
-		os.mkdir(dir)
+	if dir:
+		os.makedirs(dir, exist_ok=True)
 
 	# Export the file
-	df.to_csv(outpath)
+	tmp_path = outpath+'.tmp'
+	df.to_csv(tmp_path)
+	os.replace(tmp_path, outpath)
 
 def to_csv_no_index(df, outpath):
 	"""
@@ -52,8 +57,8 @@ def to_csv_no_index(df, outpath):
 
 	# If the directory doesn't exist, make it
 	dir = os.path.dirname(outpath)
-	if dir and not os.path.isdir(dir):
-		os.mkdir(dir)
+	if dir:
+		os.makedirs(dir, exist_ok=True)
 
 	# Export the file
 	df.to_csv(outpath, index=False)
\ No newline at end of file
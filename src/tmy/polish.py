@@ -4,12 +4,45 @@ import datetime
 import logging
 import calendar
 
+from .stack import MonthStack
+
 def makeSortColumn(x):
 	t = x['datetime']
 	x['sort-score'] = (t.day*24 + t.hour)*60 + t.minute
 	return x
 
-def fillRemainingGaps(data, ranked_candidates, extented_candidates):
+def gapDays(df, month):
+	"""
+	Finds the days of a calendar month that have
+	gaps, using one vectorised pass over the
+	dataframe
+	Returns two arrays with an entry for each
+	possible day (1 to 31, at position day-1):
+	True if the day has any missing values, and
+	the number of rows in the day
+
+	df - dataframe with a datetime index
+	month - calendar month (rows of any other
+		month are ignored)
+	"""
+	index = df.index
+	day_codes = np.where(index.month==month, index.day, 0)
+	row_gaps = df.isnull().values.any(axis=1)
+
+	rows = np.bincount(day_codes, minlength=32)[1:32]
+	gaps = np.bincount(day_codes, weights=row_gaps, minlength=32)[1:32]>0
+	return gaps, rows
+
+def monthGapDays(data, key, month):
+	"""
+	gapDays() of one month of data (a dictionary
+	of dataframes or a MonthStack)
+	"""
+	if isinstance(data, MonthStack):
+		return data.gapDays(key)
+	return gapDays(data[key], month)
+
+def fillRemainingGaps(data, ranked_candidates, extented_candidates, gap_days=None, replaced=None):
 	"""
 	Replaces any gaps remaining in the winning
 	dataframe with days from other well-scoring
@@ -18,117 +51,124 @@ def fillRemainingGaps(data, ranked_candidates, extented_candidates):
 	month
 
 	data - dict, keys are datetime objects and
-		values are dataframes
+		values are dataframes. Can also be a
+		MonthStack, whose winning month is filled
+		in the stack and returned as a dataframe
 	ranked_candidates - list of candidates, ordered
 		by score (i.e. winning month is first entry)
+	extented_candidates - longer list of candidates,
+		used if none of ranked_candidates can fill
+		a day
+	gap_days - optional dict of key -> gapDays()
+		results that have already been worked out
+		(e.g. for ranking.rank by
+		tmy.decide.month). Missing
+		entries are added to it
+	replaced - optional dict that the replaced
+		days are stored in: day -> key of the month
+		it was taken from (None if no month could
+		replace it)
 	"""
 
 	logging.info('Replacing any remaining gaps...')
+	if replaced is None:
+		replaced = {}
+
+	stacked = isinstance(data, MonthStack)
 
 	wkey = ranked_candidates[0]	 # winning key
-	wdf = data[wkey]				# winning dataframe
 	other_candidates = ranked_candidates[1:]
 
-	# Loop through the index of the winning
-	# dataframe, which is a heap of datetime
-	# objects
-	timestamps = list(wdf.index)
-	month = timestamps[0].month
-	year=timestamps[0].year
+	if stacked:
+		timestamp = lambda key, position: data.timestamp(key, position)
+		first = data.timestamp(wkey, 0)
+	else:
+		wdf = data[wkey]				# winning dataframe
+		timestamp = lambda key, position: data[key].index[position]
+		first = wdf.index[0]
+	month = first.month
+	year = first.year
 	eomday = calendar.monthrange(year, month)[1]
-	#for i in range(0, len(timestamps)):
+
+	# Build the (candidate, day) completeness
+	# matrix once. Each day's replacement is then
+	# just a lookup into it
+	if gap_days is None:
+		gap_days = {}
+	candidates = list(dict.fromkeys([wkey]+list(other_candidates)+list(extented_candidates)))
+	for key in candidates:
+		if key not in gap_days:
+			gap_days[key] = monthGapDays(data, key, month)
+	slot = {key: i for i, key in enumerate(candidates)}
+	gaps = np.vstack([gap_days[key][0] for key in candidates])
+	rows = np.vstack([gap_days[key][1] for key in candidates])
+	if stacked:
+		n_columns = [data.numberOfColumns(key) for key in candidates]
+	else:
+		n_columns = [data[key].shape[1] for key in candidates]
+
+	def dayPositions(key, day):
+		if stacked:
+			return data.dayRows(key, day)
+		index = data[key].index
+		return np.flatnonzero((index.month==month) & (index.day==day))
+
+	def findReplacement(keys, day, source_shape):
+		# First candidate that has no missing values
+		# on this day, and the same shape of day
+		for key in keys:
+			i = slot[key]
+			if (not gaps[i, day-1]) and ((rows[i, day-1], n_columns[i]) == source_shape):
+				return key
+		return None
+
+	w = slot[wkey]
 	for day in range(1, eomday+1):
-		source_keys = [k for k in list(wdf.index) if k.month==month and k.day==day]
-		source_day = wdf.loc[source_keys]
-		source_shape = source_day.shape
 		# If there is a Nan anywhere in this
-		# row, replace this day
-		try:
-			missing_data = source_day.isnull().values.any()
-		except IndexError:
-			# The number of rows has changed
-			# Complain and break
-			logging.error('Unexpected end of dataframe (the\
-				number of rows in this dataframe has changed)')
+		# day, replace this day
+		if not gaps[w, day-1]:
+			continue
+
+		source_positions = dayPositions(wkey, day)
+		source_shape = (len(source_positions), n_columns[w])
+		logging.info('Replacing '+str(timestamp(wkey, source_positions[0])))
+
+		# Go through each other candidate and get
+		# the same day. If there's no missing values
+		# in that day, use it as the replacement day
+		replacement_key = findReplacement(other_candidates, day, source_shape)
+
+		# If not found, go through extended list of five candidates
+		if replacement_key is None:
+			logging.debug('Using extended candidate list')
+			replacement_key = findReplacement(extented_candidates, day, source_shape)
+
+		# If we couldn't find a replacement, we have to
+		# quit processing of the entire station!
+		if replacement_key is None:
+			logging.error('Failed to replace missing data in winning month')
+			replaced[day] = None
 			break
-		if missing_data:
-			logging.info('Replacing '+str(list(source_day.index)[0]))
-			#month = timestamps[i].month
-			#day = timestamps[i].day
-
-			# Go through each other candidate and get
-			# the same day. If there's no missing values
-			# in that day, quit the loop and use it as
-			# the replacement day
-			replacement_day = None
-			replacement_found = False
-			for other_candidate in other_candidates:
-				odf = data[other_candidate]	 # other dataframe
-				replacement_keys = [k for k in list(odf.index) if k.month==month and k.day==day]
-				replacement_day = odf.loc[replacement_keys]
-				replacement_day_shape = replacement_day.shape
-
-				if (not replacement_day.isnull().values.any()) and (replacement_day_shape == source_shape):
-					# There are no empty values in the
-					# replacement day. We have fixed this
-					# gap
-					logging.debug('Taking day from '+str(list(replacement_day.index)[0]))
-					replacement_found = True
-					break
-			# If not found, go through extended list of five candidates
-			if not replacement_found:
-				logging.debug('Using extended candidate list')
-				replacement_day = None
-				replacement_found = False
-				for other_candidate in extented_candidates:
-					odf = data[other_candidate]	 # other dataframe
-					replacement_keys = [k for k in list(odf.index) if k.month==month and k.day==day]
-					replacement_day = odf.loc[replacement_keys]
-
-					if (not replacement_day.isnull().values.any()) and (replacement_day_shape == source_shape):
-						# There are no empty values in the
-						# replacement day. We have fixed this
-						# gap
-						logging.debug('Taking day from '+str(list(replacement_day.index)[0]))
-						replacement_found = True
-						break
-			
-			# If we couldn't find a replacement, we have to
-			# quit processing of the entire station!
-			if not replacement_found:
-				logging.error('Failed to replace missing data in winning month')
-				break
-
-			# REPLACE DAY
-			# Remove the old day
-			#keys_to_replace = [k for k in list(wdf.index) if k.month==month and k.day==day]
-			
-			try:
-				wdf.loc[source_keys] = replacement_day.values
-			except:
-				logging.error('Failed to replace missing data in winning month. Replacement data incomplete.')
-			
-			## old code
-			#wdf = wdf.drop(keys_to_replace)
-			# Put in the new day
-			#wdf = wdf.append(replacement_day)
-
-			
-			
-			# Rows are out of order now. Sort
-			# the dataframe based on day, hour
-			# and minute, NOT on month (we have
-			# different years)
-			# Move the datetime out of the index
-			#wdf.reset_index(inplace=True)
-			# Create a column we can sort on
-			#wdf = wdf.apply(makeSortColumn, axis=1)
-			# Sort
-			#wdf.sort_values(by='sort-score', inplace=True)
-			# Delete sort column and restore index
-			#del wdf['sort-score']
-			#wdf.set_index('datetime', inplace=True)
 
+		# REPLACE DAY
+		# One block assignment of the whole day
+		try:
+			replacement_positions = dayPositions(replacement_key, day)
+			logging.debug('Taking day from '+str(timestamp(replacement_key, replacement_positions[0])))
+			if stacked:
+				data.replaceDay(wkey, replacement_key, day)
+			else:
+				odf = data[replacement_key]	 # other dataframe
+				# Columns are matched by name, the months
+				# may have them in different orders
+				wdf.iloc[source_positions] = odf[wdf.columns].values[replacement_positions]
+			gap_days[wkey][0][day-1] = False
+			replaced[day] = replacement_key
+		except:
+			logging.error('Failed to replace missing data in winning month. Replacement data incomplete.')
+
+	if stacked:
+		wdf = data.frame(wkey)
 	return wkey, wdf
 
 def smooth(df, minutes):
@@ -142,44 +182,49 @@ def smooth(df, minutes):
 
 	logging.info('Smoothing year interfaces')
 
-	# Loop through the timestamps in the new
-	# dataframe, and if the next timestamp is
-	# of a different year, we need to smooth
-	# that interface
-	timestamps = df.index
-	for i in range(0, len(timestamps)):
-		t = timestamps[i]
-		t_next = timestamps[(i+1)%len(timestamps)]
-		if t.year!=t_next.year:
-
-			# Calculate indicies for start and
-			# end of the slice
-			i0 = i-minutes
-			i1 = (i+minutes)%len(timestamps)
-
-			if i0<0:
-				if i1>i0:
-					# Start of slice wraps around
-					# to end of df
-					a = df.iloc[i0:]
-					b = df.iloc[:i1]
-					slice = pd.concat([a, b])
-				else:
-					raise RuntimeError('Unknown fault during smoothing')
+	n = len(df)
+	if n==0:
+		return
+
+	# Find all interfaces in one pass: positions
+	# where the next timestamp (wrapping around
+	# to the start) is of a different year
+	years = df.index.year.values
+	interfaces = np.flatnonzero(years!=np.roll(years, -1))
+	if len(interfaces)==0:
+		return
+
+	values = df.to_numpy(dtype=np.float64, copy=True)
+	window = np.arange(-minutes, minutes)
+	touched = []
+
+	for i in interfaces:
+		# Row positions of the slice (minutes either
+		# side of the interface). Slices near either
+		# end wrap around the dataframe
+		rows = (i+window)%n
+		block = values[rows]
+
+		# Linearly interpolate between the first and
+		# last values. Like pandas' interpolate, values
+		# after the last valid one are held constant.
+		# If the first value is missing, nothing is
+		# interpolated and the column is left as it is
+		# (the slice was only written back where it
+		# wasn't empty)
+		x = np.arange(len(rows))
+		for j in range(block.shape[1]):
+			y = block[[0, -1], j]
+			if np.isnan(y[0]):
+				continue
+			if not np.isnan(y[1]):
+				block[1:-1, j] = np.interp(x[1:-1], x[[0, -1]], y)
 			else:
-				if i1<i0:
-					# End of slice wraps around
-					# to start of df
-					a = df.iloc[i0:]
-					b = df.iloc[:i1]
-					slice = pd.concat([a, b])
-				else:
-					# Normal case
-					slice = df.iloc[i0:i1]
-
-			# Remove all but the first and last values
-			slice.iloc[1:-1] = np.nan
-			# Interpolate
-			slice.interpolate(inplace=True)
-			# Put back in dataframe
-			df.update(slice, overwrite=True)
+				block[1:, j] = y[0]
+
+		values[rows] = block
+		touched.append(rows)
+
+	# Put back in dataframe
+	rows = np.unique(np.concatenate(touched))
+	df.iloc[rows] = values[rows]
\ No newline at end of file
@@ -0,0 +1,231 @@
+import collections.abc
+import calendar
+import numpy as np
+import pandas as pd
+
+NS_PER_MINUTE = 60*10**9
+MINUTES_PER_DAY = 24*60
+
+class MonthStack(collections.abc.Mapping):
+	"""
+	All months of one calendar month (e.g. all
+	February) in one contiguous array shaped
+	(years x minutes of the month x variables),
+	instead of a dictionary of dataframes
+
+	Months share the minute axis. Minutes past the
+	end of a shorter month (e.g. the 29th of
+	February in other years) and variables a month
+	doesn't have are NaN, and are masked by
+	minutes and present
+
+	It still behaves like the dictionary of
+	dataframes (month key -> dataframe), but the
+	dataframes are made on request. Use frame() to
+	get one back, e.g. for the winning month
+
+	keys - month keys (datetime objects), in the
+		order of the dictionary
+	columns - all variables, in the order they
+		are first found
+	values - the data (years x minutes x variables)
+	present - True if a month has a variable
+		(years x variables)
+	minutes - number of minutes of each month
+	"""
+
+	def __init__(self, keys, columns, values, present, minutes, starts, timezones, frame_columns, dtypes, index_name):
+		self.keys_ = list(keys)
+		self.columns = list(columns)
+		self.values = values
+		self.present = present
+		self.minutes = minutes
+		self.starts = starts
+		self.timezones = timezones
+		self.frame_columns = frame_columns
+		self.dtypes = dtypes
+		self.index_name = index_name
+		self.slot = {key: i for i, key in enumerate(self.keys_)}
+		self.column_slot = {column: j for j, column in enumerate(self.columns)}
+
+	@classmethod
+	def fromDict(cls, data, dtype=None, release=False):
+		"""
+		Makes a MonthStack from a dictionary of
+		months (datetime keys, dataframe values)
+		Every dataframe needs a complete minutely
+		index from the start to the end of its month,
+		as made by load.load. Raises ValueError if
+		one doesn't (data is then left as it is)
+
+		dtype - dtype of the array. Defaults to
+			float32 if all data is float32, otherwise
+			float64
+		release - remove each month from data once
+			it is copied into the array, so only one
+			dataframe is held twice at a time (if
+			nothing else refers to them)
+		"""
+
+		keys = list(data.keys())
+		if not keys:
+			raise ValueError('No months to stack')
+
+		# All columns, in the order they are found
+		columns = list(dict.fromkeys(column for df in data.values() for column in df))
+		column_slot = {column: j for j, column in enumerate(columns)}
+
+		if dtype is None:
+			all_float32 = all((df.dtypes==np.float32).all() for df in data.values())
+			dtype = np.float32 if all_float32 else np.float64
+
+		minutes = np.zeros(len(keys), dtype=np.int64)
+		starts = np.zeros(len(keys), dtype=np.int64)
+		for i, key in enumerate(keys):
+			index = data[key].index
+			days = calendar.monthrange(key.year, key.month)[1]
+			if not isinstance(index, pd.DatetimeIndex) or index.tz is None or len(index)!=days*MINUTES_PER_DAY:
+				raise ValueError(str(key)+' is not a complete minutely month')
+			first = index[0]
+			if (first.year, first.month, first.day, first.hour, first.minute)!=(key.year, key.month, 1, 0, 0):
+				raise ValueError(str(key)+' does not start at the start of its month')
+			ns = index.asi8
+			if (np.diff(ns)!=NS_PER_MINUTE).any():
+				raise ValueError(str(key)+' is not a complete minutely month')
+			minutes[i] = len(index)
+			starts[i] = ns[0]
+
+		timezones = [data[key].index.tz for key in keys]
+		frame_columns = [list(data[key].columns) for key in keys]
+		dtypes = [data[key].dtypes for key in keys]
+		index_name = data[keys[0]].index.name
+
+		# The array is filled one month at a time, so
+		# its memory is only taken up as the months
+		# are copied in (and released)
+		values = np.empty((len(keys), minutes.max(), len(columns)), dtype=dtype)
+		present = np.zeros((len(keys), len(columns)), dtype=bool)
+		for i, key in enumerate(keys):
+			df = data.pop(key) if release else data[key]
+			positions = [column_slot[column] for column in df]
+			values[i] = np.nan
+			values[i][:minutes[i], positions] = df.to_numpy(dtype=dtype)
+			present[i, positions] = True
+			del df
+
+		return cls(keys, columns, values, present, minutes, starts, timezones, frame_columns, dtypes, index_name)
+
+	def __getitem__(self, key):
+		return self.frame(key)
+
+	def __iter__(self):
+		return iter(self.keys_)
+
+	def __len__(self):
+		return len(self.keys_)
+
+	def __contains__(self, key):
+		return key in self.slot
+
+	def keys(self):
+		return list(self.keys_)
+
+	def index(self, key):
+		"""
+		The datetime index of a month
+		"""
+		i = self.slot[key]
+		ns = self.starts[i] + np.arange(self.minutes[i])*NS_PER_MINUTE
+		index = pd.DatetimeIndex(ns.view('datetime64[ns]')).tz_localize('UTC').tz_convert(self.timezones[i])
+		return index.rename(self.index_name)
+
+	def timestamp(self, key, position):
+		"""
+		The timestamp of one row of a month
+		"""
+		i = self.slot[key]
+		ns = int(self.starts[i] + position*NS_PER_MINUTE)
+		return pd.Timestamp(ns, tz='UTC').tz_convert(self.timezones[i])
+
+	def frame(self, key):
+		"""
+		Makes the dataframe of a month, with the
+		columns and dtypes it had when stacked
+		"""
+		i = self.slot[key]
+		columns = self.frame_columns[i]
+		positions = [self.column_slot[column] for column in columns]
+		df = pd.DataFrame(self.values[i, :self.minutes[i]][:, positions], index=self.index(key), columns=columns)
+		changed = [column for column in columns if df[column].dtype!=self.dtypes[i][column]]
+		if changed:
+			df = df.astype({column: self.dtypes[i][column] for column in changed})
+		return df
+
+	def hasColumn(self, key, column):
+		return column in self.column_slot and self.present[self.slot[key], self.column_slot[column]]
+
+	def sample(self, key, column):
+		"""
+		The values of one variable of a month (a
+		view, not a copy). None if the month doesn't
+		have the variable
+		"""
+		if not self.hasColumn(key, column):
+			return None
+		i = self.slot[key]
+		return self.values[i, :self.minutes[i], self.column_slot[column]]
+
+	def longTermSample(self, column):
+		"""
+		Joins one variable of all months into a single
+		long-term sample. Months without the variable
+		add NaNs
+		Raises KeyError if no month has the variable
+		"""
+		if column not in self.column_slot or not self.present[:, self.column_slot[column]].any():
+			raise KeyError(column)
+		j = self.column_slot[column]
+		return np.concatenate([self.values[i, :self.minutes[i], j] for i in range(len(self.keys_))])
+
+	def gapDays(self, key):
+		"""
+		Same as tmy.polish.gapDays for a month of the
+		stack: True for each day (1 to 31, at position
+		day-1) that has missing values, and the number
+		of rows of each day
+		"""
+		i = self.slot[key]
+		days = self.minutes[i]//MINUTES_PER_DAY
+		block = self.values[i, :self.minutes[i]][:, self.present[i]]
+		gaps = np.zeros(31, dtype=bool)
+		gaps[:days] = np.isnan(block.reshape(days, MINUTES_PER_DAY, block.shape[1])).any(axis=(1, 2))
+		rows = np.zeros(31, dtype=np.int64)
+		rows[:days] = MINUTES_PER_DAY
+		return gaps, rows
+
+	def numberOfColumns(self, key):
+		return int(self.present[self.slot[key]].sum())
+
+	def dayRows(self, key, day):
+		"""
+		Minutes of a day of a month
+		"""
+		start = (day-1)*MINUTES_PER_DAY
+		return np.arange(start, min(start+MINUTES_PER_DAY, self.minutes[self.slot[key]]))
+
+	def replaceDay(self, key, other_key, day):
+		"""
+		Replaces a day of a month with the same day
+		of another month. Variables are matched by
+		name, as months can have them in different
+		orders
+		Raises ValueError if the other month doesn't
+		have all variables of the month
+		"""
+		i = self.slot[key]
+		o = self.slot[other_key]
+		rows = self.dayRows(key, day)
+		columns = np.flatnonzero(self.present[i])
+		if not self.present[o, columns].all():
+			raise ValueError(str(other_key)+' does not have all variables of '+str(key))
+		self.values[i][rows[0]:rows[-1]+1, columns] = self.values[o][rows[0]:rows[-1]+1, columns]
@@ -0,0 +1,291 @@
+import os
+import json
+import logging
+import collections
+import collections.abc
+import numpy as np
+import fs_stats
+
+from . import polish
+
+# Default size of the cache of the samples of
+# month summaries (see low-memory-mb in the
+# processing block of config.yml)
+SAMPLES_CACHE_MB = 256
+
+class MemoryCache:
+	"""
+	Least recently used cache of arrays (or tuples
+	of arrays), that holds at most max_mb of them.
+	The least recently used entries are dropped
+	first, and made again when they are needed.
+	An entry larger than max_mb is still kept, on
+	its own
+
+	peak_bytes - the most the cache has held
+	"""
+
+	def __init__(self, max_mb):
+		self.entries = collections.OrderedDict()
+		self.nbytes = 0
+		self.peak_bytes = 0
+		self.max_bytes = max_mb*1024**2
+
+	def get(self, key, make):
+		"""
+		The entry of key, made with make() if it
+		isn't cached
+		"""
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+		value = make()
+		self.entries[key] = value
+		self.nbytes += entryBytes(value)
+		while self.nbytes>self.max_bytes and len(self.entries)>1:
+			dropped_key, dropped = self.entries.popitem(last=False)
+			self.nbytes -= entryBytes(dropped)
+		self.peak_bytes = max(self.peak_bytes, self.nbytes)
+		return value
+
+def entryBytes(value):
+	"""
+	Memory of the arrays of a cache entry
+	"""
+	if isinstance(value, np.ndarray):
+		return value.nbytes
+	if isinstance(value, dict):
+		value = value.values()
+	if isinstance(value, (tuple, list, collections.abc.ValuesView)):
+		return sum(entryBytes(x) for x in value)
+	return 0
+
+class SavedSamples(collections.abc.Mapping):
+	"""
+	The sorted samples of a month summary saved
+	with save(), read from its file when they are
+	needed and kept in a MemoryCache (variable ->
+	sorted sample, like MonthSummary.samples)
+	"""
+
+	def __init__(self, path, sizes, cache):
+		self.path = path
+		self.sizes = sizes
+		self.cache = cache
+
+	def __getitem__(self, variable):
+		if variable not in self.sizes:
+			raise KeyError(variable)
+		return self.cache.get((self.path, variable), lambda: self.read(variable))
+
+	def read(self, variable):
+		i = list(self.sizes).index(variable)
+		with np.load(self.path, allow_pickle=False) as bundle:
+			return bundle['sample_'+str(i)], self.sizes[variable]
+
+	def __iter__(self):
+		return iter(self.sizes)
+
+	def __len__(self):
+		return len(self.sizes)
+
+	def __contains__(self, variable):
+		return variable in self.sizes
+
+class MonthSummary:
+	"""
+	Everything the ranking of a calendar month
+	needs to know about one month, so the month's
+	dataframe doesn't have to be kept in memory
+	(see low-memory in the processing block of
+	config.yml)
+
+	The samples keep every value of the scored
+	variables (8 bytes per minute and variable).
+	Once the summary is saved, release() drops
+	them, and they are read back from the file
+	through a MemoryCache when they are needed, so
+	the memory of the samples of all months is
+	capped by the cache
+
+	samples - variable -> sorted sample of the
+		month (fs_stats.sortedSample), for the
+		scored variables the month has (a dict, or
+		SavedSamples once released)
+	measured - variable -> number of values of
+		the sample that aren't NaN
+	rows - number of rows of the month
+	wind_speed_sum, wind_speed_count - sum and
+		number of the wind-speed values (None if
+		the month doesn't have wind-speed)
+	gap_days - tmy.polish.gapDays of the month
+	columns - number of columns of the month
+	variables - the variables it was made for
+	coarse - variable -> sorted sample of the means
+		of blocks of coarse_resolution minutes (see
+		coarseSample), for the pre-ranking. Empty if
+		coarse_resolution is None
+	"""
+
+	def __init__(self, df, month, variables, coarse_resolution=None):
+		self.variables = list(variables)
+		self.samples = {}
+		self.coarse = {}
+		self.coarse_resolution = coarse_resolution
+		for v in variables:
+			if v in df:
+				self.samples[v] = fs_stats.sortedSample(df[v].values)
+				if coarse_resolution is not None:
+					self.coarse[v] = fs_stats.sortedSample(coarseSample(df[v].values, coarse_resolution))
+		self.measured = {v: len(sample[0]) for v, sample in self.samples.items()}
+		self.rows = len(df)
+
+		self.wind_speed_sum = None
+		self.wind_speed_count = None
+		if 'wind-speed' in df:
+			self.wind_speed_sum = float(df['wind-speed'].sum())
+			self.wind_speed_count = int(df['wind-speed'].count())
+
+		self.gap_days = polish.gapDays(df, month)
+		self.columns = df.shape[1]
+
+	def release(self, path, cache):
+		"""
+		Drops the samples, which are then read from
+		the summary saved at path (see save) through
+		cache
+		"""
+		self.samples = SavedSamples(path, {v: sample[1] for v, sample in self.samples.items()}, cache)
+
+	def sampleSize(self, variable):
+		"""
+		Size of the sample of a variable, including
+		NaNs (the rows of the month if it doesn't
+		have the variable)
+		"""
+		if variable in self.samples:
+			return self.samples.sizes[variable] if isinstance(self.samples, SavedSamples) else self.samples[variable][1]
+		return self.rows
+
+	def windSpeedMean(self):
+		if not self.wind_speed_count:
+			return np.nan
+		return self.wind_speed_sum/self.wind_speed_count
+
+	def nbytes(self):
+		"""
+		Approximate memory used by the summary (not
+		counting released samples)
+		"""
+		samples = list(self.coarse.values())
+		if not isinstance(self.samples, SavedSamples):
+			samples += list(self.samples.values())
+		return sum(sample[0].nbytes for sample in samples) + sum(x.nbytes for x in self.gap_days)
+
+def samplesCache(summaries):
+	"""
+	The MemoryCache that the released samples of a
+	dictionary of summaries are read through (None
+	if none is released)
+	"""
+	for month_summary in summaries.values():
+		if isinstance(month_summary.samples, SavedSamples):
+			return month_summary.samples.cache
+	return None
+
+def coarseSample(values, resolution):
+	"""
+	Means of the blocks of resolution minutes of a
+	minutely sample (e.g. hourly means for 60).
+	Missing values are left out of the means, and
+	blocks without any values are NaN
+	"""
+	blocks = -(-len(values)//resolution)
+	padded = np.full(blocks*resolution, np.nan)
+	padded[:len(values)] = values
+	padded = padded.reshape(blocks, resolution)
+	counts = (~np.isnan(padded)).sum(axis=1)
+	sums = np.nansum(padded, axis=1)
+	means = np.full(blocks, np.nan)
+	np.divide(sums, counts, out=means, where=counts>0)
+	return means
+
+def summaryPath(preprocesspath, name):
+	return os.path.normpath(preprocesspath+'/'+name+'.summary.npz')
+
+def save(summary, preprocesspath, name, tag):
+	"""
+	Saves the summary of a cached month next to it,
+	so later runs don't have to load the month to
+	rank it (see onetmy.processMonth)
+
+	tag - text that load() has to be given to use
+		the summary again (e.g. the hash of the
+		month's manifest fingerprint)
+	"""
+	path = summaryPath(preprocesspath, name)
+	metadata = {
+		'tag': tag,
+		'variables': summary.variables,
+		'sizes': {v: int(sample[1]) for v, sample in summary.samples.items()},
+		'measured': summary.measured,
+		'rows': summary.rows,
+		'wind-speed-sum': summary.wind_speed_sum,
+		'wind-speed-count': summary.wind_speed_count,
+		'columns': summary.columns,
+		'coarse-resolution': summary.coarse_resolution,
+		'coarse-sizes': {v: int(sample[1]) for v, sample in summary.coarse.items()},
+	}
+	arrays = {'metadata': np.array(json.dumps(metadata)), 'gaps': summary.gap_days[0], 'gap-rows': summary.gap_days[1]}
+	for i, v in enumerate(summary.samples):
+		arrays['sample_'+str(i)] = summary.samples[v][0]
+	for i, v in enumerate(summary.coarse):
+		arrays['coarse_'+str(i)] = summary.coarse[v][0]
+
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tmp_path = path+'.tmp'
+	with open(tmp_path, 'wb') as f:
+		np.savez(f, **arrays)
+	os.replace(tmp_path, path)
+
+def load(preprocesspath, name, variables, tag, coarse_resolution=None, cache=None):
+	"""
+	Loads the summary of a month saved with save()
+	Returns None if there isn't one, or if it was
+	saved with another tag, other variables or
+	another coarse resolution
+
+	cache - optional MemoryCache. The samples are
+		then read when they are needed (see
+		MonthSummary.release), instead of now
+	"""
+	path = summaryPath(preprocesspath, name)
+	if not os.path.exists(path):
+		return None
+	try:
+		with np.load(path, allow_pickle=False) as bundle:
+			metadata = json.loads(str(bundle['metadata']))
+			if metadata['tag']!=tag or metadata['variables']!=list(variables):
+				return None
+			if metadata.get('coarse-resolution')!=coarse_resolution:
+				return None
+			summary = MonthSummary.__new__(MonthSummary)
+			summary.variables = metadata['variables']
+			if cache is None:
+				summary.samples = {v: (bundle['sample_'+str(i)], size) for i, (v, size) in enumerate(metadata['sizes'].items())}
+			else:
+				summary.samples = SavedSamples(path, metadata['sizes'], cache)
+			summary.measured = metadata['measured']
+			summary.coarse_resolution = coarse_resolution
+			summary.coarse = {v: (bundle['coarse_'+str(i)], size) for i, (v, size) in enumerate(metadata.get('coarse-sizes', {}).items())}
+			summary.gap_days = (bundle['gaps'], bundle['gap-rows'])
+	except (OSError, ValueError, KeyError):
+		logging.warning('Could not read month summary '+path)
+		return None
+
+	summary.rows = metadata['rows']
+	summary.wind_speed_sum = metadata['wind-speed-sum']
+	summary.wind_speed_count = metadata['wind-speed-count']
+	summary.columns = metadata['columns']
+	return summary
@@ -0,0 +1,134 @@
+import numpy as np
+import fs_stats
+
+from .summary import MemoryCache
+
+# Default size of the cache of counts of
+# SharedStatistics
+COUNTS_CACHE_MB = 256
+
+class SharedStatistics:
+	"""
+	FS inputs of all years of a calendar month,
+	shared by the TMYs of several windows of years
+	(see onetmy.processWindows), and by the
+	rankings of low-memory mode
+
+	The long-term sample of a window is never
+	sorted. The values of each year below each
+	unique value of a candidate are counted once
+	(numpy.searchsorted on the year's sorted
+	sample), and a window adds up the counts of its
+	years. The histogram sketches of the
+	approximate FS engine are also made once for
+	each year, and merged for each window
+
+	There is an array of counts for every pair of
+	years and variable, as long as the candidate's
+	sample, so the counts (and the unique values
+	and sketches) are kept in a least recently
+	used cache of max_counts_mb. Those that were
+	dropped are made again when needed.
+	Neighbouring windows share most of their
+	years, so the counts of the last window are
+	the ones that are used again
+
+	summaries - month key -> tmy.summary.MonthSummary
+	max_counts_mb - size of the cache of counts
+		(default COUNTS_CACHE_MB)
+	"""
+
+	def __init__(self, summaries, max_counts_mb=None):
+		self.summaries = summaries
+		self.cache = MemoryCache(COUNTS_CACHE_MB if max_counts_mb is None else max_counts_mb)
+
+	def sample(self, key, variable):
+		"""
+		Sorted sample of a variable of a month. None
+		if the month doesn't have the variable
+		"""
+		return self.summaries[key].samples.get(variable)
+
+	def sketch(self, key, variable, bin_width):
+		"""
+		fs_stats.histogramSketch of a variable of a
+		month
+		"""
+		return self.cache.get(('sketch', key, variable, bin_width),
+			lambda: fs_stats.histogramSketch(self.sample(key, variable), bin_width))
+
+	def candidate(self, key, variable):
+		"""
+		Unique values of a variable of a month, and
+		the number of the month's values below each
+		"""
+		return self.cache.get(('candidate', key, variable),
+			lambda: np.unique(self.sample(key, variable)[0], return_index=True))
+
+	def below(self, key, other, variable):
+		"""
+		Number of values of month other below each
+		unique value of month key
+		"""
+		def count():
+			unique, candidate_below = self.candidate(key, variable)
+			return np.searchsorted(self.sample(other, variable)[0], unique, side='left').astype(np.int32)
+		return self.cache.get(('below', key, other, variable), count)
+
+	def exactFs(self, keys, key, variable):
+		"""
+		FS statistic of a variable of month key
+		against the long-term sample of the months
+		keys (the same as fs_stats.calculateFSSorted)
+		None if month key doesn't have the variable
+		"""
+		summary = self.summaries[key]
+		if variable not in summary.samples:
+			return None
+
+		months = [k for k in keys if variable in self.summaries[k].samples]
+		lt_size = sum(self.summaries[k].sampleSize(variable) for k in keys)
+		lt_measured = sum(self.summaries[k].measured[variable] for k in months)
+		lt_below = np.zeros(len(self.candidate(key, variable)[0]), dtype=np.int64)
+		for k in months:
+			lt_below += self.below(key, k, variable)
+
+		unique, candidate_below = self.candidate(key, variable)
+		return fs_stats.calculateFSFromCounts(lt_below, lt_measured, lt_size,
+			candidate_below, summary.measured[variable], summary.sampleSize(variable))
+
+def periods(spec, years):
+	"""
+	The windows of years of a windows setting (see
+	the tmy block of config.yml)
+	Returns a list of (first year, last year)
+	Raises ValueError if the setting isn't valid
+
+	spec - list of periods ("2000-2014" or [2000,
+		2014]), or a dictionary with the length and
+		step (in years) of rolling windows over
+		years
+	years - the years that have data
+	"""
+	if not spec:
+		return []
+
+	if isinstance(spec, dict):
+		length = int(spec.get('length', 0))
+		step = int(spec.get('step', 1))
+		if length<1 or step<1:
+			raise ValueError('Rolling windows need a positive length and step')
+		return [(first, first+length-1) for first in range(min(years), max(years)-length+2, step)]
+
+	result = []
+	for period in spec:
+		if isinstance(period, str):
+			period = period.split('-')
+		try:
+			first, last = [int(x) for x in period]
+		except (TypeError, ValueError):
+			raise ValueError('"'+str(period)+'" is not a period of years (e.g. 2000-2014)')
+		if last<first:
+			raise ValueError('Period '+str(first)+'-'+str(last)+' ends before it starts')
+		result.append((first, last))
+	return result
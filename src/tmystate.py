@@ -0,0 +1,137 @@
+"""
+State of the TMY of a station, so it can be updated
+one calendar month at a time when new months of
+data arrive (see onetmy.updateStation)
+
+For each calendar month it keeps the winning month
+after the final gap replace step (cached like the
+gap-filled months, as <station>_tmy_<MM>), and
+<station>_tmy.json records the winner and the
+fingerprint (see manifest.py) of every month it
+was chosen from. A calendar month only has to be
+decided again if one of its months is new, changed
+or gone, or if the tmy block of config.yml changed
+"""
+
+import os
+import json
+import logging
+import datetime
+
+from config_parse import CONFIG
+
+import manifest
+import monthcache
+
+def statePath(preprocesspath, station):
+    return os.path.normpath(preprocesspath+'/'+station+'_tmy.json')
+
+def winnerName(station, month_no):
+    return station+'_tmy_{:02d}'.format(month_no)
+
+def tmyConfig():
+    """
+    Hash of the tmy block of config.yml, which
+    changes the winners of every calendar month
+    """
+    return manifest.hashJson(CONFIG['tmy'])
+
+def monthFingerprints(station, paths):
+    """
+    Hash of the fingerprint of each month of a
+    calendar month
+
+    paths - dictionary of month key -> source files
+    """
+    return {key.isoformat(): manifest.hashJson(manifest.fingerprint(station, paths[key])) for key in sorted(paths)}
+
+def load(preprocesspath, station):
+    """
+    Loads the state of the TMY of a station.
+    Returns None if there isn't one (or it can't
+    be read)
+    """
+    path = statePath(preprocesspath, station)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logging.warning('Could not read TMY state '+path)
+        return None
+
+def record(preprocesspath, station, paths_subsets, tmy_months, state=None):
+    """
+    Saves the winners of calendar months, and
+    updates the state of the TMY of the station
+
+    paths_subsets - dictionary of calendar month
+        number -> paths dictionary of that month
+    tmy_months - dictionary of the winning month
+        keys -> dataframes, of the calendar months
+        to record
+    state - state to update (e.g. from load()).
+        Starts a new one if None
+    """
+
+    if state is None or state.get('tmy-config')!=tmyConfig():
+        state = {'tmy-config': tmyConfig(), 'calendar-months': {}}
+
+    for key, df in tmy_months.items():
+        monthcache.save(df, preprocesspath, winnerName(station, key.month), csv_copy=False)
+        state['calendar-months']['{:02d}'.format(key.month)] = {
+            'winner': key.isoformat(),
+            'months': monthFingerprints(station, paths_subsets[key.month]),
+        }
+    state['updated'] = datetime.datetime.now().isoformat(timespec='seconds')
+
+    path = statePath(preprocesspath, station)
+    tmp_path = path+'.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+    return state
+
+def changedCalendarMonths(state, station, paths_subsets):
+    """
+    Finds the calendar months that have to be
+    decided again: one of their months is new,
+    changed or gone, they have no winner yet, or
+    the tmy block of config.yml changed
+    Returns a list of calendar month numbers
+    """
+
+    if state.get('tmy-config')!=tmyConfig():
+        logging.info('The tmy block of config.yml changed. Deciding all calendar months again')
+        return sorted(paths_subsets)
+
+    changed = []
+    for month_no in sorted(paths_subsets):
+        entry = state['calendar-months'].get('{:02d}'.format(month_no))
+        if entry is None:
+            logging.info('Calendar month '+str(month_no)+' has no winner yet')
+            changed.append(month_no)
+            continue
+        fingerprints = monthFingerprints(station, paths_subsets[month_no])
+        if fingerprints!=entry['months']:
+            new = sorted(set(fingerprints)-set(entry['months']))
+            gone = sorted(set(entry['months'])-set(fingerprints))
+            modified = sorted(key for key in fingerprints if key in entry['months'] and fingerprints[key]!=entry['months'][key])
+            logging.info('Calendar month %d changed: %d new, %d changed and %d removed months', month_no, len(new), len(modified), len(gone))
+            changed.append(month_no)
+    return changed
+
+def loadWinner(preprocesspath, station, state, month_no):
+    """
+    Loads the recorded winner of a calendar month
+    Returns its key and dataframe, or None, None if
+    it isn't recorded
+    """
+    entry = state['calendar-months'].get('{:02d}'.format(month_no))
+    if entry is None:
+        return None, None
+    df = monthcache.load(preprocesspath, winnerName(station, month_no))
+    if df is None:
+        return None, None
+    return datetime.datetime.fromisoformat(entry['winner']), df
@@ -2,6 +2,13 @@ import logging
 import datetime
 from config_parse import CONFIG
 
+# A month is skipped if a required column has less
+# than this share of data (see removePatchyColumns)
+COLUMN_REQUIREMENT = 0.7
+# or if less than this share of its data is left
+# after logical filling (see fill.fill)
+DATA_REQUIREMENT = 0.9
+
 def month(dates, required_n):
     """
     Checks to see if we have enough years for this
@@ -86,16 +93,10 @@ def removePatchyColumns(df, required_percentage):
 
 def requiredColumns(df):
     """
-    Checks that a dataframe has all of
-    the columns listed in list_of_cols
+    Checks that a dataframe has all of the
+    columns in tmy.required-columns of config.yml
+    (e.g. mean-ghi, mean-dni, mean-dhi, air-temp,
+    relative-humidity, wind-speed)
     Returns a bool
-    Required you to initialise the global
-    list of required columns
     """
-    global required_cols
-    return set(required_cols).issubset(df.columns)
-
-"""required_cols = ['mean-ghi', 'mean-dni', 'mean-dhi',
-    'air-temp', 'relative-humidity', 'wind-speed']
-"""
-required_cols = CONFIG['tmy']['required-columns']
+    return set(CONFIG['tmy']['required-columns']).issubset(df.columns)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules of OneTMY are in src/, and read
+# src/config.yml
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC)
+os.environ.setdefault('ONETMY_CONFIG', os.path.join(SRC, 'config.yml'))
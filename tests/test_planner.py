@@ -0,0 +1,32 @@
+import planner
+
+IRRADIANCE = planner.LOGICAL_FILL_COLUMNS
+
+def scan(irradiance, air_temp, day):
+    """
+    Scan of a month whose irradiance columns have a
+    share irradiance of the minutes, and whose
+    logical filling fills the share 1-day
+    """
+    available = {column: irradiance for column in IRRADIANCE}
+    available['air-temp'] = air_temp
+    return {'available': available, 'day': day}
+
+def test_gaps_that_can_be_at_night_are_doubtful():
+    # 29% of the irradiance is missing and 30% of
+    # the month is night. Spread evenly, the gaps
+    # leave less than 85% of the data, but if they
+    # are at night (e.g. a logger that is switched
+    # off at night), logical filling fills them all
+    month = scan(0.71, 1.0, 0.7)
+    assert planner.estimate(month)[1] < 0.85
+    assert planner.estimate(month, night_gaps=True)[1] == 1.0
+    assert planner.monthStatus(month, 0.05) == 'doubtful'
+
+def test_gaps_too_large_for_the_night_are_short():
+    month = scan(0.71, 0.71, 0.9)
+    assert planner.estimate(month, night_gaps=True)[1] < 0.85
+    assert planner.monthStatus(month, 0.05) == 'short'
+
+def test_complete_month_is_ok():
+    assert planner.monthStatus(scan(1.0, 1.0, 0.5), 0.05) == 'ok'
@@ -0,0 +1,65 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytz
+import pytest
+
+import tmy
+import timetools
+
+TIMEZONE = pytz.FixedOffset(600)
+
+def month(year, columns, gap_days=()):
+    """
+    February of a year, with every value of a column
+    set to its position plus the year/10000, and
+    the whole of gap_days missing
+    """
+    index = timetools.generateTimeseries(year, 2, TIMEZONE, df_type=False)
+    df = pd.DataFrame({column: np.full(len(index), columns.index(column)+year/10000) for column in columns}, index=index)
+    for day in gap_days:
+        df.loc[df.index.day==day] = np.nan
+    return df
+
+def key(year):
+    return datetime.datetime(year, 2, 1)
+
+@pytest.mark.parametrize('stacked', [False, True])
+def test_replacement_days_are_copied_by_column_name(stacked):
+    data = {
+        key(2001): month(2001, ['mean-ghi', 'air-temp'], gap_days=[2]),
+        key(2002): month(2002, ['air-temp', 'mean-ghi']),
+    }
+    if stacked:
+        data = tmy.MonthStack.fromDict(data)
+
+    replaced = {}
+    wkey, wdf = tmy.polish.fillRemainingGaps(data, [key(2001), key(2002)], [], replaced=replaced)
+
+    assert replaced=={2: key(2002)}
+    day = wdf[wdf.index.day==2]
+    # The values of each column, not of the column
+    # in the same position
+    assert (day['mean-ghi']==1+0.2002).all()
+    assert (day['air-temp']==0+0.2002).all()
+    assert (wdf[wdf.index.day==3]['mean-ghi']==0+0.2001).all()
+
+@pytest.mark.parametrize('stacked', [False, True])
+def test_extended_candidates_need_their_own_shape_of_day(stacked):
+    columns = ['mean-ghi', 'air-temp']
+    data = {
+        key(2001): month(2001, columns, gap_days=[2]),
+        key(2002): month(2002, columns, gap_days=[2]),
+        # Complete, but without air-temp
+        key(2003): month(2003, ['mean-ghi']),
+        key(2004): month(2004, columns),
+    }
+    if stacked:
+        data = tmy.MonthStack.fromDict(data)
+
+    replaced = {}
+    wkey, wdf = tmy.polish.fillRemainingGaps(data, [key(2001), key(2002)], [key(2003), key(2004)], replaced=replaced)
+
+    assert replaced=={2: key(2004)}
+    assert not wdf.isnull().values.any()
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+import tmy.summary
+import tmy.windows
+
+VARIABLES = ['mean-ghi', 'mean-dni']
+
+def month(year, seed):
+    """
+    February of a year, with random values and a
+    gap in the first variable
+    """
+    index = pd.date_range(str(year)+'-02-01', periods=28*24*60, freq='min', tz='UTC')
+    values = np.random.default_rng(seed).normal(size=(len(index), len(VARIABLES)))
+    values[100:200, 0] = np.nan
+    return pd.DataFrame(values, index=index, columns=VARIABLES)
+
+def test_memory_cache_holds_at_most_its_cap():
+    cache = tmy.summary.MemoryCache(1)
+    for i in range(10):
+        cache.get(i, lambda: np.zeros(50000))    # 0.4 MB each
+    assert cache.peak_bytes <= 1024**2
+    assert list(cache.entries) == [8, 9]
+
+def test_released_summaries_score_the_same(tmp_path):
+    summaries = {}
+    released = {}
+    cache = tmy.summary.MemoryCache(0.5)
+    for i, year in enumerate(range(2000, 2006)):
+        name = 'station_'+str(year)
+        summaries[year] = tmy.summary.MonthSummary(month(year, i), 2, VARIABLES)
+        tmy.summary.save(summaries[year], str(tmp_path), name, 'tag')
+        released[year] = tmy.summary.load(str(tmp_path), name, VARIABLES, 'tag', cache=cache)
+
+    keys = list(summaries)
+    expected = tmy.windows.SharedStatistics(summaries)
+    bounded = tmy.windows.SharedStatistics(released, 1)
+    for key in keys:
+        for v in VARIABLES:
+            assert bounded.exactFs(keys, key, v) == expected.exactFs(keys, key, v)
+
+    # One sample (0.32 MB) at most on top of the cap
+    assert cache.peak_bytes <= 0.5*1024**2 + 28*24*60*8
+    assert all(x.nbytes() < 1000 for x in released.values())
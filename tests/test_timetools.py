@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytz
+
+import timetools
+
+TIMEZONE = pytz.FixedOffset(600)
+
+def timeseries():
+    return timetools.generateTimeseries(2010, 2, TIMEZONE, df_type=False)
+
+def dataFile(minutes, **columns):
+    times = timeseries()[minutes]
+    return pd.DataFrame(dict(datetime=times, **columns))
+
+def test_duplicate_timestamps_keep_the_first_row():
+    df = dataFile([0, 1, 1, 2], **{'air-temp': [10.0, 11.0, 99.0, 12.0]})
+
+    aligned = timetools.alignAgainstMasterTimeseries([df], timeseries())
+
+    assert len(aligned)==28*1440
+    assert aligned.index.is_unique
+    assert list(aligned['air-temp'].values[:3])==[10.0, 11.0, 12.0]
+    assert np.isnan(aligned['air-temp'].values[3:]).all()
+
+def test_column_in_several_files_fills_the_gaps_of_the_first():
+    first = dataFile([0, 1, 2], **{'air-temp': [10.0, np.nan, 12.0], 'mean-ghi': [1.0, 2.0, 3.0]})
+    second = dataFile([0, 1, 3], **{'air-temp': [90.0, 91.0, 93.0], 'wind-speed': [4.0, 5.0, 6.0]})
+
+    aligned = timetools.alignAgainstMasterTimeseries([first, second], timeseries())
+
+    # One column each, no _x/_y columns
+    assert list(aligned.columns)==['air-temp', 'mean-ghi', 'wind-speed']
+    # The first file wins, the second only fills its
+    # missing values
+    assert aligned['air-temp'].values[:4].tolist()==[10.0, 91.0, 12.0, 93.0]
+    assert aligned['mean-ghi'].values[:3].tolist()==[1.0, 2.0, 3.0]
+    assert np.isnan(aligned['mean-ghi'].values[3])
+    assert aligned['wind-speed'].values[[0, 1, 3]].tolist()==[4.0, 5.0, 6.0]
+
+def test_rows_outside_the_month_are_dropped():
+    df = dataFile([0, 1], **{'air-temp': [10.0, 11.0]})
+    df.loc[1, 'datetime'] = df.loc[1, 'datetime']-pd.Timedelta(days=1)
+
+    aligned = timetools.alignAgainstMasterTimeseries([df], timeseries())
+
+    assert aligned['air-temp'].values[0]==10.0
+    assert aligned['air-temp'].notna().sum()==1